@@ -4,7 +4,6 @@ import logging
 import re
 import os
 import gc
-from sqlalchemy import create_engine
 
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.schema import MetaData
@@ -14,8 +13,9 @@ from cloudbot.client import Client
 from cloudbot.config import Config
 from cloudbot.reloader import PluginReloader
 from cloudbot.plugin import PluginManager
-from cloudbot.event import Event, CommandEvent, RegexEvent, EventType
-from cloudbot.util import botvars, formatting
+from cloudbot.event import Event, CommandEvent, RegexEvent, UrlEvent, EventType
+from cloudbot.util import botvars, formatting, database, http, async_http, web, links, logwriter, logfiles, logsearch, \
+    history, ratelimit
 from cloudbot.clients.irc import IrcClient
 
 logger = logging.getLogger("cloudbot")
@@ -41,7 +41,13 @@ class CloudBot:
     :type db_engine: sqlalchemy.engine.Engine
     :type db_factory: sqlalchemy.orm.session.sessionmaker
     :type db_session: sqlalchemy.orm.scoping.scoped_session
+    :type db_read_engine: sqlalchemy.engine.Engine
+    :type db_read_factory: sqlalchemy.orm.session.sessionmaker
+    :type db_read_session: sqlalchemy.orm.scoping.scoped_session
     :type db_metadata: sqlalchemy.sql.schema.MetaData
+    :type recent_links: cloudbot.util.links.RecentLinks
+    :type link_previews: cloudbot.util.links.PreviewCache
+    :type history: cloudbot.util.history.HistoryStore
     :type loop: asyncio.events.AbstractEventLoop
     :type stopped_future: asyncio.Future
     :param: stopped_future: Future that will be given a result when the bot has stopped.
@@ -71,6 +77,17 @@ class CloudBot:
         self.config = Config(self)
         logger.debug("Config system initialised.")
 
+        # the config sections which can also be applied while the bot is running, see config.section_reloaders
+        self.configure_http()
+        self.configure_shortener()
+        self.configure_logging()
+        self.configure_ratelimit()
+        self.link_previews = None
+        self.configure_links()
+
+        # recent messages in each channel, shared by all connections
+        self.history = history.create_store(self.config, self.data_dir)
+
         # log developer mode
         if cloudbot.dev_mode.get("plugin_reloading"):
             logger.info("Enabling developer option: plugin reloading.")
@@ -83,9 +100,12 @@ class CloudBot:
 
         # setup db
         db_path = self.config.get('database', 'sqlite:///cloudbot.db')
-        self.db_engine = create_engine(db_path)
+        self.db_engine, self.db_read_engine = database.create_engines(db_path, self.config)
         self.db_factory = sessionmaker(bind=self.db_engine)
         self.db_session = scoped_session(self.db_factory)
+        # read-only sessions, for hooks which only query the database
+        self.db_read_factory = sessionmaker(bind=self.db_read_engine)
+        self.db_read_session = scoped_session(self.db_read_factory)
         self.db_metadata = MetaData()
         # set botvars.metadata so plugins can access when loading
         botvars.metadata = self.db_metadata
@@ -102,6 +122,41 @@ class CloudBot:
 
         self.plugin_manager = PluginManager(self)
 
+    def configure_http(self):
+        """applies the "http" config section to the shared http session and response cache"""
+        http.configure(self.config, self.data_dir)
+
+    def configure_shortener(self):
+        """applies the "shortener_cache" config section"""
+        web.configure(self.config, self.data_dir)
+
+    def configure_logging(self):
+        """applies the "logging" config section to the log writer, log file maintenance and log search"""
+        logwriter.configure(self.config)
+        logfiles.configure(self.config, cloudbot.log_dir,
+                           [clean_name(conf['name']) for conf in self.config.get('connections', [])])
+        logsearch.configure(self.config, self.data_dir)
+
+    def configure_ratelimit(self):
+        """applies the "ratelimit" config section"""
+        ratelimit.configure(self.config)
+
+    def configure_links(self):
+        """applies the "links" config section, replacing the link dedup window and the preview cache"""
+        link_config = self.config.get("links", {})
+        # links handled recently in each channel, so url hooks don't respond to the same link twice
+        self.recent_links = links.RecentLinks(link_config.get("dedup_window", links.DEFAULT_DEDUP_WINDOW))
+        # url hook replies, reused when the same link is posted again
+        if link_config.get("persist_previews", True):
+            preview_path = os.path.join(self.data_dir, "link_previews.db")
+        else:
+            preview_path = None
+        if self.link_previews is not None:
+            self.link_previews.close()
+        self.link_previews = links.PreviewCache(preview_path, link_config.get("preview_cache_size",
+                                                                              links.PREVIEW_CACHE_SIZE),
+                                                link_config.get("preview_ttl", {}))
+
     def run(self):
         """
         Starts CloudBot.
@@ -136,9 +191,8 @@ class CloudBot:
         """quits all networks and shuts the bot down"""
         logger.info("Stopping bot.")
 
-        if cloudbot.dev_mode.get("config_reloading"):
-            logger.debug("Stopping config reloader.")
-            self.config.stop()
+        logger.debug("Stopping config reloader.")
+        yield from self.config.stop()
 
         if cloudbot.dev_mode.get("plugin_reloading"):
             logger.debug("Stopping plugin reloader.")
@@ -160,6 +214,13 @@ class CloudBot:
                 continue
             connection.close()
 
+        async_http.close_idle_connections()
+        self.link_previews.close()
+        logwriter.writer.close()
+        logfiles.stop()
+        logsearch.stop()
+        self.history.close()
+
         self.running = False
         # Give the stopped_future a result, so that run() will exit
         self.stopped_future.set_result(restart)
@@ -253,6 +314,22 @@ class CloudBot:
                     regex_event = RegexEvent(hook=regex_hook, match=match, base_event=event)
                     tasks.append(self.plugin_manager.launch(regex_hook, regex_event))
 
+            # URL hooks, found by host, so the cost depends on the links in the message rather than the hook count
+            if self.plugin_manager.url_hooks:
+                for url in links.find_urls(event.content):
+                    url_hooks = self.plugin_manager.get_url_hooks(links.get_host(url))
+                    if not url_hooks or self.recent_links.seen((event.conn.name, event.chan.lower(), url)):
+                        continue
+                    for url_hook in url_hooks:
+                        if url_hook.pattern is not None:
+                            match = url_hook.pattern.search(url)
+                            if not match:
+                                continue
+                        else:
+                            match = None
+                        url_event = UrlEvent(hook=url_hook, url=url, match=match, base_event=event)
+                        tasks.append(self.plugin_manager.launch(url_hook, url_event))
+
         # Run the tasks
         yield from asyncio.gather(*run_before_tasks, loop=self.loop)
         yield from asyncio.gather(*tasks, loop=self.loop)
@@ -17,7 +17,7 @@ class Client:
     :type config: dict[str, unknown]
     :type nick: str
     :type vars: dict
-    :type history: dict[str, list[tuple]]
+    :type history: cloudbot.util.history.ConnectionHistory
     :type permissions: PermissionManager
     """
 
@@ -46,7 +46,7 @@ class Client:
         else:
             self.config = config
         self.vars = {}
-        self.history = {}
+        self.history = bot.history.for_connection(name)
 
         # create permissions manager
         self.permissions = PermissionManager(self)
@@ -1,5 +1,7 @@
+import asyncio
 import json
 import os
+import threading
 import time
 import sys
 import logging
@@ -11,6 +13,21 @@ import cloudbot
 
 logger = logging.getLogger("cloudbot")
 
+# seconds to wait after a change before saving the config, so a burst of changes is written to the file once
+SAVE_DELAY = 1.0
+
+# top-level config sections which can be applied without restarting the bot -> the CloudBot method applying them
+section_reloaders = {
+    "http": "configure_http",
+    "shortener_cache": "configure_shortener",
+    "logging": "configure_logging",
+    "ratelimit": "configure_ratelimit",
+    "links": "configure_links",
+}
+
+# top-level config sections which are only read when the bot starts
+restart_sections = ("database", "database_tuning", "history", "plugin_loading", "developer_mode")
+
 
 class Config(dict):
     """
@@ -33,6 +50,14 @@ class Config(dict):
         self.bot = bot
         self.update(*args, **kwargs)
 
+        # the contents of the config file as it was last loaded or saved, so reloads caused by our own saves are skipped
+        self._text = None
+        self._save_handle = None
+        self._write_future = None
+        self._saves = 0
+        self._saves_written = 0
+        self._save_lock = threading.Lock()
+
         # populate self with config data
         self.load_config()
 
@@ -42,17 +67,22 @@ class Config(dict):
 
             pattern = "*{}".format(self.filename)
 
-            self.event_handler = ConfigEventHandler(self.bot, self, patterns=[pattern])
+            self.event_handler = ConfigEventHandler(self.bot, self, patterns=[pattern], ignore_directories=True)
             self.observer.schedule(self.event_handler, path='.', recursive=False)
             self.observer.start()
 
+    @asyncio.coroutine
     def stop(self):
-        """shuts down the config reloader"""
+        """shuts down the config reloader, and saves any unsaved changes"""
         if cloudbot.dev_mode["config_reloading"]:
             self.observer.stop()
+        if self._write_future is not None:
+            # let a save already handed to the executor finish, rather than dropping it
+            yield from asyncio.wait([self._write_future], loop=self.bot.loop)
+        self.flush()
 
     def load_config(self):
-        """(re)loads the bot config from the config file"""
+        """(re)loads the bot config from the config file, and reloads the parts of the bot affected by any changes"""
         if not os.path.exists(self.path):
             # if there is no config, show an error and die
             logger.critical("No config file found, bot shutting down!")
@@ -62,18 +92,153 @@ class Config(dict):
             time.sleep(5)
             sys.exit()
 
-        with open(self.path) as f:
-            self.update(json.load(f))
+        with open(self.path, encoding="utf-8") as f:
+            text = f.read()
+        if text == self._text:
+            # nothing has changed since we last loaded or saved the file
+            return
+
+        if self._text is None:
+            self.update(json.loads(text))
+            self._text = text
             logger.debug("Config loaded from file.")
+            return
+
+        try:
+            data = json.loads(text)
+        except ValueError:
+            logger.exception("Config file is not valid JSON, ignoring the change.")
+            return
+        self._text = text
 
-        # reload permissions
-        if self.bot.connections:
-            for connection in self.bot.connections:
+        changed, changed_connections = self._apply(data)
+        if not changed:
+            return
+        logger.info("Config reloaded, changed sections: {}".format(", ".join(sorted(changed))))
+
+        for section in sorted(changed):
+            reloader = section_reloaders.get(section)
+            if reloader is not None:
+                try:
+                    getattr(self.bot, reloader)()
+                except Exception:
+                    logger.exception("Couldn't apply the changed {} config section".format(section))
+            elif section in restart_sections:
+                logger.warning("Config section {} changed, restart the bot to apply it.".format(section))
+
+        for connection in self.bot.connections:
+            sections = changed_connections.get(connection.config.get("name"), set())
+            if "permissions" in sections:
                 connection.permissions.reload()
+            # plugins which compile parts of a connection's config (ignore lists, acls) notice the replaced sections
+            # by themselves
+
+    def _apply(self, data):
+        """
+        Replaces the config with data, returning the top-level sections which changed, and the changed sections of each
+        connection's config by connection name
+        :type data: dict
+        :rtype: (set[str], dict[str, set[str]])
+        """
+        changed = set()
+        changed_connections = {}
+        for key in set(self) | set(data):
+            if key not in data:
+                del self[key]
+                changed.add(key)
+            elif key == "connections" and key in self:
+                changed_connections = self._apply_connections(data[key])
+                if changed_connections:
+                    changed.add(key)
+            elif self.get(key) != data[key]:
+                self[key] = data[key]
+                changed.add(key)
+        return changed, changed_connections
+
+    def _apply_connections(self, connections):
+        """
+        Updates each connection's config in place, as each client and its permission manager share the dict
+        :type connections: list[dict]
+        :rtype: dict[str, set[str]]
+        """
+        old_connections = {conf.get("name"): conf for conf in self["connections"]}
+        changed = {}
+        merged = []
+        for conf in connections:
+            name = conf.get("name")
+            old_conf = old_connections.pop(name, None)
+            if old_conf is None:
+                logger.info("Connection {} added to the config, it will be connected on restart.".format(name))
+                changed[name] = set(conf)
+                merged.append(conf)
+                continue
+            sections = {key for key in set(old_conf) | set(conf) if old_conf.get(key) != conf.get(key)}
+            if sections:
+                old_conf.clear()
+                old_conf.update(conf)
+                changed[name] = sections
+            merged.append(old_conf)
+        for name in old_connections:
+            logger.info("Connection {} removed from the config, it will be disconnected on restart.".format(name))
+            changed[name] = set()
+
+        if changed or [conf.get("name") for conf in self["connections"]] != [conf.get("name") for conf in merged]:
+            self["connections"][:] = merged
+        return changed
 
     def save_config(self):
-        """saves the contents of the config dict to the config file"""
-        json.dump(self, open(self.path, 'w'), sort_keys=True, indent=4)
+        """
+        Saves the config to the config file soon. Changes made within SAVE_DELAY of each other are saved together, and
+        the file is written from a background thread, replacing the old file only once it's been written in full.
+        """
+        self.bot.loop.call_soon_threadsafe(self._schedule_save)
+
+    def _schedule_save(self):
+        if self._save_handle is None:
+            self._save_handle = self.bot.loop.call_later(SAVE_DELAY, self._save)
+
+    def _save(self):
+        self._save_handle = None
+        self._saves += 1
+        self._write_future = self.bot.loop.run_in_executor(None, self._write, self._saves,
+                                                           json.dumps(self, sort_keys=True, indent=4))
+
+    def flush(self):
+        """saves any changes waiting to be saved right away, and waits for a save already being written to finish"""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+            self._saves += 1
+        if self._saves > self._saves_written:
+            # either the save was waiting on SAVE_DELAY, or it's still queued for the executor
+            self._write(self._saves, json.dumps(self, sort_keys=True, indent=4))
+        else:
+            # taking the lock waits for a write in progress
+            with self._save_lock:
+                pass
+
+    def _write(self, save, text):
+        """
+        :param save: Which save this is, so an older save never overwrites a newer one
+        :type save: int
+        :type text: str
+        """
+        with self._save_lock:
+            if save < self._saves_written or text == self._text:
+                return
+            self._saves_written = save
+            # set before the file is replaced, so the reload it triggers sees it's our own change
+            self._text = text
+            temp_path = self.path + ".tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except OSError:
+                logger.exception("Couldn't save the config to {}".format(self.path))
+                return
         logger.info("Config saved to file.")
 
 
@@ -95,5 +260,6 @@ class ConfigEventHandler(Trick):
 
     def on_any_event(self, event):
         if self.bot.running:
-            logger.info("Config changed, triggering reload.")
-            self.config.load_config()
+            logger.debug("Config file changed, checking for changes.")
+            # reload from the event loop, so the config never changes under a running hook
+            self.bot.loop.call_soon_threadsafe(self.config.load_config)
@@ -32,6 +32,7 @@ class Event:
     :type host: str
     :type mask: str
     :type db: sqlalchemy.orm.Session
+    :type db_read: sqlalchemy.orm.Session
     :type db_executor: concurrent.futures.ThreadPoolExecutor
     :type irc_raw: str
     :type irc_prefix: str
@@ -86,6 +87,7 @@ class Event:
         :type irc_ctcp_text: str
         """
         self.db = None
+        self.db_read = None
         self.db_executor = None
         self.bot = bot
         self.conn = conn
@@ -145,14 +147,21 @@ class Event:
         if self.hook is None:
             raise ValueError("event.hook is required to prepare an event")
 
+        if "db" in self.hook.required_args or "db_read" in self.hook.required_args:
+            # we're running a coroutine hook with a db, so initialise an executor pool
+            self.db_executor = concurrent.futures.ThreadPoolExecutor(1)
+
         if "db" in self.hook.required_args:
             logger.debug("Opening database session for {}:threaded=False".format(self.hook.description))
 
-            # we're running a coroutine hook with a db, so initialise an executor pool
-            self.db_executor = concurrent.futures.ThreadPoolExecutor(1)
             # be sure to initialize the db in the database executor, so it will be accessible in that thread.
             self.db = yield from self.async(self.bot.db_session)
 
+        if "db_read" in self.hook.required_args:
+            logger.debug("Opening read-only database session for {}:threaded=False".format(self.hook.description))
+
+            self.db_read = yield from self.async(self.bot.db_read_session)
+
     def prepare_threaded(self):
         """
         Initializes this event to be run through it's hook
@@ -171,6 +180,11 @@ class Event:
 
             self.db = self.bot.db_session()
 
+        if "db_read" in self.hook.required_args:
+            logger.debug("Opening read-only database session for {}:threaded=True".format(self.hook.description))
+
+            self.db_read = self.bot.db_read_session()
+
     @asyncio.coroutine
     def close(self):
         """
@@ -190,6 +204,11 @@ class Event:
             yield from self.async(self.db.close)
             self.db = None
 
+        if self.db_read is not None:
+            logger.debug("Closing read-only database session for {}:threaded=False".format(self.hook.description))
+            yield from self.async(self.db_read.close)
+            self.db_read = None
+
     def close_threaded(self):
         """
         Closes this event after running it through it's hook.
@@ -206,6 +225,11 @@ class Event:
             self.db.close()
             self.db = None
 
+        if self.db_read is not None:
+            logger.debug("Closing read-only database session for {}:threaded=True".format(self.hook.description))
+            self.db_read.close()
+            self.db_read = None
+
     @property
     def event(self):
         """
@@ -354,6 +378,29 @@ class CommandEvent(Event):
         self.notice(message, target=target)
 
 
+class UrlEvent(Event):
+    """
+    :type hook: cloudbot.plugin.UrlHook
+    :type url: str
+    :type match: re.__Match
+    """
+
+    def __init__(self, *, bot=None, hook, url, match=None, conn=None, base_event=None, event_type=None, content=None,
+                 target=None, channel=None, nick=None, user=None, host=None, mask=None, irc_raw=None, irc_prefix=None,
+                 irc_command=None, irc_paramlist=None):
+        """
+        :param url: The normalized URL which triggered the hook
+        :param match: The match of the hook's pattern against the URL, if it has one
+        :type url: str
+        :type match: re.__Match
+        """
+        super().__init__(bot=bot, conn=conn, hook=hook, base_event=base_event, event_type=event_type, content=content,
+                         target=target, channel=channel, nick=nick, user=user, host=host, mask=mask, irc_raw=irc_raw,
+                         irc_prefix=irc_prefix, irc_command=irc_command, irc_paramlist=irc_paramlist)
+        self.url = url
+        self.match = match
+
+
 class RegexEvent(Event):
     """
     :type hook: cloudbot.plugin.RegexHook
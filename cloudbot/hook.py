@@ -106,6 +106,35 @@ class _RegexHook(_Hook):
                 self.regexes.append(re_to_match)
 
 
+class _UrlHook(_Hook):
+    """
+    :type hosts: set[str]
+    """
+
+    def __init__(self, function):
+        """
+        :type function: function
+        """
+        _Hook.__init__(self, function, "url")
+        self.hosts = set()
+
+    def add_hook(self, hosts_param, kwargs):
+        """
+        :type hosts_param: tuple[str]
+        :type kwargs: dict[str, unknown]
+        """
+        self._add_hook(kwargs)
+
+        if not hosts_param:
+            raise ValueError("@url() hook needs at least one host")
+        for host in hosts_param:
+            host = host.lower()
+            # URLs are normalized before dispatch, which removes any www.
+            if host.startswith("www."):
+                host = host[4:]
+            self.hosts.add(host)
+
+
 class _RawHook(_Hook):
     """
     :type triggers: set[str]
@@ -158,6 +187,30 @@ class _EventHook(_Hook):
             self.types.update(trigger_param)
 
 
+class _MigrationHook(_Hook):
+    """
+    :type version: int
+    """
+
+    def __init__(self, function):
+        """
+        :type function: function
+        """
+        _Hook.__init__(self, function, "migration")
+        self.version = None
+
+    def add_hook(self, version, kwargs):
+        """
+        :type version: int
+        :type kwargs: dict[str, unknown]
+        """
+        self._add_hook(kwargs)
+
+        if not isinstance(version, int) or version < 1:
+            raise ValueError("Invalid migration version {}".format(version))
+        self.version = version
+
+
 def _add_hook(func, hook):
     if not hasattr(func, "_cloudbot_hook"):
         func._cloudbot_hook = {}
@@ -254,6 +307,35 @@ def regex(regex_param, **kwargs):
         return lambda func: _regex_hook(func)
 
 
+def url(*hosts_param, **kwargs):
+    """External url decorator. Must be used as a function to return a decorator.
+
+    The hook is called for links to any of the given hosts (or their subdomains) in messages, with the normalized URL
+    as `url`. If a pattern is given, the hook is only called for URLs it matches, with the match as `match`.
+
+    What the hook returns (a string, or a list of lines) is cached for preview_ttl seconds (0 to turn this off) and
+    repeated when the link is posted again. Anything the hook sends itself, through message(), reply() or notice(), is
+    not cached, so hooks wanting their previews cached should return them.
+    :type hosts_param: str
+    :type pattern: str | re.__Regex
+    :type preview_ttl: int
+    """
+
+    def _url_hook(func):
+        hook = _get_hook(func, "url")
+        if hook is None:
+            hook = _UrlHook(func)
+            _add_hook(func, hook)
+
+        hook.add_hook(hosts_param, kwargs)
+        return func
+
+    if len(hosts_param) == 1 and callable(hosts_param[0]):  # this decorator is being used directly, which isn't good
+        raise TypeError("@url() hook must be used as a function that returns a decorator")
+    else:  # this decorator is being used as a function, so return a decorator
+        return lambda func: _url_hook(func)
+
+
 def sieve(param=None, **kwargs):
     """External sieve decorator. Can be used directly as a decorator, or with args to return a decorator
     :type param: function | None
@@ -295,3 +377,26 @@ def onload(param=None, **kwargs):
         return _onload_hook(param)
     else:
         return lambda func: _onload_hook(func)
+
+
+def migration(version, **kwargs):
+    """External migration decorator. Must be used as a function to return a decorator.
+
+    Migrations are run once per database, in order of version, when the plugin is loaded. The last version applied
+    is recorded, so each migration only ever runs once.
+    :type version: int
+    """
+
+    def _migration_hook(func):
+        hook = _get_hook(func, "migration")
+        if hook is None:
+            hook = _MigrationHook(func)
+            _add_hook(func, hook)
+
+        hook.add_hook(version, kwargs)
+        return func
+
+    if callable(version):  # this decorator is being used directly, which isn't good
+        raise TypeError("@migration() hook must be used as a function that returns a decorator")
+    else:  # this decorator is being used as a function, so return a decorator
+        return lambda func: _migration_hook(func)
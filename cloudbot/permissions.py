@@ -1,6 +1,8 @@
 from fnmatch import fnmatch
 import logging
 
+from cloudbot.util.masks import MaskMatcher
+
 logger = logging.getLogger("cloudbot")
 
 
@@ -12,6 +14,8 @@ class PermissionManager(object):
     :type group_perms: dict[str, list[str]]
     :type group_users: dict[str, list[str]]
     :type perm_users: dict[str, list[str]]
+    :type perm_matchers: dict[str, MaskMatcher]
+    :type group_matchers: dict[str, MaskMatcher]
     """
 
     def __init__(self, conn):
@@ -28,6 +32,8 @@ class PermissionManager(object):
         self.group_perms = {}
         self.group_users = {}
         self.perm_users = {}
+        self.perm_matchers = {}
+        self.group_matchers = {}
 
         self.reload()
 
@@ -58,6 +64,11 @@ class PermissionManager(object):
                     self.perm_users[perm] = []
                 self.perm_users[perm].extend(users)
 
+        # compile each permission's and group's masks, replacing the matchers (and their cached decisions) from
+        # before the reload
+        self.perm_matchers = {perm: MaskMatcher(users) for perm, users in self.perm_users.items()}
+        self.group_matchers = {group: MaskMatcher(users) for group, users in self.group_users.items()}
+
         logger.debug("[{}] Group permissions: {}".format(self.readable_name, self.group_perms))
         logger.debug("[{}] Group users: {}".format(self.readable_name, self.group_users))
         logger.debug("[{}] Permission users: {}".format(self.readable_name, self.perm_users))
@@ -69,17 +80,15 @@ class PermissionManager(object):
         :rtype: bool
         """
 
-        if not perm.lower() in self.perm_users:
+        matcher = self.perm_matchers.get(perm.lower())
+        if matcher is None:
             # no one has access
             return False
 
-        allowed_users = self.perm_users[perm.lower()]
-
-        for allowed_mask in allowed_users:
-            if fnmatch(user_mask.lower(), allowed_mask):
-                if notice:
-                    logger.info("[{}] Allowed user {} access to {}".format(self.readable_name, user_mask, perm))
-                return True
+        if matcher.match(user_mask.lower()):
+            if notice:
+                logger.info("[{}] Allowed user {} access to {}".format(self.readable_name, user_mask, perm))
+            return True
 
         return False
 
@@ -105,25 +114,16 @@ class PermissionManager(object):
         :type user_mask: str
         :rtype: list[str]
         """
-        permissions = set()
-        for permission, users in self.perm_users.items():
-            for mask_to_check in users:
-                if fnmatch(user_mask.lower(), mask_to_check):
-                    permissions.add(permission)
-        return permissions
+        user_mask = user_mask.lower()
+        return {permission for permission, matcher in self.perm_matchers.items() if matcher.match(user_mask)}
 
     def get_user_groups(self, user_mask):
         """
         :type user_mask: str
         :rtype: list[str]
         """
-        groups = []
-        for group, users in self.group_users.items():
-            for mask_to_check in users:
-                if fnmatch(user_mask.lower(), mask_to_check):
-                    groups.append(group)
-                    continue
-        return groups
+        user_mask = user_mask.lower()
+        return [group for group, matcher in self.group_matchers.items() if matcher.match(user_mask)]
 
     def group_exists(self, group):
         """
@@ -140,13 +140,10 @@ class PermissionManager(object):
         :type user_mask: str
         :rtype: bool
         """
-        users = self.group_users.get(group.lower())
-        if not users:
+        matcher = self.group_matchers.get(group.lower())
+        if matcher is None:
             return False
-        for mask_to_check in users:
-            if fnmatch(user_mask.lower(), mask_to_check):
-                return True
-        return False
+        return matcher.match(user_mask.lower())
 
     def remove_group_user(self, group, user_mask):
         """
@@ -7,9 +7,11 @@ import os
 import re
 
 import sqlalchemy
+from sqlalchemy import Table, Column, String, Integer
+from sqlalchemy.sql import select
 
 from cloudbot.event import Event
-from cloudbot.util import botvars
+from cloudbot.util import botvars, http, links
 
 logger = logging.getLogger("cloudbot")
 
@@ -18,7 +20,8 @@ def find_hooks(parent, module):
     """
     :type parent: Plugin
     :type module: object
-    :rtype: (list[CommandHook], list[RegexHook], list[RawHook], list[SieveHook], List[EventHook], list[OnloadHook])
+    :rtype: (list[CommandHook], list[RegexHook], list[RawHook], list[SieveHook], List[EventHook], list[OnloadHook],
+                list[MigrationHook], list[UrlHook])
     """
     # set the loaded flag
     module._cloudbot_loaded = True
@@ -28,7 +31,10 @@ def find_hooks(parent, module):
     sieve = []
     event = []
     onload = []
-    type_lists = {"command": command, "regex": regex, "irc_raw": raw, "sieve": sieve, "event": event, "onload": onload}
+    migration = []
+    url = []
+    type_lists = {"command": command, "regex": regex, "irc_raw": raw, "sieve": sieve, "event": event, "onload": onload,
+                  "migration": migration, "url": url}
     for name, func in module.__dict__.items():
         if hasattr(func, "_cloudbot_hook"):
             # if it has cloudbot hook
@@ -40,7 +46,7 @@ def find_hooks(parent, module):
             # delete the hook to free memory
             del func._cloudbot_hook
 
-    return command, regex, raw, sieve, event, onload
+    return command, regex, raw, sieve, event, onload, migration, url
 
 
 def find_tables(code):
@@ -78,7 +84,9 @@ class PluginManager:
     :type catch_all_triggers: list[RawHook]
     :type event_type_hooks: dict[cloudbot.event.EventType, list[EventHook]]
     :type regex_hooks: list[(re.__Regex, RegexHook)]
+    :type url_hooks: dict[str, list[UrlHook]]
     :type sieves: list[SieveHook]
+    :type migration_table: sqlalchemy.Table
     """
 
     def __init__(self, bot):
@@ -94,9 +102,18 @@ class PluginManager:
         self.catch_all_triggers = []
         self.event_type_hooks = {}
         self.regex_hooks = []
+        self.url_hooks = {}
         self.sieves = []
         self._hook_waiting_queues = {}
 
+        # bookkeeping for plugin migrations, plugin title -> last applied migration version
+        self.migration_table = Table(
+            "plugin_migrations",
+            bot.db_metadata,
+            Column("plugin", String, primary_key=True),
+            Column("version", Integer)
+        )
+
     @asyncio.coroutine
     def load_all(self, plugin_dir):
         """
@@ -106,6 +123,9 @@ class PluginManager:
 
         :type plugin_dir: str
         """
+        if not (yield from self.bot.loop.run_in_executor(None, self.migration_table.exists, self.bot.db_engine)):
+            yield from self.bot.loop.run_in_executor(None, self.migration_table.create, self.bot.db_engine)
+
         path_list = glob.iglob(os.path.join(plugin_dir, '*.py'))
         # Load plugins asynchronously :O
         yield from asyncio.gather(*[self.load_plugin(path) for path in path_list], loop=self.bot.loop)
@@ -157,6 +177,14 @@ class PluginManager:
         # create database tables
         yield from plugin.create_tables(self.bot)
 
+        # apply any migrations which haven't been applied to this database yet
+        if not (yield from self._migrate(plugin)):
+            logger.warning("Not registering hooks from plugin {}: migration errored".format(plugin.title))
+
+            # unregister databases
+            plugin.unregister_tables(self.bot)
+            return
+
         # run onload hooks
         for onload_hook in plugin.run_on_load:
             success = yield from self.launch(onload_hook, Event(bot=self.bot, hook=onload_hook))
@@ -207,6 +235,15 @@ class PluginManager:
                 self.regex_hooks.append((regex_match, regex_hook))
             self._log_hook(regex_hook)
 
+        # register url hooks
+        for url_hook in plugin.url_hooks:
+            for host in url_hook.hosts:
+                if host in self.url_hooks:
+                    self.url_hooks[host].append(url_hook)
+                else:
+                    self.url_hooks[host] = [url_hook]
+            self._log_hook(url_hook)
+
         # register sieves
         for sieve_hook in plugin.sieves:
             self.sieves.append(sieve_hook)
@@ -269,6 +306,14 @@ class PluginManager:
             for regex_match in regex_hook.regexes:
                 self.regex_hooks.remove((regex_match, regex_hook))
 
+        # unregister url hooks
+        for url_hook in plugin.url_hooks:
+            for host in url_hook.hosts:
+                assert host in self.url_hooks  # this can't be not true
+                self.url_hooks[host].remove(url_hook)
+                if not self.url_hooks[host]:  # if that was the last hook for this host
+                    del self.url_hooks[host]
+
         # unregister sieves
         for sieve_hook in plugin.sieves:
             self.sieves.remove(sieve_hook)
@@ -284,6 +329,74 @@ class PluginManager:
 
         return True
 
+    def get_url_hooks(self, host):
+        """
+        Returns the url hooks registered for the given host, or for any domain it's a subdomain of
+
+        :type host: str
+        :rtype: list[UrlHook]
+        """
+        found = []
+        for domain in links.parent_domains(host):
+            for url_hook in self.url_hooks.get(domain, ()):
+                if url_hook not in found:
+                    found.append(url_hook)
+        return found
+
+    def _get_migration_version(self, plugin):
+        """
+        Returns the version of the last migration applied for the given plugin, or 0 if none have been applied
+
+        :type plugin: Plugin
+        :rtype: int
+        """
+        query = select([self.migration_table.c.version]).where(self.migration_table.c.plugin == plugin.title)
+        row = self.bot.db_engine.execute(query).fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    def _set_migration_version(self, plugin, version):
+        """
+        :type plugin: Plugin
+        :type version: int
+        """
+        table = self.migration_table
+        with self.bot.db_engine.begin() as connection:
+            updated = connection.execute(table.update().values(version=version).where(table.c.plugin == plugin.title))
+            if not updated.rowcount:
+                connection.execute(table.insert().values(plugin=plugin.title, version=version))
+
+    @asyncio.coroutine
+    def _migrate(self, plugin):
+        """
+        Runs all migrations from the given plugin which haven't been applied yet, in order of version.
+
+        Returns False if a migration errored, True otherwise.
+
+        :type plugin: Plugin
+        :rtype: bool
+        """
+        if not plugin.migrations:
+            return True
+
+        current_version = yield from self.bot.loop.run_in_executor(None, self._get_migration_version, plugin)
+
+        for migration_hook in plugin.migrations:
+            if migration_hook.version <= current_version:
+                continue
+
+            logger.info("Applying migration {} for {}".format(migration_hook.version, plugin.title))
+            success = yield from self.launch(migration_hook, Event(bot=self.bot, hook=migration_hook))
+            if not success:
+                return False
+
+            yield from self.bot.loop.run_in_executor(None, self._set_migration_version, plugin,
+                                                     migration_hook.version)
+            current_version = migration_hook.version
+
+        return True
+
     def _log_hook(self, hook):
         """
         Logs registering a given hook
@@ -358,6 +471,21 @@ class PluginManager:
         :type event: cloudbot.event.Event
         :rtype: bool
         """
+        preview_key = None
+        if hook.type == "url" and hook.preview_ttl:
+            # reuse this hook's reply from the last time someone posted this link
+            previews = self.bot.link_previews
+            preview_key = "{}|{}".format(hook.description, event.url)
+            host = links.get_host(event.url)
+            preview = previews.get(preview_key)
+            if preview is None and previews.persistent:
+                # the database is on disk, so read it without blocking the other connections
+                preview = yield from self.bot.loop.run_in_executor(None, previews.load, preview_key)
+            previews.record(host, preview is not None)
+            if preview is not None:
+                self._reply(event, preview)
+                return True
+
         try:
             # _internal_run_threaded and _internal_run_coroutine prepare the database, and run the hook.
             # _internal_run_* will prepare parameters and the database session, but won't do any error catching.
@@ -365,20 +493,38 @@ class PluginManager:
                 out = yield from self.bot.loop.run_in_executor(None, self._execute_hook_threaded, hook, event)
             else:
                 out = yield from self._execute_hook_sync(hook, event)
+        except http.ServiceUnavailable as e:
+            # a service the hook relies on is down, and its circuit breaker is failing requests fast
+            logger.debug("Hook {} skipped: {}".format(hook.description, e))
+            if hook.type == "command":
+                event.reply(str(e))
+            return False
         except Exception:
             logger.exception("Error in hook {}".format(hook.description))
             return False
 
         if out is not None:
-            # if there are multiple items in the response, return them on multiple lines
             if isinstance(out, (list, tuple)):
-                event.reply(out[0])
-                for line in out[1:]:
-                    event.message(line)
+                lines = [str(line) for line in out]
             else:
-                event.reply(str(out))
+                lines = [str(out)]
+            if preview_key is not None and lines:
+                self.bot.link_previews.put(preview_key, lines, self.bot.link_previews.get_ttl(host, hook.preview_ttl))
+            self._reply(event, lines)
         return True
 
+    @staticmethod
+    def _reply(event, lines):
+        """
+        Sends a hook's reply, replying with the first line and sending the rest as messages
+        :type event: cloudbot.event.Event
+        :type lines: collections.Sequence[str]
+        """
+        if lines:
+            event.reply(lines[0])
+            for line in lines[1:]:
+                event.message(line)
+
     @asyncio.coroutine
     def _sieve(self, sieve, event, hook):
         """
@@ -409,12 +555,16 @@ class PluginManager:
         :type hook: cloudbot.plugin.Hook | cloudbot.plugin.CommandHook
         :rtype: bool
         """
-        if hook.type != "onload":  # we don't need sieves on onload hooks.
+        if hook.type not in ("onload", "migration"):  # we don't need sieves on onload or migration hooks.
             for sieve in self.bot.plugin_manager.sieves:
                 event = yield from self._sieve(sieve, event, hook)
                 if event is None:
                     return False
 
+        if hook.type == "url":
+            # only now is the link handled, and not to be handled again within the dedup window
+            self.bot.recent_links.record((event.conn.name, event.chan.lower(), event.url))
+
         if hook.type == "command" and hook.auto_help and not event.text and hook.doc is not None:
             event.notice_doc()
             return False
@@ -472,6 +622,8 @@ class Plugin:
     :type raw_hooks: list[RawHook]
     :type sieves: list[SieveHook]
     :type events: list[EventHook]
+    :type migrations: list[MigrationHook]
+    :type url_hooks: list[UrlHook]
     :type tables: list[sqlalchemy.Table]
     """
 
@@ -484,7 +636,12 @@ class Plugin:
         self.file_path = filepath
         self.file_name = filename
         self.title = title
-        self.commands, self.regexes, self.raw_hooks, self.sieves, self.events, self.run_on_load = find_hooks(self, code)
+        self.commands, self.regexes, self.raw_hooks, self.sieves, self.events, self.run_on_load, self.migrations, \
+            self.url_hooks = find_hooks(self, code)
+        self.migrations.sort(key=lambda migration_hook: migration_hook.version)
+        for previous, migration_hook in zip(self.migrations, self.migrations[1:]):
+            if previous.version == migration_hook.version:
+                logger.warning("Plugin {} declares migration {} more than once".format(title, migration_hook.version))
         # we need to find tables for each plugin so that they can be unloaded from the global metadata when the
         # plugin is reloaded
         self.tables = find_tables(code)
@@ -577,6 +734,7 @@ class CommandHook(Hook):
     :type aliases: list[str]
     :type doc: str
     :type auto_help: bool
+    :type cost: float
     """
 
     def __init__(self, plugin, cmd_hook):
@@ -585,6 +743,8 @@ class CommandHook(Hook):
         :type cmd_hook: cloudbot.util.hook._CommandHook
         """
         self.auto_help = cmd_hook.kwargs.pop("autohelp", True)
+        # tokens each use takes from the rate limits, for commands which are expensive to run
+        self.cost = cmd_hook.kwargs.pop("cost", None)
 
         self.name = cmd_hook.main_alias
         self.aliases = list(cmd_hook.aliases)  # turn the set into a list
@@ -623,6 +783,34 @@ class RegexHook(Hook):
         return "regex {} from {}".format(self.function_name, self.plugin.file_name)
 
 
+class UrlHook(Hook):
+    """
+    :type hosts: set[str]
+    :type pattern: re.__Regex | None
+    :type preview_ttl: int
+    """
+
+    def __init__(self, plugin, url_hook):
+        """
+        :type plugin: Plugin
+        :type url_hook: cloudbot.util.hook._UrlHook
+        """
+        self.hosts = url_hook.hosts
+        self.preview_ttl = url_hook.kwargs.pop("preview_ttl", links.DEFAULT_PREVIEW_TTL)
+        pattern = url_hook.kwargs.pop("pattern", None)
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern, re.I)
+        self.pattern = pattern
+
+        super().__init__("url", plugin, url_hook)
+
+    def __repr__(self):
+        return "Url[hosts: {}, {}]".format(sorted(self.hosts), Hook.__repr__(self))
+
+    def __str__(self):
+        return "url {} ({}) from {}".format(self.function_name, ",".join(sorted(self.hosts)), self.plugin.file_name)
+
+
 class RawHook(Hook):
     """
     :type triggers: set[str]
@@ -700,11 +888,34 @@ class OnloadHook(Hook):
         return "onload {} from {}".format(self.function_name, self.plugin.file_name)
 
 
+class MigrationHook(Hook):
+    """
+    :type version: int
+    """
+
+    def __init__(self, plugin, migration_hook):
+        """
+        :type plugin: Plugin
+        :type migration_hook: cloudbot.util.hook._MigrationHook
+        """
+        self.version = migration_hook.version
+
+        super().__init__("migration", plugin, migration_hook)
+
+    def __repr__(self):
+        return "Migration[version: {}, {}]".format(self.version, Hook.__repr__(self))
+
+    def __str__(self):
+        return "migration {} ({}) from {}".format(self.function_name, self.version, self.plugin.file_name)
+
+
 _hook_name_to_plugin = {
     "command": CommandHook,
     "regex": RegexHook,
+    "url": UrlHook,
     "irc_raw": RawHook,
     "sieve": SieveHook,
     "event": EventHook,
-    "onload": OnloadHook
+    "onload": OnloadHook,
+    "migration": MigrationHook
 }
@@ -0,0 +1,585 @@
+"""
+async_http.py - an HTTP client for coroutine hooks, built on asyncio streams
+
+Requests made through this module don't hold an executor thread while waiting on the network, so a coroutine hook can
+have many lookups in flight at once. The helpers mirror cloudbot.util.http, raising the same HTTPError and URLError,
+and parsing (JSON, HTML, XML) happens in the executor so large documents don't block the event loop.
+
+Usage, from a coroutine hook:
+
+    data = yield from async_http.get_json("http://example.com/api", query=text)
+"""
+
+import asyncio
+import email.message
+import json
+import logging
+import ssl
+import time
+import urllib.parse
+import urllib.request
+import urllib.response
+import zlib
+from collections import deque
+
+from bs4 import BeautifulSoup
+from lxml import etree, html
+
+from cloudbot.util import http, http_fixtures, httpcache
+from cloudbot.util.http import HTTPError, URLError
+
+logger = logging.getLogger("cloudbot")
+
+# largest response body we'll read, in bytes
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+# number of idle keep-alive connections kept open to each host
+MAX_IDLE_CONNECTIONS = 10
+# seconds an idle connection is kept before it's closed rather than reused
+IDLE_TIMEOUT = 30
+MAX_REDIRECTS = 5
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# (scheme, host, port) -> deque of (reader, writer, idle since)
+_idle_connections = {}
+# single-flight key -> future of the fetch in progress, shared by identical concurrent requests
+_in_flight = {}
+# host -> (size, asyncio.BoundedSemaphore) enforcing the host policy's concurrency limit for coroutine requests
+_host_slots = {}
+_ssl_context = None
+
+
+def _get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+class _ConnectionClosed(Exception):
+    """Raised when a reused keep-alive connection turns out to have been closed by the server"""
+    pass
+
+
+class _InvalidRequest(URLError):
+    """Raised for requests which can't be made at all, which isn't the host's fault"""
+    pass
+
+
+@asyncio.coroutine
+def _connect(key, loop):
+    """
+    Returns an idle connection for the given (scheme, host, port), or opens a new one
+    :type key: (str, str, int)
+    :rtype: (asyncio.StreamReader, asyncio.StreamWriter, bool)
+    """
+    idle = _idle_connections.get(key)
+    now = time.time()
+    while idle:
+        reader, writer, idle_since = idle.pop()
+        if reader.at_eof() or now - idle_since > IDLE_TIMEOUT:
+            writer.close()
+            continue
+        return reader, writer, True
+
+    scheme, host, port = key
+    if scheme == "https":
+        reader, writer = yield from asyncio.open_connection(host, port, ssl=_get_ssl_context(), loop=loop)
+    else:
+        reader, writer = yield from asyncio.open_connection(host, port, loop=loop)
+    return reader, writer, False
+
+
+def _release(key, reader, writer):
+    idle = _idle_connections.get(key)
+    if idle is None:
+        idle = _idle_connections[key] = deque()
+    if len(idle) >= MAX_IDLE_CONNECTIONS:
+        writer.close()
+        return
+    idle.append((reader, writer, time.time()))
+
+
+def close_idle_connections():
+    """
+    Closes all pooled keep-alive connections, for use when the bot stops
+    """
+    for idle in _idle_connections.values():
+        while idle:
+            _, writer, _ = idle.pop()
+            writer.close()
+    _idle_connections.clear()
+
+
+@asyncio.coroutine
+def _read_headers(reader):
+    """
+    :type reader: asyncio.StreamReader
+    :rtype: (int, str, dict[str, str])
+    """
+    status_line = yield from reader.readline()
+    if not status_line:
+        raise _ConnectionClosed()
+
+    try:
+        _, code, *reason = status_line.decode("latin-1").split(None, 2)
+        code = int(code)
+    except ValueError:
+        raise URLError("Invalid HTTP status line: {!r}".format(status_line))
+    reason = reason[0].strip() if reason else ""
+
+    headers = {}
+    while True:
+        line = yield from reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        value = value.strip()
+        if name in headers:
+            # Set-Cookie values can contain commas themselves, so they're kept a line each
+            headers[name] += ("\n" if name == "set-cookie" else ", ") + value
+        else:
+            headers[name] = value
+
+    return code, reason, headers
+
+
+@asyncio.coroutine
+def _read_body(reader, headers, max_size):
+    """
+    Reads a response body, returning it along with whether the connection can be reused
+    :type reader: asyncio.StreamReader
+    :type headers: dict[str, str]
+    :type max_size: int
+    :rtype: (bytes, bool)
+    """
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        chunks = []
+        size = 0
+        while True:
+            line = yield from reader.readline()
+            try:
+                chunk_size = int(line.split(b";", 1)[0].strip() or b"0", 16)
+            except ValueError:
+                raise URLError("Invalid chunk size: {!r}".format(line))
+            if chunk_size == 0:
+                # trailers, ending with a blank line
+                while (yield from reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            size += chunk_size
+            if size > max_size:
+                raise URLError("Response larger than {} bytes".format(max_size))
+            chunks.append((yield from reader.readexactly(chunk_size)))
+            yield from reader.readline()
+        return b"".join(chunks), True
+
+    if "content-length" in headers:
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise URLError("Invalid Content-Length: {!r}".format(headers["content-length"]))
+        if length > max_size:
+            raise URLError("Response larger than {} bytes".format(max_size))
+        return (yield from reader.readexactly(length)), True
+
+    # no length given, the body runs until the server closes the connection
+    body = yield from reader.read(max_size + 1)
+    if len(body) > max_size:
+        raise URLError("Response larger than {} bytes".format(max_size))
+    return body, False
+
+
+def _decode_content(body, headers):
+    if not body:
+        # HEAD, 204 and 304 responses have no body, even when they name the encoding one would have had
+        return body
+    encoding = headers.get("content-encoding", "").lower()
+    try:
+        if encoding == "gzip":
+            return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            try:
+                return zlib.decompress(body)
+            except zlib.error:
+                # some servers send raw deflate data, without the zlib header
+                return zlib.decompress(body, -zlib.MAX_WBITS)
+    except zlib.error as e:
+        raise URLError("Couldn't decode {} response: {}".format(encoding, e))
+    return body
+
+
+@asyncio.coroutine
+def _fetch(method, url, request_headers, data, max_size, loop):
+    """
+    Makes a single request, without following redirects
+    :rtype: (int, str, dict[str, str], bytes)
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise _InvalidRequest("Unsupported URL scheme: {}".format(parts.scheme))
+    if not parts.hostname:
+        raise _InvalidRequest("No host given: {}".format(url))
+
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    key = (parts.scheme, parts.hostname.lower(), port)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+
+    headers = {"Host": parts.netloc, "Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+    headers.update(request_headers)
+    if data is not None:
+        headers["Content-Length"] = str(len(data))
+
+    request = "{} {} HTTP/1.1\r\n".format(method, path)
+    request += "".join("{}: {}\r\n".format(name, value) for name, value in headers.items())
+    request = (request + "\r\n").encode("latin-1")
+    if data is not None:
+        request += data
+
+    while True:
+        reader, writer, reused = yield from _connect(key, loop)
+        try:
+            writer.write(request)
+            yield from writer.drain()
+            code, reason, response_headers = yield from _read_headers(reader)
+        except (_ConnectionClosed, ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if reused:
+                # the server closed the idle connection, try again on a new one
+                continue
+            raise URLError("Connection closed by {}".format(parts.netloc))
+        except BaseException:
+            writer.close()
+            raise
+        break
+
+    try:
+        if method == "HEAD" or code in (204, 304) or 100 <= code < 200:
+            body, keep_alive = b"", True
+        else:
+            body, keep_alive = yield from _read_body(reader, response_headers, max_size)
+    except asyncio.IncompleteReadError:
+        writer.close()
+        raise URLError("Connection closed by {} before the response was complete".format(parts.netloc))
+    except BaseException:
+        writer.close()
+        raise
+
+    if keep_alive and response_headers.get("connection", "").lower() != "close":
+        _release(key, reader, writer)
+    else:
+        writer.close()
+
+    return code, reason, response_headers, _decode_content(body, response_headers)
+
+
+@asyncio.coroutine
+def _replay(store, method, url, data, loop):
+    """
+    Serves a request from a fixture store in replay mode
+    :type store: cloudbot.util.http_fixtures.FixtureStore
+    """
+    latency, failed = store.choose()
+    if latency:
+        yield from asyncio.sleep(latency, loop=loop)
+    if failed and store.fail_status is None:
+        raise http_fixtures.InjectedFailure("Injected failure for {}".format(url))
+    if failed:
+        return store.fail_status, "Injected failure", {}, b""
+
+    code, reason, headers, content = store.load(method, url, data)
+    return code, reason, {name.lower(): value for name, value in headers.items()}, content
+
+
+@asyncio.coroutine
+def _with_policy(url, timeout, loop, fetch, *args):
+    """
+    Makes one request (a single hop of a redirect chain) under the policy of the host it's to: failing fast while the
+    host's circuit is open, waiting for one of the host's connection slots, and recording whether it failed
+    :type url: str
+    :param timeout: Seconds the request may take, not counting waiting for a slot
+    :param fetch: The coroutine function making the request, called with args
+    :rtype: (int, str, dict[str, str], bytes)
+    """
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    policy = http.get_policy(host)
+    policy.check()
+
+    size, slots = _host_slots.get(host, (None, None))
+    if size != policy.max_concurrent:
+        slots = asyncio.BoundedSemaphore(policy.max_concurrent, loop=loop)
+        _host_slots[host] = (policy.max_concurrent, slots)
+    try:
+        yield from asyncio.wait_for(slots.acquire(), policy.queue_timeout, loop=loop)
+    except asyncio.TimeoutError:
+        policy.end_trial()
+        raise http.ServiceUnavailable(host, "{} is too busy right now, try again later.".format(host))
+
+    start = time.time()
+    failed = True
+    try:
+        result = yield from asyncio.wait_for(fetch(*args), timeout, loop=loop)
+    except asyncio.TimeoutError:
+        policy.record(True)
+        raise URLError("Timed out after {} seconds".format(timeout))
+    except _InvalidRequest:
+        policy.end_trial()
+        raise
+    except (OSError, URLError) as e:
+        policy.record(True)
+        if isinstance(e, URLError):
+            raise
+        raise URLError(e)
+    except BaseException:
+        policy.end_trial()
+        raise
+    else:
+        failed = result[0] >= 400
+        policy.record(result[0] >= 500)
+    finally:
+        slots.release()
+        http.record_request(url, time.time() - start, failed)
+    return result
+
+
+@asyncio.coroutine
+def _request(method, url, request_headers, data, max_size, timeout, cookies, loop):
+    """
+    :rtype: (str, int, str, dict[str, str], bytes)
+    """
+    store = http_fixtures.active_store
+    if store is not None and store.mode == http_fixtures.REPLAY:
+        code, reason, headers, content = yield from _with_policy(url, timeout, loop, _replay, store, method, url,
+                                                                 data, loop)
+        return url, code, reason, headers, content
+
+    result = yield from _follow_redirects(method, url, request_headers, data, max_size, timeout, cookies, loop)
+    if store is not None:
+        final_url, code, reason, headers, content = result
+        store.save(method, url, data, code, reason, headers, content)
+    return result
+
+
+def _add_cookies(url, request_headers):
+    """
+    Returns the request headers with the cookies the shared jar has for the URL added
+    :type url: str
+    :type request_headers: dict[str, str]
+    :rtype: dict[str, str]
+    """
+    request = urllib.request.Request(url, headers=request_headers)
+    http.jar.add_cookie_header(request)
+    return dict(request.header_items())
+
+
+def _extract_cookies(url, request_headers, response_headers):
+    """
+    Stores the cookies set by a response in the shared jar
+    """
+    info = email.message.Message()
+    for value in response_headers.get("set-cookie", "").split("\n"):
+        if value:
+            info["Set-Cookie"] = value
+    response = urllib.response.addinfourl(None, info, url)
+    http.jar.extract_cookies(response, urllib.request.Request(url, headers=request_headers))
+
+
+@asyncio.coroutine
+def _follow_redirects(method, url, request_headers, data, max_size, timeout, cookies, loop):
+    for _ in range(MAX_REDIRECTS + 1):
+        hop_headers = _add_cookies(url, request_headers) if cookies else request_headers
+        # each hop is made under its own host's policy, as a redirect can lead anywhere
+        code, reason, headers, content = yield from _with_policy(url, timeout, loop, _fetch, method, url,
+                                                                 hop_headers, data, max_size, loop)
+        if cookies:
+            _extract_cookies(url, hop_headers, headers)
+        if code not in REDIRECT_CODES or "location" not in headers:
+            return url, code, reason, headers, content
+        url = urllib.parse.urljoin(url, headers["location"])
+        if code == 303 or (code in (301, 302) and method == "POST"):
+            method, data = "GET", None
+    raise URLError("Too many redirects")
+
+
+@asyncio.coroutine
+def open(url, query_params=None, user_agent=None, post_data=None, referer=None, get_method=None, cookies=False,
+         timeout=None, headers=None, cache=None, negative_cache=None, max_size=DEFAULT_MAX_SIZE, loop=None, **kwargs):
+    """
+    Makes a request, taking the same arguments as cloudbot.util.http.open, and returns a Response. Responses are cached
+    in, and served from, the same cache as cloudbot.util.http's, and cookies go in the same jar.
+    :type url: str
+    :type max_size: int
+    :type loop: asyncio.AbstractEventLoop
+    :rtype: cloudbot.util.http.Response
+    """
+    if query_params is None:
+        query_params = {}
+
+    if user_agent is None:
+        user_agent = http.ua_cloudbot
+
+    query_params.update(kwargs)
+
+    url = http.prepare_url(url, query_params)
+
+    if get_method is not None:
+        method = get_method
+    elif post_data is not None:
+        method = "POST"
+    else:
+        method = "GET"
+
+    if isinstance(post_data, str):
+        post_data = post_data.encode("utf-8")
+
+    request_headers = {"User-Agent": user_agent}
+    if headers is not None:
+        request_headers.update(headers)
+    if referer is not None:
+        request_headers["Referer"] = referer
+
+    if timeout is None:
+        timeout = http.session.timeout
+
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    ttl, negative_ttl = http.cache_policies.get(host, (None, http.DEFAULT_NEGATIVE_TTL))
+    if cache is not None:
+        ttl = cache
+    if negative_cache is not None:
+        negative_ttl = negative_cache
+
+    response_cache = http.response_cache
+    cacheable = bool(ttl) and method == "GET" and not cookies
+    entry = None
+    if cacheable:
+        # keyed on the headers too, before the conditional ones are added
+        key = httpcache.cache_key(url, request_headers)
+        entry = response_cache.get(key)
+        if entry is not None and entry.is_fresh():
+            response_cache.record(host, "hits" if entry.error is None else "negative_hits")
+            return http.cached_response(entry)
+        if entry is not None and entry.error is None:
+            # stale, but we may be able to revalidate it rather than downloading it again
+            if entry.etag:
+                request_headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                request_headers["If-Modified-Since"] = entry.last_modified
+
+    try:
+        final_url, code, reason, response_headers, content = yield from _request(method, url, request_headers,
+                                                                                 post_data, max_size, timeout, cookies,
+                                                                                 loop)
+    except http.ServiceUnavailable:
+        raise
+    except URLError as e:
+        if cacheable and negative_ttl:
+            response_cache.record(host, "misses")
+            response_cache.put(key, httpcache.CacheEntry(url, None, {}, b"", time.time() + negative_ttl,
+                                                         error=str(e.reason)))
+        raise
+
+    if cacheable and code == 304 and entry is not None and entry.error is None:
+        response_cache.record(host, "revalidated")
+        entry.expires_at = time.time() + ttl
+        response_cache.put(key, entry)
+        return http.cached_response(entry)
+
+    if cacheable:
+        response_cache.record(host, "misses")
+
+    cached_headers = {name: response_headers[name] for name in http.CACHED_HEADERS if name in response_headers}
+
+    if code >= 400:
+        if cacheable and negative_ttl:
+            response_cache.put(key, httpcache.CacheEntry(final_url, code, cached_headers, b"",
+                                                         time.time() + negative_ttl, error=(code, reason)))
+        raise HTTPError(final_url, code, reason, response_headers, None)
+
+    if cacheable:
+        response_cache.put(key, httpcache.CacheEntry(final_url, code, cached_headers, content, time.time() + ttl))
+
+    return http.Response(final_url, code, response_headers, content)
+
+
+@asyncio.coroutine
+def _get(*args, **kwargs):
+    decode = kwargs.pop("decode", True)
+    response = yield from open(*args, **kwargs)
+    if decode:
+        return response.read().decode()
+    else:
+        return response.read()
+
+
+@asyncio.coroutine
+def _get_parsed(parse, loop, args, kwargs):
+    content = yield from _get(*args, **kwargs)
+    if parse is None:
+        return content
+    # parse in the executor, so large documents don't stall the event loop
+    return (yield from loop.run_in_executor(None, parse, content))
+
+
+@asyncio.coroutine
+def _shared_get(kind, parse, args, kwargs):
+    """
+    Fetches and parses a URL. Identical requests made at the same time share one fetch and one parsed result, so
+    callers shouldn't modify what they get back.
+    """
+    loop = kwargs.get("loop")
+    if loop is None:
+        loop = asyncio.get_event_loop()
+
+    arguments = http.bind_arguments(open, args, kwargs)
+    key = None if arguments is None else http.flight_key(kind, **arguments)
+    if key is None:
+        return (yield from _get_parsed(parse, loop, args, kwargs))
+
+    future = _in_flight.get(key)
+    http.single_flight.record(key[1], future is not None)
+    if future is None:
+        future = asyncio.async(_get_parsed(parse, loop, args, kwargs), loop=loop)
+        _in_flight[key] = future
+        future.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    # shielded, so one caller being cancelled doesn't cancel the fetch for everyone else
+    return (yield from asyncio.shield(future, loop=loop))
+
+
+@asyncio.coroutine
+def get(*args, **kwargs):
+    return (yield from _shared_get("text", None, args, kwargs))
+
+
+@asyncio.coroutine
+def get_url(*args, **kwargs):
+    response = yield from open(*args, **kwargs)
+    return response.geturl()
+
+
+@asyncio.coroutine
+def get_html(*args, **kwargs):
+    return (yield from _shared_get("html", html.fromstring, args, kwargs))
+
+
+def _parse_soup(text):
+    return BeautifulSoup(text, 'lxml')
+
+
+@asyncio.coroutine
+def get_soup(*args, **kwargs):
+    return (yield from _shared_get("soup", _parse_soup, args, kwargs))
+
+
+@asyncio.coroutine
+def get_xml(*args, **kwargs):
+    kwargs["decode"] = False  # we don't want to decode, for etree
+    return (yield from _shared_get("xml", etree.fromstring, args, kwargs))
+
+
+@asyncio.coroutine
+def get_json(*args, **kwargs):
+    return (yield from _shared_get("json", json.loads, args, kwargs))
@@ -0,0 +1,126 @@
+"""
+database.py - creates the bot's database engines, applying the configured tuning profile
+"""
+
+import logging
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("cloudbot")
+
+# Tuning applied to SQLite databases, overridable with the "database_tuning" config section.
+# Any option set to null is left at SQLite's default.
+default_tuning = {
+    # WAL lets readers carry on while a write is in progress
+    "journal_mode": "WAL",
+    # NORMAL only fsyncs at checkpoints when in WAL mode, which is still safe against corruption
+    "synchronous": "NORMAL",
+    # milliseconds to wait for a lock before raising "database is locked"
+    "busy_timeout": 5000,
+    # number of prepared statements cached per connection
+    "statement_cache_size": 100,
+    # number of pooled connections used for writing and for reading
+    "pool_size": 5,
+    "read_pool_size": 5
+}
+
+valid_journal_modes = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+valid_synchronous = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+def get_tuning(config):
+    """
+    Merges the "database_tuning" config section over the defaults
+    :type config: dict
+    :rtype: dict
+    """
+    tuning = dict(default_tuning)
+    tuning.update(config.get("database_tuning", {}))
+    return tuning
+
+
+def _is_memory_database(url):
+    """
+    :type url: sqlalchemy.engine.url.URL
+    :rtype: bool
+    """
+    return url.database in (None, "", ":memory:")
+
+
+def _add_pragmas(engine, tuning, read_only=False):
+    """
+    Applies the journal mode, synchronous level and busy timeout to every new connection made by the given engine
+    :type engine: sqlalchemy.engine.Engine
+    :type tuning: dict
+    :type read_only: bool
+    """
+    pragmas = []
+
+    journal_mode = tuning.get("journal_mode")
+    if journal_mode:
+        if journal_mode.upper() not in valid_journal_modes:
+            raise ValueError("Invalid database journal_mode {}".format(journal_mode))
+        pragmas.append("PRAGMA journal_mode={}".format(journal_mode.upper()))
+
+    synchronous = tuning.get("synchronous")
+    if synchronous:
+        if synchronous.upper() not in valid_synchronous:
+            raise ValueError("Invalid database synchronous level {}".format(synchronous))
+        pragmas.append("PRAGMA synchronous={}".format(synchronous.upper()))
+
+    busy_timeout = tuning.get("busy_timeout")
+    if busy_timeout is not None:
+        pragmas.append("PRAGMA busy_timeout={}".format(int(busy_timeout)))
+
+    if read_only:
+        pragmas.append("PRAGMA query_only=1")
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def create_engines(db_path, config):
+    """
+    Creates the write and read engines for the given database.
+
+    For file-based SQLite databases, the read engine is a separate pool of query-only connections, so reads never
+    queue up behind writers for a connection. For any other database, the same engine is returned for both.
+
+    :type db_path: str
+    :type config: dict
+    :rtype: (sqlalchemy.engine.Engine, sqlalchemy.engine.Engine)
+    """
+    url = make_url(db_path)
+    if url.get_dialect().name != "sqlite" or _is_memory_database(url):
+        engine = create_engine(db_path)
+        return engine, engine
+
+    tuning = get_tuning(config)
+    connect_args = {
+        # pooled connections are handed between executor threads, one thread at a time
+        "check_same_thread": False
+    }
+    if tuning.get("statement_cache_size") is not None:
+        connect_args["cached_statements"] = int(tuning["statement_cache_size"])
+    if tuning.get("busy_timeout") is not None:
+        connect_args["timeout"] = int(tuning["busy_timeout"]) / 1000
+
+    write_engine = create_engine(db_path, poolclass=QueuePool, pool_size=tuning.get("pool_size") or 5,
+                                 connect_args=connect_args)
+    _add_pragmas(write_engine, tuning)
+
+    read_engine = create_engine(db_path, poolclass=QueuePool, pool_size=tuning.get("read_pool_size") or 5,
+                                connect_args=connect_args)
+    # journal mode is a property of the database file, so leave setting it to the writers
+    read_tuning = dict(tuning, journal_mode=None)
+    _add_pragmas(read_engine, read_tuning, read_only=True)
+
+    logger.debug("Database tuning: {}".format(tuning))
+
+    return write_engine, read_engine
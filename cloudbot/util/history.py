@@ -0,0 +1,408 @@
+"""
+history.py - a memory-bounded store of each channel's recent messages, optionally persisted across restarts
+
+Each channel keeps up to its configured depth of messages. When all channels together go over the memory budget, the
+channels which have been quiet the longest are dropped. If persistence is enabled, every message is also appended to a
+fixed-size memory-mapped ring file, which the store is refilled from at startup.
+"""
+
+import functools
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from collections import OrderedDict, deque, namedtuple
+
+# messages kept per channel, unless configured for the channel
+DEFAULT_DEPTH = 100
+# bytes all channels' history may take up together
+DEFAULT_MEMORY_BUDGET = 16 * 1024 * 1024
+# bytes the ring file holds
+DEFAULT_RING_SIZE = 8 * 1024 * 1024
+# the first characters of channel names, anything else is a private conversation
+CHANNEL_PREFIXES = "#&!+"
+# rough bytes each message takes besides its content: the record, its time, the nick reference and the deque slot
+RECORD_OVERHEAD = 160
+
+logger = logging.getLogger("cloudbot")
+
+# sed-style corrections, "s/find/replace/" or "s/find/replace/nick"
+correction_re = re.compile(r"^[sS]/([^/]*)/([^/]*)(/.*)?\s*$")
+
+# is_correction is worked out once when the message is added, so searches can skip corrections without matching them
+HistoryRecord = namedtuple("HistoryRecord", ["nick", "time", "content", "is_correction"])
+
+
+@functools.lru_cache(maxsize=256)
+def compile_search(text):
+    """
+    Returns a case-insensitive pattern matching text literally. Patterns are cached, as the same text tends to be
+    searched for repeatedly.
+    :type text: str
+    :rtype: re.__Regex
+    """
+    return re.compile(re.escape(text), re.IGNORECASE)
+
+
+def is_channel(chan):
+    """
+    :type chan: str
+    :rtype: bool
+    """
+    return bool(chan) and chan[0] in CHANNEL_PREFIXES
+
+
+def record_size(record):
+    """
+    :type record: HistoryRecord
+    :rtype: int
+    """
+    return RECORD_OVERHEAD + len(record.content)
+
+
+class ChannelHistory:
+    """
+    The recent messages in a channel, oldest first
+    :type records: collections.deque[HistoryRecord]
+    :type by_nick: dict[str, collections.deque[HistoryRecord]]
+    :type size: int
+    """
+
+    __slots__ = ("records", "by_nick", "size", "_lock")
+
+    def __init__(self, depth, lock):
+        self.records = deque(maxlen=depth)
+        # lowercase nick -> the same records, for the messages from that nick
+        self.by_nick = {}
+        self.size = 0
+        self._lock = lock
+
+    def _append(self, record):
+        """
+        Adds a record, returning how much the history's size changed by
+        :rtype: int
+        """
+        change = record_size(record)
+        if len(self.records) == self.records.maxlen:
+            oldest = self.records[0]
+            change -= record_size(oldest)
+            # the oldest message is always the oldest from its nick too
+            nick_key = oldest.nick.lower()
+            nick_records = self.by_nick[nick_key]
+            nick_records.popleft()
+            if not nick_records:
+                del self.by_nick[nick_key]
+        self.records.append(record)
+        self.by_nick.setdefault(record.nick.lower(), deque()).append(record)
+        self.size += change
+        return change
+
+    def search(self, pattern, nick=None, include_corrections=False):
+        """
+        Yields the messages matching pattern, newest first. Searches for a nick only look at that nick's messages.
+        :type pattern: re.__Regex
+        :param nick: Only search messages from this nick
+        :param include_corrections: Whether to search messages which are corrections of earlier ones
+        :rtype: collections.Iterable[HistoryRecord]
+        """
+        with self._lock:
+            if nick is None:
+                records = list(self.records)
+            else:
+                records = list(self.by_nick.get(nick.lower(), ()))
+
+        for record in reversed(records):
+            if record.is_correction and not include_corrections:
+                continue
+            if pattern.search(record.content):
+                yield record
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        # iterate over a copy, so messages arriving meanwhile don't break the iteration
+        with self._lock:
+            records = list(self.records)
+        return iter(records)
+
+    def __reversed__(self):
+        with self._lock:
+            records = list(self.records)
+        return reversed(records)
+
+
+class RingFile:
+    """
+    A fixed-size file of history records, memory-mapped, overwriting the oldest records once it's full.
+
+    Valid records run from tail to lap_end and then from the start of the data to head if the file has wrapped around,
+    or from the start of the data to head if it hasn't.
+    :type path: str
+    :type size: int
+    """
+
+    magic = b"CBHR"
+    header = struct.Struct("<4sIQQQ?")
+    header_size = 64
+    # record length (including this header) and time, followed by "server\0chan\0nick\0content" in UTF-8
+    record_header = struct.Struct("<Id")
+
+    def __init__(self, path, size=DEFAULT_RING_SIZE):
+        self.path = path
+        self.size = size
+
+        fresh = not os.path.exists(path) or os.path.getsize(path) != size
+        self._file = open(path, "w+b" if fresh else "r+b")
+        if fresh:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+        magic, version, self.head, self.tail, self.lap_end, self.wrapped = self.header.unpack_from(self._map, 0)
+        if magic != self.magic or version != 1:
+            self.head = self.tail = self.lap_end = self.header_size
+            self.wrapped = False
+            self._write_header()
+
+    def _write_header(self):
+        self.header.pack_into(self._map, 0, self.magic, 1, self.head, self.tail, self.lap_end, self.wrapped)
+
+    def append(self, server, chan, record):
+        """
+        :type server: str
+        :type chan: str
+        :type record: HistoryRecord
+        """
+        payload = "\0".join((server, chan, record.nick, record.content)).encode("utf-8", "replace")
+        length = self.record_header.size + len(payload)
+        if length > (self.size - self.header_size) // 4:
+            # too large to be a real message, and would take up too much of the ring
+            return
+
+        if self.head + length > self.size:
+            # no room left before the end of the file, go back to the start. Anything left of the lap before this one
+            # is dropped, the records from the start of the file up to here are now the oldest.
+            self.lap_end = self.head
+            self.head = self.tail = self.header_size
+            self.wrapped = True
+
+        # advance the tail past the old records the new one overwrites
+        while self.wrapped and self.tail < self.head + length:
+            self.tail += self.record_header.unpack_from(self._map, self.tail)[0]
+            if self.tail >= self.lap_end:
+                # the whole previous lap has been overwritten
+                self.wrapped = False
+                self.tail = self.header_size
+
+        self.record_header.pack_into(self._map, self.head, length, record.time)
+        self._map[self.head + self.record_header.size:self.head + length] = payload
+        self.head += length
+        self._write_header()
+
+    def _read(self, start, end):
+        position = start
+        while position < end:
+            length, timestamp = self.record_header.unpack_from(self._map, position)
+            if length < self.record_header.size or position + length > end:
+                logger.warning("History ring file {} is corrupt, ignoring the rest of it".format(self.path))
+                return
+            payload = self._map[position + self.record_header.size:position + length].decode("utf-8", "replace")
+            server, chan, nick, content = payload.split("\0", 3)
+            yield server, chan, HistoryRecord(sys.intern(nick), timestamp, content,
+                                              correction_re.match(content) is not None)
+            position += length
+
+    def read_all(self):
+        """
+        Returns the (server, chan, record) of every record in the ring, oldest first
+        :rtype: list[(str, str, HistoryRecord)]
+        """
+        records = []
+        try:
+            if self.wrapped:
+                records.extend(self._read(self.tail, self.lap_end))
+            records.extend(self._read(self.header_size, self.head))
+        except (struct.error, ValueError):
+            logger.warning("History ring file {} is corrupt, ignoring the rest of it".format(self.path))
+        return records
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+class ConnectionHistory:
+    """
+    The history of one connection's channels, looked up by channel name
+    :type store: HistoryStore
+    :type server: str
+    """
+
+    def __init__(self, store, server):
+        self.store = store
+        self.server = server
+
+    def add(self, chan, nick, timestamp, content):
+        return self.store.add(self.server, chan, nick, timestamp, content)
+
+    def get(self, chan, default=None):
+        history = self.store.get(self.server, chan)
+        return default if history is None else history
+
+    def clear(self, chan):
+        return self.store.clear(self.server, chan)
+
+    def __getitem__(self, chan):
+        history = self.store.get(self.server, chan)
+        if history is None:
+            raise KeyError(chan)
+        return history
+
+    def __contains__(self, chan):
+        return self.store.get(self.server, chan) is not None
+
+
+class HistoryStore:
+    """
+    :type depth: int
+    :type channel_depths: dict[str, int]
+    :type memory_budget: int
+    :type ring: RingFile | None
+    :type persist_private: bool
+    :type size: int
+    :type evictions: int
+    """
+
+    def __init__(self, depth=DEFAULT_DEPTH, channel_depths=None, memory_budget=DEFAULT_MEMORY_BUDGET, ring=None,
+                 persist_private=False):
+        """
+        :param depth: Messages to keep for each channel, 0 to keep none
+        :param channel_depths: channel name -> messages to keep for it, overriding depth
+        :param ring: The ring file to persist messages to
+        :param persist_private: Whether private messages are persisted to the ring file too
+        """
+        self.depth = max(depth, 0)
+        self.channel_depths = {chan.lower(): max(chan_depth, 0)
+                               for chan, chan_depth in (channel_depths or {}).items()}
+        self.memory_budget = memory_budget
+        self.ring = ring
+        self.persist_private = persist_private
+        self.size = 0
+        self.evictions = 0
+
+        # (server, chan) -> ChannelHistory, the channel with the oldest last message first
+        self._channels = OrderedDict()
+        self._lock = threading.RLock()
+
+        if ring is not None:
+            for server, chan, record in ring.read_all():
+                if self.get_depth(chan) == 0 or not (persist_private or is_channel(chan)):
+                    continue
+                if record.nick:
+                    self._add(server, chan, record)
+                else:
+                    self._clear(server, chan)
+
+    def for_connection(self, server):
+        """
+        :type server: str
+        :rtype: ConnectionHistory
+        """
+        return ConnectionHistory(self, server)
+
+    def get_depth(self, chan):
+        """
+        Returns the number of messages kept for a channel, 0 if its history is turned off
+        :type chan: str
+        :rtype: int
+        """
+        return self.channel_depths.get(chan.lower(), self.depth)
+
+    def add(self, server, chan, nick, timestamp, content):
+        """
+        :type server: str
+        :type chan: str
+        :type nick: str
+        :type timestamp: float
+        :type content: str
+        :rtype: HistoryRecord
+        """
+        # most messages come from a few nicks, so share one copy of each
+        record = HistoryRecord(sys.intern(nick), timestamp, content, correction_re.match(content) is not None)
+        if self.get_depth(chan) == 0:
+            return record
+        with self._lock:
+            self._add(server, chan, record)
+            if self.ring is not None and (self.persist_private or is_channel(chan)):
+                self.ring.append(server, chan, record)
+        return record
+
+    def _add(self, server, chan, record):
+        key = (server, chan.lower())
+        history = self._channels.get(key)
+        if history is None:
+            history = self._channels[key] = ChannelHistory(self.get_depth(chan), self._lock)
+        else:
+            self._channels.move_to_end(key)
+        self.size += history._append(record)
+
+        # drop the longest quiet channels until we're back under budget, but always keep the channel just written to
+        while self.size > self.memory_budget and len(self._channels) > 1:
+            _, evicted = self._channels.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def get(self, server, chan):
+        """
+        :type server: str
+        :type chan: str
+        :rtype: ChannelHistory | None
+        """
+        with self._lock:
+            return self._channels.get((server, chan.lower()))
+
+    def clear(self, server, chan):
+        """
+        Forgets a channel's history, returning False if it had none
+        :type server: str
+        :type chan: str
+        :rtype: bool
+        """
+        with self._lock:
+            if self.ring is not None and (self.persist_private or is_channel(chan)):
+                # a record without a nick marks the history before it as cleared
+                self.ring.append(server, chan, HistoryRecord("", 0, "", False))
+            return self._clear(server, chan)
+
+    def _clear(self, server, chan):
+        history = self._channels.pop((server, chan.lower()), None)
+        if history is None:
+            return False
+        self.size -= history.size
+        return True
+
+    def close(self):
+        with self._lock:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+
+
+def create_store(config, data_dir):
+    """
+    Creates a history store as set up in the "history" section of the config
+    :type config: dict
+    :type data_dir: str
+    :rtype: HistoryStore
+    """
+    history_config = config.get("history", {})
+    ring = None
+    if history_config.get("persist", False):
+        ring = RingFile(os.path.join(data_dir, "history.ring"), history_config.get("persist_size", DEFAULT_RING_SIZE))
+    return HistoryStore(history_config.get("depth", DEFAULT_DEPTH), history_config.get("channel_depths"),
+                        history_config.get("memory_budget", DEFAULT_MEMORY_BUDGET), ring,
+                        history_config.get("persist_private", False))
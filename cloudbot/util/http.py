@@ -1,23 +1,32 @@
-# convenience wrapper for urllib2 & friends
+# convenience wrapper for requests & friends
 
+import codecs
 import http.cookiejar
+import inspect
 import json
-import urllib.request
-import urllib.parse
-import urllib.error
-import urllib.request
-import urllib.error
-import urllib.parse
+import logging
+import os
+import re
+import threading
+import time
 import urllib.parse
 # noinspection PyUnresolvedReferences
 from urllib.parse import quote, quote_plus as _quote_plus
 
+import requests
+import requests.adapters
+import requests.cookies
+import requests.exceptions
 from bs4 import BeautifulSoup
 from lxml import etree, html
 
 # noinspection PyUnresolvedReferences
 from urllib.error import URLError, HTTPError
 
+from cloudbot.util import httpcache, urlnorm
+
+logger = logging.getLogger("cloudbot")
+
 ua_cloudbot = 'Cloudbot/DEV http://github.com/CloudDev/CloudBot'
 
 ua_firefox = 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:17.0) Gecko/17.0' \
@@ -28,39 +37,738 @@ ua_internetexplorer = 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)'
 ua_chrome = 'Mozilla/5.0 (X11; Linux i686) AppleWebKit/537.4 (KHTML, ' \
             'like Gecko) Chrome/22.0.1229.79 Safari/537.4'
 
-jar = http.cookiejar.CookieJar()
+# Defaults for the shared session, overridable with the "http" config section
+DEFAULT_TIMEOUT = 10
+# number of hosts to keep connection pools for
+DEFAULT_POOL_HOSTS = 20
+# number of keep-alive connections kept open to each host
+DEFAULT_POOL_SIZE = 10
+
+# Defaults for per-host request policies, overridable with the "http" config section, and per host with "hosts"
+# most requests to one host allowed at a time
+DEFAULT_MAX_CONCURRENT = 4
+# seconds a request waits for one of those slots before giving up
+DEFAULT_QUEUE_TIMEOUT = 5
+# consecutive failures (connection errors, timeouts and 5xx responses) before a host's circuit opens
+DEFAULT_FAILURE_THRESHOLD = 5
+# seconds an open circuit fails requests immediately, before letting a trial request through
+DEFAULT_COOLDOWN = 60
+
+# how long failed requests are cached for, when caching is enabled for a request
+DEFAULT_NEGATIVE_TTL = 60
+# response headers kept in cached entries
+CACHED_HEADERS = ("content-type", "etag", "last-modified")
+
+# how much of a page get_html_stream reads before giving up on the rest
+DEFAULT_STREAM_SIZE = 512 * 1024
+STREAM_CHUNK_SIZE = 16 * 1024
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+charset_re = re.compile(br'<meta[^>]+charset=["\']?([a-zA-Z0-9_-]+)', re.I)
 
+jar = http.cookiejar.CookieJar()
 
-def get(*args, **kwargs):
-    if kwargs.get("decode", True):
+response_cache = httpcache.ResponseCache()
+# host -> (ttl, negative_ttl), for hosts which should be cached without each request asking for it
+cache_policies = {}
+
+
+class RequestStats:
+    """
+    Request counts and timings for a single host
+    :type requests: int
+    :type errors: int
+    :type total_time: float
+    :type max_time: float
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    @property
+    def average_time(self):
+        if not self.requests:
+            return 0.0
+        return self.total_time / self.requests
+
+
+# host -> RequestStats
+request_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record_request(url, elapsed, failed):
+    """
+    Records a request made to the host of the given URL, for get_stats()
+    :type url: str
+    :param elapsed: Seconds the request took
+    :type failed: bool
+    """
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    with _stats_lock:
+        stats = request_stats.get(host)
+        if stats is None:
+            stats = request_stats[host] = RequestStats()
+        stats.requests += 1
+        if failed:
+            stats.errors += 1
+        stats.total_time += elapsed
+        stats.max_time = max(stats.max_time, elapsed)
+
+
+class ServiceUnavailable(URLError, requests.exceptions.ConnectionError):
+    """
+    Raised without making a request when a host's circuit breaker is open, or too many requests to it are already
+    waiting. It's both a URLError and a requests ConnectionError, so existing error handling for either catches it.
+    :type host: str
+    """
+
+    def __init__(self, host, reason=None):
+        if reason is None:
+            reason = "{} is unavailable right now, try again later.".format(host)
+        URLError.__init__(self, reason)
+        self.host = host
+        self.request = None
+        self.response = None
+
+    def __str__(self):
+        return self.reason
+
+
+class HostPolicy:
+    """
+    A concurrency limit and circuit breaker for a single host.
+
+    The circuit opens after failure_threshold consecutive failures. While it's open, requests fail immediately with
+    ServiceUnavailable rather than waiting on a dead service. After cooldown seconds it half-opens, letting a single
+    trial request through: success closes the circuit again, failure re-opens it.
+    :type host: str
+    :type max_concurrent: int
+    :type queue_timeout: float
+    :type failure_threshold: int
+    :type cooldown: float
+    :type failures: int
+    :type opened_at: float | None
+    :type trial_running: bool
+    """
+
+    def __init__(self, host, max_concurrent=DEFAULT_MAX_CONCURRENT, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.host = host
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.rejected = 0
+
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        :rtype: str
+        """
+        if self.opened_at is None:
+            return "closed"
+        elif time.time() - self.opened_at < self.cooldown:
+            return "open"
+        else:
+            return "half-open"
+
+    def check(self):
+        """
+        Raises ServiceUnavailable if a request to this host shouldn't be made right now
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return
+            self.rejected += 1
+        raise ServiceUnavailable(self.host)
+
+    def record(self, failed):
+        """
+        :type failed: bool
+        """
+        with self._lock:
+            self.trial_running = False
+            if not failed:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Circuit opened for {} after {} failures".format(self.host, self.failures))
+                self.opened_at = time.time()
+
+    def end_trial(self):
+        """
+        Lets another trial request through a half-open circuit, without recording an outcome for this one
+        """
+        with self._lock:
+            self.trial_running = False
+
+    def acquire(self):
+        """
+        Checks the circuit and waits for a concurrency slot, raising ServiceUnavailable if either isn't available
+        """
+        self.check()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.end_trial()
+            with self._lock:
+                self.rejected += 1
+            raise ServiceUnavailable(self.host, "{} is too busy right now, try again later.".format(self.host))
+
+    def release(self):
+        self._slots.release()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+
+# host -> HostPolicy
+host_policies = {}
+# settings applied to hosts without their own policy config, and the per-host overrides, from the "http" config
+_policy_defaults = {}
+_policy_overrides = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(host):
+    """
+    Returns the policy for the given host, creating it from the config if needed
+    :type host: str
+    :rtype: HostPolicy
+    """
+    host = host.lower()
+    policy = host_policies.get(host)
+    if policy is None:
+        with _policies_lock:
+            policy = host_policies.get(host)
+            if policy is None:
+                settings = dict(_policy_defaults)
+                settings.update(_policy_overrides.get(host, {}))
+                policy = host_policies[host] = HostPolicy(host, **settings)
+    return policy
+
+
+def _is_failure(response):
+    """
+    Only server errors count against a host, a 404 or 403 means the service is working. Requests which fail count
+    against it only if they couldn't connect or timed out.
+    :type response: requests.Response
+    """
+    return response.status_code >= 500
+
+
+class Session(requests.Session):
+    """
+    A requests Session which applies a default timeout and records per-host request timings.
+
+    Cookies are only stored in the module-level jar, and only for requests made with cookies=True, so they don't leak
+    between unrelated plugins sharing this session.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.timeout = DEFAULT_TIMEOUT
+        self.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        self.mount_pools(DEFAULT_POOL_HOSTS, DEFAULT_POOL_SIZE)
+
+    def mount_pools(self, pool_hosts, pool_size):
+        """
+        :type pool_hosts: int
+        :type pool_size: int
+        """
+        for prefix in ("http://", "https://"):
+            old_adapter = self.adapters.get(prefix)
+            self.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size))
+            if old_adapter is not None:
+                # closes the replaced adapter's pooled connections, which would otherwise stay open until exit
+                old_adapter.close()
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        policy = get_policy(urllib.parse.urlsplit(url).netloc)
+        policy.acquire()
+
+        start = time.time()
+        failed = True
+        try:
+            response = super().request(method, url, **kwargs)
+            failed = response.status_code >= 400
+            policy.record(_is_failure(response))
+            return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            policy.record(True)
+            raise
+        except BaseException:
+            # not the host's fault (an invalid URL or header is the caller's), but the trial request (if this was it)
+            # is over
+            policy.end_trial()
+            raise
+        finally:
+            policy.release()
+            record_request(url, time.time() - start, failed)
+
+
+# the shared session, use this rather than requests.get/requests.post so connections are reused
+session = Session()
+
+
+class _Call:
+    """
+    A fetch in progress, which other callers can wait on
+    :type done: threading.Event
+    """
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Makes sure only one identical request is in flight at a time. Callers asking for a request which is already being
+    made wait for it and share its result (or its error) rather than making it again.
+    :type stats: dict[str, dict[str, int]]
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, url, deduplicated):
+        """
+        :type url: str
+        :type deduplicated: bool
+        """
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self._lock:
+            stats = self.stats.get(host)
+            if stats is None:
+                stats = self.stats[host] = {"requests": 0, "deduplicated": 0}
+            stats["requests"] += 1
+            if deduplicated:
+                stats["deduplicated"] += 1
+
+    def do(self, key, url, function):
+        """
+        Calls function, unless a call with the same key is already running, in which case waits for that one instead
+        :type key: tuple
+        :type url: str
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        self.record(url, not leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+single_flight = SingleFlight()
+
+
+def configure(config, data_dir=None):
+    """
+    Applies the "http" config section to the shared session and response cache
+    :type config: dict
+    :type data_dir: str
+    """
+    global response_cache, _policy_defaults, _policy_overrides
+    http_config = config.get("http", {})
+    session.timeout = http_config.get("timeout", DEFAULT_TIMEOUT)
+
+    policy_options = ("max_concurrent", "queue_timeout", "failure_threshold", "cooldown")
+    _policy_defaults = {option: http_config[option] for option in policy_options if option in http_config}
+    _policy_overrides = {host.lower(): settings for host, settings in http_config.get("hosts", {}).items()}
+    with _policies_lock:
+        # recreated with the new settings when next used
+        host_policies.clear()
+    session.mount_pools(http_config.get("pool_hosts", DEFAULT_POOL_HOSTS),
+                        http_config.get("pool_size", DEFAULT_POOL_SIZE))
+
+    cache_config = http_config.get("cache", {})
+    if cache_config.get("disk", False) and data_dir is not None:
+        disk_dir = os.path.join(data_dir, "http_cache")
+    else:
+        disk_dir = None
+    response_cache = httpcache.ResponseCache(cache_config.get("memory_size", httpcache.DEFAULT_MEMORY_SIZE), disk_dir,
+                                             cache_config.get("disk_size", httpcache.DEFAULT_DISK_SIZE))
+
+
+def set_cache_policy(host, ttl, negative_ttl=DEFAULT_NEGATIVE_TTL):
+    """
+    Caches all GET requests to the given host, unless a request specifies its own cache time
+    :param host: The host, as it appears in URLs (for example "gdata.youtube.com")
+    :param ttl: How long successful responses are cached, in seconds
+    :param negative_ttl: How long failed requests and error responses are cached, in seconds
+    :type host: str
+    :type ttl: int
+    :type negative_ttl: int
+    """
+    cache_policies[host.lower()] = (ttl, negative_ttl)
+
+
+def get_cache_stats():
+    """
+    Returns cache hits, misses, revalidations and negative (cached failure) hits for each host
+    :rtype: dict[str, dict[str, int]]
+    """
+    return {host: {"hits": stats.hits, "misses": stats.misses, "revalidated": stats.revalidated,
+                   "negative_hits": stats.negative_hits}
+            for host, stats in list(response_cache.stats.items())}
+
+
+def get_breaker_states():
+    """
+    Returns circuit breaker state for each host requested so far
+    :rtype: dict[str, dict[str, str | int | float]]
+    """
+    now = time.time()
+    states = {}
+    for host, policy in list(host_policies.items()):
+        opened_at = policy.opened_at
+        states[host] = {"state": policy.state, "failures": policy.failures, "rejected": policy.rejected,
+                        "retry_in": max(0, policy.cooldown - (now - opened_at)) if opened_at is not None else 0}
+    return states
+
+
+def reset_breaker(host):
+    """
+    Closes the circuit for the given host, returning False if no requests have been made to it
+    :type host: str
+    :rtype: bool
+    """
+    policy = host_policies.get(host.lower())
+    if policy is None:
+        return False
+    policy.reset()
+    return True
+
+
+def get_flight_stats():
+    """
+    Returns how many requests went through the single-flight helpers for each host, and how many of them shared
+    another caller's in-flight request
+    :rtype: dict[str, dict[str, int]]
+    """
+    with single_flight._lock:
+        return {host: dict(stats) for host, stats in single_flight.stats.items()}
+
+
+def get_stats():
+    """
+    Returns request statistics for each host, including how many connections have been opened to it. A host whose
+    connection count is much lower than its request count is having its connections reused.
+    :rtype: dict[str, dict[str, int | float]]
+    """
+    connections = {}
+    for adapter in session.adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host.lower()
+            if pool.port not in (80, 443, None):
+                host = "{}:{}".format(host, pool.port)
+            connections[host] = connections.get(host, 0) + pool.num_connections
+
+    with _stats_lock:
+        return {host: {"requests": stats.requests, "errors": stats.errors, "average_time": stats.average_time,
+                       "max_time": stats.max_time, "connections": connections.get(host, 0)}
+                for host, stats in request_stats.items()}
+
+
+class Response:
+    """
+    A file-like response, mimicking what urllib's opener used to return
+    :type url: str
+    :type code: int
+    :type headers: dict[str, str]
+    """
+
+    def __init__(self, url, code, headers, content):
+        """
+        :type url: str
+        :type code: int
+        :type headers: dict[str, str]
+        :type content: bytes
+        """
+        self.url = url
+        self.code = self.status = code
+        self.headers = headers
+        self._content = content
+
+    def read(self):
+        return self._content
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        pass
+
+
+def bind_arguments(func, args, kwargs):
+    """
+    Returns the arguments a call to func would be given, by name, with any extra keyword arguments merged in, so that
+    requests made with positional and keyword arguments can be compared. Returns None if the call is invalid.
+    :type func: callable
+    :type args: tuple
+    :type kwargs: dict
+    :rtype: dict | None
+    """
+    try:
+        bound = inspect.signature(func).bind(*args, **kwargs)
+    except TypeError:
+        return None
+    arguments = dict(bound.arguments)
+    arguments.update(arguments.pop("kwargs", {}))
+    return arguments
+
+
+def flight_key(kind, url, *, query_params=None, user_agent=None, post_data=None, referer=None, get_method=None,
+               cookies=False, headers=None, decode=True, **kwargs):
+    """
+    Returns the key identical requests share in the single-flight helpers, or None if the request shouldn't be shared
+    with anyone (it isn't a plain GET). The key is the normalized URL, including query parameters, and anything else
+    which could change the response. Everything after the URL must be passed by name, see bind_arguments().
+    :type kind: str
+    :rtype: tuple | None
+    """
+    if post_data is not None or cookies or get_method not in (None, "GET"):
+        return None
+
+    params = dict(query_params or {})
+    # options taken by open() itself, rather than query parameters
+    for option in ("timeout", "cache", "negative_cache", "max_size", "loop"):
+        kwargs.pop(option, None)
+    params.update(kwargs)
+
+    try:
+        url = urlnorm.normalize(prepare_url(url, params))
+    except Exception:
+        return None
+
+    return (kind, url, user_agent, referer, tuple(sorted((headers or {}).items())), decode)
+
+
+def _get(*args, **kwargs):
+    if kwargs.pop("decode", True):
         return open(*args, **kwargs).read().decode()
     else:
         return open(*args, **kwargs).read()
 
 
+def _shared_get(kind, parse, args, kwargs):
+    """
+    Fetches and parses a URL. Identical requests made at the same time, from any thread, share one fetch and one parsed
+    result, so callers shouldn't modify what they get back.
+    """
+    arguments = bind_arguments(open, args, kwargs)
+    key = None if arguments is None else flight_key(kind, **arguments)
+    if key is None:
+        return parse(_get(*args, **kwargs))
+    return single_flight.do(key, key[1], lambda: parse(_get(*args, **kwargs)))
+
+
+def get(*args, **kwargs):
+    return _shared_get("text", lambda text: text, args, kwargs)
+
+
 def get_url(*args, **kwargs):
     return open(*args, **kwargs).geturl()
 
 
 def get_html(*args, **kwargs):
-    return html.fromstring(get(*args, **kwargs))
+    return _shared_get("html", html.fromstring, args, kwargs)
 
 
 def get_soup(*args, **kwargs):
-    return BeautifulSoup(get(*args, **kwargs), 'lxml')
+    return _shared_get("soup", lambda text: BeautifulSoup(text, 'lxml'), args, kwargs)
 
 
 def get_xml(*args, **kwargs):
     kwargs["decode"] = False  # we don't want to decode, for etree
-    return etree.fromstring(get(*args, **kwargs))
+    return _shared_get("xml", etree.fromstring, args, kwargs)
 
 
 def get_json(*args, **kwargs):
-    return json.loads(get(*args, **kwargs))
+    return _shared_get("json", json.loads, args, kwargs)
+
+
+def _get_charset(content_type, data):
+    """
+    Finds the page encoding from the Content-Type header or a <meta> tag in the start of the page
+    :type content_type: str
+    :type data: bytes
+    :rtype: str
+    """
+    _, _, params = content_type.partition(";")
+    for param in params.split(";"):
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "charset" and value:
+            charset = value.strip("\"' ")
+            break
+    else:
+        match = charset_re.search(data)
+        charset = match.group(1).decode("ascii") if match else "utf-8"
+
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return "utf-8"
+
+
+def get_html_stream(url, query_params=None, user_agent=None, referer=None, headers=None, timeout=None,
+                    max_size=DEFAULT_STREAM_SIZE, stop_tags=None, **kwargs):
+    """
+    Fetches and parses an HTML page as it downloads, rather than reading the whole page and then parsing it.
+
+    Reading stops after max_size bytes, or as soon as one of stop_tags has been closed, and whatever has been parsed
+    by then is returned. Pages which aren't HTML (by their Content-Type) are rejected before any of the body is read.
+    :param max_size: The most bytes of the page to read
+    :param stop_tags: Tag names (for example ("title", "head")) to stop reading after
+    :type url: str
+    :type max_size: int
+    :type stop_tags: tuple[str]
+    :rtype: (lxml.html.HtmlElement, str)
+    :return: The parsed page, and the URL it was fetched from after redirects
+    """
+    if query_params is None:
+        query_params = {}
+
+    if user_agent is None:
+        user_agent = ua_cloudbot
+
+    query_params.update(kwargs)
+
+    url = prepare_url(url, query_params)
+
+    request_headers = {'User-Agent': user_agent}
+    if headers is not None:
+        request_headers.update(headers)
+    if referer is not None:
+        request_headers['Referer'] = referer
+
+    try:
+        response = session.get(url, headers=request_headers, timeout=timeout, stream=True)
+    except ServiceUnavailable:
+        raise
+    except requests.exceptions.RequestException as e:
+        raise URLError(e)
+
+    try:
+        if response.status_code >= 400:
+            raise HTTPError(response.url, response.status_code, response.reason, response.headers, None)
+
+        content_type = response.headers.get("content-type", "text/html")
+        if content_type.split(";", 1)[0].strip().lower() not in HTML_CONTENT_TYPES:
+            raise URLError("Not an HTML page ({})".format(content_type))
+
+        parser = None
+        size = 0
+        try:
+            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                if parser is None:
+                    # only the closing of stop_tags is reported, so events don't pile up for the rest of the page
+                    parser = etree.HTMLPullParser(events=("end",) if stop_tags else (), tag=stop_tags,
+                                                  encoding=_get_charset(content_type, chunk))
+                    parser.set_element_class_lookup(html.HtmlElementClassLookup())
+
+                chunk = chunk[:max_size - size]
+                size += len(chunk)
+                parser.feed(chunk)
+
+                if stop_tags and any(True for _ in parser.read_events()):
+                    break
+                if size >= max_size:
+                    break
+        except requests.exceptions.RequestException as e:
+            raise URLError(e)
+
+        page = parser.close() if parser is not None else None
+        if page is None:
+            raise URLError("Empty page")
+
+        return page, response.url
+    finally:
+        response.close()
+
+
+def cached_response(entry):
+    """
+    Returns a response for a cache entry, raising the cached error if it's a failure
+    :type entry: httpcache.CacheEntry
+    :rtype: Response
+    """
+    if entry.error is None:
+        return Response(entry.url, entry.status, entry.headers, entry.content)
+    elif isinstance(entry.error, tuple):
+        code, reason = entry.error
+        raise HTTPError(entry.url, code, reason, entry.headers, None)
+    else:
+        raise URLError(entry.error)
 
 
 def open(url, query_params=None, user_agent=None, post_data=None,
-         referer=None, get_method=None, cookies=False, timeout=None, headers=None, **kwargs):
+         referer=None, get_method=None, cookies=False, timeout=None, headers=None, cache=None, negative_cache=None,
+         **kwargs):
+    """
+    Makes a request using the shared session.
+
+    Errors are raised as urllib's HTTPError and URLError, which is what plugins expect from this module.
+
+    If cache is given, or a cache policy is set for the host, GET requests are cached for that many seconds. Stale
+    entries with an ETag or Last-Modified header are revalidated rather than fetched again, and failures are cached
+    for negative_cache seconds.
+    :rtype: Response
+    """
     if query_params is None:
         query_params = {}
 
@@ -71,29 +779,82 @@ def open(url, query_params=None, user_agent=None, post_data=None,
 
     url = prepare_url(url, query_params)
 
-    request = urllib.request.Request(url, post_data)
-
     if get_method is not None:
-        request.get_method = lambda: get_method
+        method = get_method
+    elif post_data is not None:
+        method = "POST"
+    else:
+        method = "GET"
 
+    request_headers = {}
     if headers is not None:
-        for header_key, header_value in headers.items():
-            request.add_header(header_key, header_value)
+        request_headers.update(headers)
 
-    request.add_header('User-Agent', user_agent)
+    request_headers['User-Agent'] = user_agent
 
     if referer is not None:
-        request.add_header('Referer', referer)
+        request_headers['Referer'] = referer
+
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    ttl, negative_ttl = cache_policies.get(host, (None, DEFAULT_NEGATIVE_TTL))
+    if cache is not None:
+        ttl = cache
+    if negative_cache is not None:
+        negative_ttl = negative_cache
+
+    cacheable = bool(ttl) and method == "GET" and not cookies
+    entry = None
+    if cacheable:
+        # keyed on the headers too, before the conditional ones are added
+        key = httpcache.cache_key(url, request_headers)
+        entry = response_cache.get(key)
+        if entry is not None and entry.is_fresh():
+            response_cache.record(host, "hits" if entry.error is None else "negative_hits")
+            return cached_response(entry)
+        if entry is not None and entry.error is None:
+            # stale, but we may be able to revalidate it rather than downloading it again
+            if entry.etag:
+                request_headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                request_headers['If-Modified-Since'] = entry.last_modified
+
+    try:
+        response = session.request(method, url, data=post_data, headers=request_headers, timeout=timeout,
+                                   cookies=jar if cookies else None)
+    except ServiceUnavailable:
+        raise
+    except requests.exceptions.RequestException as e:
+        if cacheable and negative_ttl:
+            response_cache.record(host, "misses")
+            response_cache.put(key, httpcache.CacheEntry(url, None, {}, b"", time.time() + negative_ttl, error=str(e)))
+        raise URLError(e)
 
     if cookies:
-        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
-    else:
-        opener = urllib.request.build_opener()
+        requests.cookies.extract_cookies_to_jar(jar, response.request, response.raw)
 
-    if timeout:
-        return opener.open(request, timeout=timeout)
-    else:
-        return opener.open(request)
+    if cacheable and response.status_code == 304 and entry is not None and entry.error is None:
+        response_cache.record(host, "revalidated")
+        entry.expires_at = time.time() + ttl
+        response_cache.put(key, entry)
+        return cached_response(entry)
+
+    if cacheable:
+        response_cache.record(host, "misses")
+
+    response_headers = {key: response.headers[key] for key in CACHED_HEADERS if key in response.headers}
+
+    if response.status_code >= 400:
+        if cacheable and negative_ttl:
+            response_cache.put(key, httpcache.CacheEntry(response.url, response.status_code, response_headers, b"",
+                                                         time.time() + negative_ttl,
+                                                         error=(response.status_code, response.reason)))
+        raise HTTPError(response.url, response.status_code, response.reason, response.headers, None)
+
+    if cacheable:
+        response_cache.put(key, httpcache.CacheEntry(response.url, response.status_code, response_headers,
+                                                     response.content, time.time() + ttl))
+
+    return Response(response.url, response.status_code, response.headers, response.content)
 
 
 def prepare_url(url, queries):
@@ -0,0 +1,237 @@
+"""
+http_fixtures.py - records HTTP responses to fixture files and replays them, for offline plugin tests and benchmarks
+
+While fixtures are in use, every request made through requests (so cloudbot.util.http, and plugins using requests
+directly) and through cloudbot.util.async_http is served from, or recorded to, a directory of fixture files.
+
+Usage:
+
+    with http_fixtures.use_fixtures("plugins/test/fixtures", mode="record"):
+        youtube.youtube("never gonna give you up")  # talks to the real API, saving each response
+
+    with http_fixtures.use_fixtures("plugins/test/fixtures", latency=0.05, fail_rate=0.1, seed=1):
+        youtube.youtube("never gonna give you up")  # served from the fixtures, no network needed
+"""
+
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+
+import requests
+import requests.adapters
+import requests.exceptions
+import requests.sessions
+import requests.structures
+import requests.utils
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class FixtureMissing(requests.exceptions.ConnectionError):
+    """
+    Raised in replay mode for a request which has no recorded fixture
+    """
+    pass
+
+
+class InjectedFailure(requests.exceptions.ConnectionError):
+    """
+    Raised in replay mode when a request is chosen to fail by failure injection
+    """
+    pass
+
+
+def request_key(method, url, body=None):
+    """
+    Returns the fixture name for a request. Query parameters are sorted, so the same request always maps to the same
+    fixture however its parameters were ordered.
+    :type method: str
+    :type url: str
+    :type body: bytes | str | None
+    :rtype: str
+    """
+    scheme, netloc, path, query, fragment = urllib.parse.urlsplit(url)
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(query, keep_blank_values=True)))
+    url = urllib.parse.urlunsplit((scheme.lower(), netloc.lower(), path, query, ""))
+
+    digest = hashlib.sha1("{} {}".format(method.upper(), url).encode("utf-8"))
+    if body:
+        digest.update(body.encode("utf-8") if isinstance(body, str) else body)
+    return "{}-{}".format(netloc.lower().replace(":", "_"), digest.hexdigest()[:16])
+
+
+class FixtureStore:
+    """
+    A directory of recorded responses, one JSON file per request
+    :type path: str
+    :type mode: str
+    :type latency: float | (float, float)
+    :type fail_rate: float
+    :type fail_status: int | None
+    """
+
+    def __init__(self, path, mode=REPLAY, latency=0, fail_rate=0, fail_status=None, seed=0):
+        """
+        :param path: The fixture directory
+        :param mode: RECORD to make real requests and save them, REPLAY to serve saved responses
+        :param latency: Seconds to delay each replayed response by, or a (min, max) range to pick from
+        :param fail_rate: The fraction of replayed requests to fail, between 0 and 1
+        :param fail_status: The status code failed requests respond with. If None, they raise a connection error.
+        :param seed: Seeds latency and failure choices, so runs with the same seed behave the same
+        """
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("Invalid fixture mode {}".format(mode))
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        if mode == RECORD:
+            os.makedirs(path, exist_ok=True)
+
+    def _fixture_path(self, method, url, body):
+        return os.path.join(self.path, request_key(method, url, body) + ".json")
+
+    def load(self, method, url, body=None):
+        """
+        Returns the recorded (status, reason, headers, content) for a request
+        :rtype: (int, str, dict[str, str], bytes)
+        """
+        path = self._fixture_path(method, url, body)
+        try:
+            with open(path, encoding="utf-8") as f:
+                fixture = json.load(f)
+        except FileNotFoundError:
+            raise FixtureMissing("No fixture recorded for {} {} ({})".format(method, url, path))
+
+        if fixture.get("encoding") == "base64":
+            content = base64.b64decode(fixture["body"])
+        else:
+            content = fixture["body"].encode("utf-8")
+        return fixture["status"], fixture["reason"], fixture["headers"], content
+
+    def save(self, method, url, body, status, reason, headers, content):
+        """
+        :type method: str
+        :type url: str
+        :type body: bytes | str | None
+        :type status: int
+        :type reason: str
+        :type headers: dict[str, str]
+        :type content: bytes
+        """
+        fixture = {"method": method, "url": url, "status": status, "reason": reason, "headers": dict(headers)}
+        # the body is stored already decoded, so the encoding headers no longer apply
+        for header in list(fixture["headers"]):
+            if header.lower() in ("content-encoding", "transfer-encoding", "content-length"):
+                del fixture["headers"][header]
+        try:
+            fixture["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            fixture["body"] = base64.b64encode(content).decode("ascii")
+            fixture["encoding"] = "base64"
+
+        path = self._fixture_path(method, url, body)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(fixture, f, indent=2, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def choose(self):
+        """
+        Picks the latency and whether to fail for the next replayed request
+        :rtype: (float, bool)
+        """
+        with self._lock:
+            if isinstance(self.latency, (tuple, list)):
+                latency = self._random.uniform(*self.latency)
+            else:
+                latency = self.latency
+            failed = self.fail_rate > 0 and self._random.random() < self.fail_rate
+        return latency, failed
+
+
+class FixtureAdapter(requests.adapters.BaseAdapter):
+    """
+    A requests transport adapter serving requests from, or recording them to, a FixtureStore
+    :type store: FixtureStore
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self._real_adapter = requests.adapters.HTTPAdapter()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.store.mode == RECORD:
+            response = self._real_adapter.send(request, stream=False, timeout=timeout, verify=verify, cert=cert,
+                                               proxies=proxies)
+            self.store.save(request.method, request.url, request.body, response.status_code, response.reason,
+                            response.headers, response.content)
+            return response
+
+        latency, failed = self.store.choose()
+        if latency:
+            time.sleep(latency)
+        if failed and self.store.fail_status is None:
+            raise InjectedFailure("Injected failure for {}".format(request.url), request=request)
+
+        if failed:
+            status, reason, headers, content = self.store.fail_status, "Injected failure", {}, b""
+        else:
+            status, reason, headers, content = self.store.load(request.method, request.url, request.body)
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response._content = content
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+    def close(self):
+        self._real_adapter.close()
+
+
+# the store in use, checked by cloudbot.util.async_http
+active_store = None
+
+
+@contextmanager
+def use_fixtures(path, mode=REPLAY, latency=0, fail_rate=0, fail_status=None, seed=0):
+    """
+    Serves all HTTP requests made inside the with block from fixtures (or records them to fixtures)
+    :rtype: FixtureStore
+    """
+    global active_store
+    store = FixtureStore(path, mode, latency, fail_rate, fail_status, seed)
+    adapter = FixtureAdapter(store)
+    original_get_adapter = requests.sessions.Session.get_adapter
+
+    def get_adapter(session, url):
+        if url.lower().startswith(("http://", "https://")):
+            return adapter
+        return original_get_adapter(session, url)
+
+    requests.sessions.Session.get_adapter = get_adapter
+    previous_store, active_store = active_store, store
+    try:
+        yield store
+    finally:
+        requests.sessions.Session.get_adapter = original_get_adapter
+        active_store = previous_store
+        adapter.close()
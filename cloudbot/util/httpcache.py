@@ -0,0 +1,245 @@
+"""
+httpcache.py - a size-bounded cache of HTTP responses, used by cloudbot.util.http
+
+Entries are kept in an in-memory LRU, and optionally written through to a directory on disk so they survive restarts.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("cloudbot")
+
+DEFAULT_MEMORY_SIZE = 8 * 1024 * 1024
+DEFAULT_DISK_SIZE = 64 * 1024 * 1024
+
+
+def cache_key(url, headers=None):
+    """
+    Returns the key a response is cached under. Responses to the same URL can differ with the request's headers (its
+    Accept, user agent or an API key), so those are part of the key, hashed so header values aren't kept in the cache.
+    :type url: str
+    :type headers: dict[str, str]
+    :rtype: str
+    """
+    if not headers:
+        return url
+    header_lines = sorted("{}: {}".format(name.lower(), value) for name, value in headers.items())
+    return "{} {}".format(url, hashlib.sha1("\n".join(header_lines).encode("utf-8")).hexdigest())
+
+
+class CacheEntry:
+    """
+    A cached response, or a cached failure if error is set
+    :type url: str
+    :type status: int
+    :type headers: dict[str, str]
+    :type content: bytes
+    :type error: (int, str) | str | None
+    :type expires_at: float
+    """
+    __slots__ = ("url", "status", "headers", "content", "error", "expires_at")
+
+    def __init__(self, url, status, headers, content, expires_at, error=None):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.expires_at = expires_at
+        self.error = error
+
+    @property
+    def size(self):
+        return len(self.content) + len(self.url) + 256
+
+    @property
+    def etag(self):
+        return self.headers.get("etag")
+
+    @property
+    def last_modified(self):
+        return self.headers.get("last-modified")
+
+    def is_fresh(self, now=None):
+        if now is None:
+            now = time.time()
+        return now < self.expires_at
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class CacheStats:
+    """
+    :type hits: int
+    :type misses: int
+    :type revalidated: int
+    :type negative_hits: int
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.negative_hits = 0
+
+
+class ResponseCache:
+    """
+    :type max_size: int
+    :type disk_dir: str | None
+    :type max_disk_size: int
+    :type stats: dict[str, CacheStats]
+    """
+
+    def __init__(self, max_size=DEFAULT_MEMORY_SIZE, disk_dir=None, max_disk_size=DEFAULT_DISK_SIZE):
+        self.max_size = max_size
+        self.disk_dir = disk_dir
+        self.max_disk_size = max_disk_size
+        self.stats = {}
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+        if self.disk_dir is not None:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_size = sum(os.path.getsize(path) for path in self._disk_files())
+
+    def get(self, key):
+        """
+        Returns the entry for the given key, whether or not it is still fresh, or None
+        :type key: str
+        :rtype: CacheEntry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        if self.disk_dir is None:
+            return None
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._put_memory(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        """
+        :type key: str
+        :type entry: CacheEntry
+        """
+        if entry.size > self.max_size:
+            return
+        self._put_memory(key, entry)
+        if self.disk_dir is not None:
+            self._write_disk(key, entry)
+
+    def record(self, host, kind):
+        """
+        Counts a cache hit, miss, revalidation or negative hit for the given host
+        :type host: str
+        :type kind: str
+        """
+        with self._lock:
+            stats = self.stats.get(host)
+            if stats is None:
+                stats = self.stats[host] = CacheStats()
+            setattr(stats, kind, getattr(stats, kind) + 1)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _put_memory(self, key, entry):
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._size -= old_entry.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+
+    # Disk tier
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def _disk_files(self):
+        return [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if not name.endswith(".tmp")]
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                stored_key, entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.debug("Discarding unreadable HTTP cache file {}".format(path))
+            self._remove_disk(path)
+            return None
+
+        if stored_key != key:
+            # hash collision, treat as a miss
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        path = self._disk_path(key)
+        temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(temp_path, "wb") as f:
+                pickle.dump((key, entry), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+            new_size = os.path.getsize(path)
+        except OSError:
+            logger.exception("Couldn't write HTTP cache file {}".format(path))
+            return
+
+        with self._lock:
+            self._disk_size += new_size - old_size
+            over_size = self._disk_size > self.max_disk_size
+
+        if over_size:
+            self._prune_disk()
+
+    def _remove_disk(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_size -= size
+
+    def _prune_disk(self):
+        """Removes the oldest files until the disk tier is back under 80% of its maximum size"""
+        files = []
+        for path in self._disk_files():
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                # removed by another thread
+                continue
+        files.sort()
+        target = self.max_disk_size * 0.8
+        for _, path in files:
+            if self._disk_size <= target:
+                break
+            self._remove_disk(path)
@@ -0,0 +1,335 @@
+"""
+links.py - finds links in messages, for dispatching them to url hooks by host
+"""
+
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+from cloudbot.util import urlnorm
+
+# seconds a link is remembered for in a channel, repeats within this are only handled once
+DEFAULT_DEDUP_WINDOW = 30
+# most links remembered at once, across all channels
+MAX_RECENT_LINKS = 4096
+
+# seconds a url hook's reply to a link is reused for, unless the hook or the config says otherwise
+DEFAULT_PREVIEW_TTL = 600
+# number of link previews kept in memory, in front of the preview database
+PREVIEW_CACHE_SIZE = 2048
+# puts between sweeps of expired previews from the database
+PREVIEW_SWEEP_INTERVAL = 500
+
+logger = logging.getLogger("cloudbot")
+
+_STOP = object()
+
+# a URL with a scheme or a www. prefix, or a bare domain followed by a path
+url_re = re.compile(r"(?:https?://|www\.)[^\s<>\"']+|\b(?:[a-z0-9-]+\.)+[a-z]{2,}/[^\s<>\"']*", re.I)
+
+# punctuation which ends a sentence rather than a URL
+trailing_punctuation = ".,!?;:'\""
+
+
+def _strip_trailing(url):
+    """
+    :type url: str
+    :rtype: str
+    """
+    while url:
+        if url[-1] in trailing_punctuation:
+            url = url[:-1]
+        elif url[-1] == ")" and url.count(")") > url.count("("):
+            # a link in parentheses, rather than a link with parentheses in it
+            url = url[:-1]
+        else:
+            break
+    return url
+
+
+def find_urls(text):
+    """
+    Returns the normalized URLs linked in text, in order, without repeats
+    :type text: str
+    :rtype: list[str]
+    """
+    if "." not in text:
+        # every link we look for has a dot in it, and most messages have no links at all
+        return []
+
+    urls = []
+    for match in url_re.finditer(text):
+        url = _strip_trailing(match.group())
+        try:
+            url = urlnorm.normalize(url, assume_scheme="http")
+        except Exception:
+            continue
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def get_host(url):
+    """
+    :type url: str
+    :rtype: str
+    """
+    return (urllib.parse.urlsplit(url).hostname or "").lower()
+
+
+def parent_domains(host):
+    """
+    Returns the host, followed by each domain it's a subdomain of: "m.youtube.com" gives
+    ["m.youtube.com", "youtube.com", "com"]
+    :type host: str
+    :rtype: list[str]
+    """
+    parts = host.split(".")
+    return [".".join(parts[i:]) for i in range(len(parts))]
+
+
+class RecentLinks:
+    """
+    Remembers which links have recently been handled in each channel, so a link repeated within the window (pasted
+    twice, or relayed from another channel) is only handled once, by all url hooks together.
+    :type window: float
+    :type max_size: int
+    """
+
+    def __init__(self, window=DEFAULT_DEDUP_WINDOW, max_size=MAX_RECENT_LINKS):
+        self.window = window
+        self.max_size = max_size
+        self.duplicates = 0
+        self._seen = OrderedDict()
+
+    def _expire(self, now):
+        # entries are kept in the order they were last seen in, so expired ones are all at the front
+        while self._seen:
+            oldest_key, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.window and len(self._seen) < self.max_size:
+                break
+            del self._seen[oldest_key]
+
+    def seen(self, key, now=None):
+        """
+        Returns True, counting it as a duplicate, if key has been handled within the window
+        :type key: tuple
+        :rtype: bool
+        """
+        if now is None:
+            now = time.time()
+        self._expire(now)
+        if key in self._seen:
+            self.duplicates += 1
+            return True
+        return False
+
+    def record(self, key, now=None):
+        """
+        Records key as handled. This is done once a url hook has got past the sieves, so a link from an ignored or
+        rate limited user doesn't stop anyone else's being handled.
+        :type key: tuple
+        """
+        if now is None:
+            now = time.time()
+        self._expire(now)
+        self._seen[key] = now
+        self._seen.move_to_end(key)
+
+
+class PreviewStats:
+    """
+    :type hits: int
+    :type misses: int
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+
+class PreviewCache:
+    """
+    Remembers the reply each url hook gave for each link, so a reposted link is answered without any network requests
+    or parsing. A preview is the lines of the reply, the first of which is sent as a reply and the rest as messages.
+
+    Previews are kept in a bounded in-memory LRU, in front of an SQLite database if a path is given, so they survive
+    restarts. get() only looks in memory, so it's safe to call from the event loop; load() reads through to the
+    database, and should be run in an executor. Previews are written to the database from a background thread.
+    :type max_size: int
+    :type ttl_overrides: dict[str, int]
+    :type stats: dict[str, PreviewStats]
+    """
+
+    def __init__(self, path=None, max_size=PREVIEW_CACHE_SIZE, ttl_overrides=None):
+        """
+        :param ttl_overrides: domain -> seconds, overriding the TTL hooks ask for on links to that domain
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttl_overrides = {domain.lower(): ttl for domain, ttl in (ttl_overrides or {}).items()}
+        self.stats = {}
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        if path is not None:
+            db = sqlite3.connect(path)
+            try:
+                db.execute("create table if not exists link_previews (key text primary key, preview text not null, "
+                           "expires_at real not null)")
+                db.commit()
+            finally:
+                db.close()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name="link preview writer", daemon=True)
+            self._thread.start()
+
+    @property
+    def persistent(self):
+        return self._queue is not None
+
+    def get_ttl(self, host, hook_ttl):
+        """
+        Returns how long previews of links to host should be kept for
+        :type host: str
+        :type hook_ttl: int
+        :rtype: int
+        """
+        for domain in parent_domains(host):
+            if domain in self.ttl_overrides:
+                return self.ttl_overrides[domain]
+        return hook_ttl
+
+    def record(self, host, hit):
+        """
+        Counts a preview of a link to host as answered from the cache or not
+        :type host: str
+        :type hit: bool
+        """
+        with self._lock:
+            stats = self.stats.get(host)
+            if stats is None:
+                stats = self.stats[host] = PreviewStats()
+            if hit:
+                stats.hits += 1
+            else:
+                stats.misses += 1
+
+    def get(self, key, now=None):
+        """
+        Returns the preview for key kept in memory, or None
+        :type key: str
+        :rtype: tuple[str] | None
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None or entry[1] <= now:
+                return None
+            self._memory.move_to_end(key)
+            return entry[0]
+
+    def load(self, key, now=None):
+        """
+        Returns the preview for key from the database, keeping it in memory, or None. This blocks on disk I/O.
+        :type key: str
+        :rtype: tuple[str] | None
+        """
+        if self.path is None:
+            return None
+        if now is None:
+            now = time.time()
+        try:
+            db = sqlite3.connect(self.path)
+            try:
+                entry = db.execute("select preview, expires_at from link_previews where key = ?", (key,)).fetchone()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            logger.exception("Couldn't load link preview")
+            return None
+        if entry is None or entry[1] <= now:
+            return None
+        lines = tuple(entry[0].split("\n"))
+        with self._lock:
+            self._remember(key, (lines, entry[1]))
+        return lines
+
+    def put(self, key, lines, ttl, now=None):
+        """
+        :type key: str
+        :type lines: collections.Iterable[str]
+        :type ttl: int
+        """
+        if now is None:
+            now = time.time()
+        entry = (tuple(lines), now + ttl)
+        with self._lock:
+            self._remember(key, entry)
+        if self._queue is not None:
+            self._queue.put((key, "\n".join(entry[0]), entry[1]))
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _run(self):
+        db = sqlite3.connect(self.path)
+        puts = 0
+        try:
+            while True:
+                item = self._queue.get()
+                batch = []
+                stopping = False
+                while item is not None:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+
+                if batch:
+                    try:
+                        with db:
+                            db.executemany("insert or replace into link_previews (key, preview, expires_at) "
+                                           "values (?, ?, ?)", batch)
+                            if puts // PREVIEW_SWEEP_INTERVAL != (puts + len(batch)) // PREVIEW_SWEEP_INTERVAL:
+                                db.execute("delete from link_previews where expires_at <= ?", (time.time(),))
+                    except sqlite3.Error:
+                        logger.exception("Couldn't save {} link previews".format(len(batch)))
+                    puts += len(batch)
+
+                if stopping:
+                    return
+        finally:
+            db.close()
+
+    def get_stats(self):
+        """
+        Returns preview cache hits and misses for each domain
+        :rtype: dict[str, dict[str, int]]
+        """
+        with self._lock:
+            return {host: {"hits": stats.hits, "misses": stats.misses} for host, stats in self.stats.items()}
+
+    def close(self, timeout=None):
+        """
+        Saves all queued previews, then stops the writer thread
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
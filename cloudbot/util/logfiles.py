@@ -0,0 +1,395 @@
+"""
+logfiles.py - keeps an index of the channel and raw log files, and compresses and prunes old ones in the background
+
+The index lives in logs/index.json, so log tools can find the files for a server, channel or date without walking the
+log directories.
+"""
+
+import datetime
+import gzip
+import json
+import logging
+import lzma
+import os
+import re
+import threading
+import time
+
+# seconds between maintenance passes
+DEFAULT_INTERVAL = 3600
+# seconds a finished day's log must have gone unwritten for before it's compressed
+SETTLE_TIME = 600
+# bytes compressed between pauses
+CHUNK_SIZE = 1024 * 1024
+# fraction of its time the maintenance thread spends compressing, it sleeps for the rest
+DUTY_CYCLE = 0.5
+
+compressors = {
+    "gzip": (".gz", gzip.open),
+    "xz": (".xz", lzma.open),
+}
+
+log_file_re = re.compile(r"^(?P<server>.+?)_(?P<chan>[#&!+].*)_(?P<date>\d{8})\.log(?P<ext>\.gz|\.xz)?$")
+# private message logs are named after the nick instead of a channel
+private_file_format = r"^(?P<server>{})_(?P<chan>.+)_(?P<date>\d{{8}})\.log(?P<ext>\.gz|\.xz)?$"
+raw_file_re = re.compile(r"^(?P<server>.+)_(?P<date>\d{8})\.log(?P<ext>\.gz|\.xz)?$")
+year_re = re.compile(r"^\d{4}$")
+
+logger = logging.getLogger("cloudbot")
+
+
+def open_log(path):
+    """
+    Opens a log file for reading as text, whether or not it has been compressed
+    :type path: str
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    elif path.endswith(".xz"):
+        return lzma.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def parse_date(date):
+    """
+    :type date: str
+    :rtype: datetime.date
+    """
+    return datetime.datetime.strptime(date, "%Y%m%d").date()
+
+
+class LogIndex:
+    """
+    The log files on disk, keyed by their path relative to the log directory. Each entry is a dict with the "server",
+    "chan" (None for raw logs), "date" (YYYYMMDD), "size" and "compressed" of the file, and "original_size" once it has
+    been compressed.
+    :type log_dir: str
+    :type files: dict[str, dict]
+    """
+
+    def __init__(self, log_dir, servers=None):
+        """
+        :param servers: The names of the bot's connections. Both server names and nicks can have underscores in them,
+                        so private message logs can only be told apart reliably when these are known; otherwise the
+                        server name is taken to end at the first underscore.
+        :type servers: list[str]
+        """
+        self.log_dir = log_dir
+        self.files = {}
+        self._lock = threading.RLock()
+        if servers:
+            # longest first, so a server named like another plus a suffix isn't cut short
+            names = sorted((re.escape(server.lower()) for server in servers), key=len, reverse=True)
+            self._private_file_re = re.compile(private_file_format.format("|".join(names)))
+        else:
+            self._private_file_re = re.compile(private_file_format.format("[^_]+"))
+
+    def _match(self, name, raw):
+        if raw:
+            return raw_file_re.match(name)
+        return log_file_re.match(name) or self._private_file_re.match(name)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.log_dir, "index.json")
+
+    def load(self):
+        """
+        Loads the saved index, returning False if there wasn't one
+        :rtype: bool
+        """
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                files = json.load(f)
+        except FileNotFoundError:
+            return False
+        except ValueError:
+            logger.warning("Log index {} is corrupt, rebuilding it".format(self.index_path))
+            return False
+        with self._lock:
+            self.files = files
+        return True
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self.files, sort_keys=True)
+        with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _year_dirs(self, full):
+        """
+        Returns the (directory, relative directory, is raw) of each year's logs to scan. Unless full is set, only the
+        current and previous year are scanned, as older directories only change through maintenance.
+        """
+        if full:
+            years = set()
+            for parent in (self.log_dir, os.path.join(self.log_dir, "raw")):
+                if os.path.isdir(parent):
+                    years.update(name for name in os.listdir(parent) if year_re.match(name))
+        else:
+            current_year = time.gmtime().tm_year
+            years = {str(current_year), str(current_year - 1)}
+
+        for year in sorted(years):
+            yield os.path.join(self.log_dir, year), year, False
+            yield os.path.join(self.log_dir, "raw", year), "raw/" + year, True
+
+    def scan(self, full=False):
+        """
+        Adds log files which have appeared since the last scan to the index, and drops ones which have gone
+        """
+        for directory, rel_directory, raw in self._year_dirs(full):
+            try:
+                names = os.listdir(directory)
+            except FileNotFoundError:
+                names = []
+            found = set()
+            for name in names:
+                match = self._match(name, raw)
+                if match is None:
+                    continue
+                rel_path = rel_directory + "/" + name
+                found.add(rel_path)
+                try:
+                    size = os.path.getsize(os.path.join(directory, name))
+                except OSError:
+                    continue
+                with self._lock:
+                    entry = self.files.get(rel_path)
+                    if entry is None:
+                        entry = self.files[rel_path] = {
+                            "server": match.group("server"), "chan": None if raw else match.group("chan"),
+                            "date": match.group("date"), "compressed": match.group("ext") is not None
+                        }
+                    entry["size"] = size
+
+            with self._lock:
+                for rel_path in [rel_path for rel_path in self.files if rel_path.startswith(rel_directory + "/")]:
+                    if rel_path not in found:
+                        del self.files[rel_path]
+
+    def find(self, server=None, chan=None, raw=False, since=None):
+        """
+        Returns the (relative path, entry) of each matching log file, oldest first
+        :type server: str
+        :type chan: str
+        :param since: Only return files from this date (YYYYMMDD) onwards
+        :rtype: list[(str, dict)]
+        """
+        results = []
+        for rel_path, entry in self.items():
+            if (entry["chan"] is None) != raw:
+                continue
+            if server is not None and entry["server"] != server.lower():
+                continue
+            if chan is not None and entry["chan"] != chan.lower():
+                continue
+            if since is not None and entry["date"] < since:
+                continue
+            results.append((rel_path, entry))
+        results.sort(key=lambda item: (item[1]["date"], item[0]))
+        return results
+
+    def items(self):
+        """
+        :rtype: list[(str, dict)]
+        """
+        with self._lock:
+            return list(self.files.items())
+
+    def get_path(self, rel_path):
+        return os.path.join(self.log_dir, *rel_path.split("/"))
+
+    def replace(self, rel_path, new_rel_path, entry):
+        with self._lock:
+            self.files.pop(rel_path, None)
+            self.files[new_rel_path] = entry
+
+    def remove(self, rel_path):
+        with self._lock:
+            self.files.pop(rel_path, None)
+
+
+class LogMaintainer:
+    """
+    Compresses each finished day's logs, and deletes logs older than the retention limits, from a background thread
+    :type index: LogIndex
+    :type compression: str | None
+    :type retention_days: int
+    :type raw_retention_days: int
+    :type server_retention: dict[str, dict[str, int]]
+    """
+
+    def __init__(self, index, compression="gzip", retention_days=0, raw_retention_days=0, server_retention=None,
+                 interval=DEFAULT_INTERVAL):
+        """
+        :param compression: "gzip", "xz", or None to leave logs uncompressed
+        :param retention_days: Days to keep channel logs for, or 0 to keep them forever
+        :param raw_retention_days: Days to keep raw logs for, or 0 to keep them forever
+        :param server_retention: server name -> {"retention_days": int, "raw_retention_days": int} overrides
+        """
+        if compression is not None and compression not in compressors:
+            raise ValueError("Unknown log compression {}".format(compression))
+        self.index = index
+        self.compression = compression
+        self.retention_days = retention_days
+        self.raw_retention_days = raw_retention_days
+        self.server_retention = {server.lower(): limits for server, limits in (server_retention or {}).items()}
+        self.interval = interval
+
+        self.files_compressed = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.compress_time = 0.0
+        self.files_deleted = 0
+        self.bytes_deleted = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="log maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        full = not self.index.load()
+        while not self._stop_event.is_set():
+            try:
+                self.run_once(full=full)
+            except Exception:
+                logger.exception("Error maintaining log files")
+            full = False
+            self._stop_event.wait(self.interval)
+
+    def run_once(self, full=False, now=None):
+        """
+        Refreshes the index, then compresses and prunes log files
+        """
+        if now is None:
+            now = time.time()
+        today = datetime.datetime.utcfromtimestamp(now).date()
+
+        self.index.scan(full=full)
+        for rel_path, entry in self.index.items():
+            if self._stop_event.is_set():
+                break
+            age = (today - parse_date(entry["date"])).days
+            limit = self._get_retention(entry)
+            if limit and age > limit:
+                self._delete(rel_path, entry)
+            elif self.compression is not None and not entry["compressed"] and age >= 1:
+                path = self.index.get_path(rel_path)
+                try:
+                    settled = now - os.path.getmtime(path) >= SETTLE_TIME
+                except OSError:
+                    continue
+                if settled:
+                    self._compress(rel_path, entry)
+
+        self.index.save()
+
+    def _get_retention(self, entry):
+        key = "retention_days" if entry["chan"] is not None else "raw_retention_days"
+        limits = self.server_retention.get(entry["server"], {})
+        return limits.get(key, getattr(self, key))
+
+    def _delete(self, rel_path, entry):
+        try:
+            os.remove(self.index.get_path(rel_path))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.exception("Couldn't delete old log file {}".format(rel_path))
+            return
+        self.index.remove(rel_path)
+        self.files_deleted += 1
+        self.bytes_deleted += entry["size"]
+
+    def _compress(self, rel_path, entry):
+        extension, open_compressed = compressors[self.compression]
+        path = self.index.get_path(rel_path)
+        new_path = path + extension
+        busy_time = 0.0
+        try:
+            with open(path, "rb") as source, open_compressed(new_path + ".tmp", "wb") as dest:
+                while not self._stop_event.is_set():
+                    start = time.perf_counter()
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    elapsed = time.perf_counter() - start
+                    busy_time += elapsed
+                    # yield to the rest of the bot, so compressing a large log never hogs the CPU
+                    time.sleep(elapsed * (1 - DUTY_CYCLE) / DUTY_CYCLE)
+            if self._stop_event.is_set():
+                os.remove(new_path + ".tmp")
+                return
+            os.replace(new_path + ".tmp", new_path)
+            stat = os.stat(path)
+            os.utime(new_path, (stat.st_atime, stat.st_mtime))
+            os.remove(path)
+        except OSError:
+            logger.exception("Couldn't compress log file {}".format(rel_path))
+            return
+
+        new_entry = dict(entry, compressed=True, original_size=entry["size"], size=os.path.getsize(new_path))
+        self.index.replace(rel_path, rel_path + extension, new_entry)
+        self.files_compressed += 1
+        self.bytes_before += new_entry["original_size"]
+        self.bytes_after += new_entry["size"]
+        self.compress_time += busy_time
+
+    def get_stats(self):
+        """
+        :rtype: dict[str, int | float]
+        """
+        entries = [entry for _, entry in self.index.items()]
+        return {
+            "files": len(entries),
+            "size": sum(entry["size"] for entry in entries),
+            "compressed_files": sum(1 for entry in entries if entry["compressed"]),
+            "saved": sum(entry.get("original_size", entry["size"]) - entry["size"] for entry in entries),
+            "files_compressed": self.files_compressed,
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_after,
+            "compress_time": self.compress_time,
+            "files_deleted": self.files_deleted,
+            "bytes_deleted": self.bytes_deleted,
+        }
+
+
+index = None
+maintainer = None
+
+
+def configure(config, log_dir, servers=None):
+    """
+    Sets up the log index, and starts log maintenance as set up in the "logging" section of the config
+    :type config: dict
+    :type log_dir: str
+    :param servers: The names of the bot's connections, as used in log file names
+    :type servers: list[str]
+    """
+    global index, maintainer
+    logging_config = config.get("logging", {})
+    stop()
+    index = LogIndex(log_dir, servers)
+    maintainer = LogMaintainer(index, logging_config.get("compression", "gzip"),
+                               logging_config.get("retention_days", 0), logging_config.get("raw_retention_days", 0),
+                               logging_config.get("server_retention"),
+                               logging_config.get("maintenance_interval", DEFAULT_INTERVAL))
+    maintainer.start()
+
+
+def stop():
+    if maintainer is not None:
+        maintainer.stop()
@@ -0,0 +1,270 @@
+"""
+logsearch.py - a full-text index of channel messages, for searching what was said and when
+
+Messages are queued by add(), and written to an SQLite FTS5 index in batches from a background thread.
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# seconds between writes of queued messages to the index
+DEFAULT_FLUSH_INTERVAL = 1.0
+# most messages written to the index in one transaction
+MAX_BATCH_SIZE = 5000
+
+# kinds of message stored
+MESSAGE = 0
+ACTION = 1
+NOTICE = 2
+
+logger = logging.getLogger("cloudbot")
+
+_STOP = object()
+
+# the channel and nick of each line are indexed as tokens alongside its content, so searches within a channel or by a
+# nick are answered entirely by the full-text index. hex() keeps them to a single token each. The lower-cased nick is
+# stored rather than using SQLite's lower(), which only lower-cases ASCII and so wouldn't match searches' nick.lower().
+schema = [
+    "create table if not exists log_lines (id integer primary key, time integer not null, server text not null, "
+    "chan text not null, nick text not null, kind integer not null, content text not null, nick_lower text)",
+    "create index if not exists log_lines_chan_time on log_lines (server, chan, time)",
+    "create virtual table if not exists log_lines_fts using fts5(content, chan_key, nick_key, content='')",
+    "create trigger if not exists log_lines_insert after insert on log_lines begin "
+    "insert into log_lines_fts (rowid, content, chan_key, nick_key) "
+    "values (new.id, new.content, hex(new.server || ' ' || new.chan), hex(new.nick_lower)); end",
+    "create trigger if not exists log_lines_delete after delete on log_lines begin "
+    "insert into log_lines_fts (log_lines_fts, rowid, content, chan_key, nick_key) "
+    "values ('delete', old.id, old.content, hex(old.server || ' ' || old.chan), hex(old.nick_lower)); end",
+]
+
+
+def _upgrade(db):
+    """
+    Adds the nick_lower column to an index made before it existed, and indexes every line again with it, as lines with
+    non-ASCII nicks were indexed under a nick key no search could match
+    :type db: sqlite3.Connection
+    :return: Whether the index needs to be filled in again, once the schema is created
+    :rtype: bool
+    """
+    columns = [row[1] for row in db.execute("pragma table_info(log_lines)")]
+    if not columns or "nick_lower" in columns:
+        return False
+    db.execute("alter table log_lines add column nick_lower text")
+    rows = db.execute("select id, nick from log_lines").fetchall()
+    db.executemany("update log_lines set nick_lower = ? where id = ?",
+                   ((nick.lower(), row_id) for row_id, nick in rows))
+    db.execute("drop trigger if exists log_lines_insert")
+    db.execute("drop trigger if exists log_lines_delete")
+    db.execute("drop table if exists log_lines_fts")
+    return True
+
+
+def _key(*parts):
+    """
+    Returns the token a channel or nick is indexed as, matching the hex() in the insert trigger
+    :rtype: str
+    """
+    return '"{}"'.format(" ".join(parts).encode("utf-8").hex().upper())
+
+
+class SearchResult:
+    """
+    :type time: int
+    :type nick: str
+    :type kind: int
+    :type content: str
+    """
+
+    __slots__ = ("time", "nick", "kind", "content")
+
+    def __init__(self, time, nick, kind, content):
+        self.time = time
+        self.nick = nick
+        self.kind = kind
+        self.content = content
+
+
+def build_query(text):
+    """
+    Turns a user's search into an FTS5 query matching lines containing every word, so that quotes, operators and
+    column filters in the search can't cause syntax errors. Prefix searches aren't supported, as they're slow on
+    common words without a much larger index.
+    :type text: str
+    :rtype: str
+    """
+    terms = []
+    for word in text.split():
+        word = word.strip("*")
+        if word:
+            terms.append('"{}"'.format(word.replace('"', '""')))
+    return " ".join(terms)
+
+
+class LogSearchIndex:
+    """
+    :type path: str
+    :type flush_interval: float
+    """
+
+    def __init__(self, path, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lines_indexed = 0
+
+        db = self._connect()
+        try:
+            with db:
+                reindex = _upgrade(db)
+                for statement in schema:
+                    db.execute(statement)
+                if reindex:
+                    db.execute("insert into log_lines_fts (rowid, content, chan_key, nick_key) "
+                               "select id, content, hex(server || ' ' || chan), hex(nick_lower) from log_lines")
+        finally:
+            db.close()
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="log search indexer", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # lets searches read the index while the indexer is writing to it
+        db.execute("pragma journal_mode = wal")
+        db.execute("pragma synchronous = normal")
+        return db
+
+    def add(self, timestamp, server, chan, nick, kind, content):
+        """
+        Queues a message to be indexed
+        :type timestamp: float
+        :type server: str
+        :type chan: str
+        :type nick: str
+        :type kind: int
+        :type content: str
+        """
+        self._queue.put((int(timestamp), server.lower(), chan.lower(), nick, nick.lower(), kind, content))
+
+    def close(self, timeout=None):
+        """
+        Indexes all queued messages, then stops the indexer thread
+        """
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        db = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is not _STOP:
+                    # let messages build up, so they're indexed a batch per transaction instead of one each
+                    time.sleep(self.flush_interval)
+
+                batch = []
+                stopping = False
+                while item is not None:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= MAX_BATCH_SIZE:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+
+                if batch:
+                    try:
+                        with db:
+                            db.executemany("insert into log_lines (time, server, chan, nick, nick_lower, kind, "
+                                           "content) values (?, ?, ?, ?, ?, ?, ?)", batch)
+                    except sqlite3.Error:
+                        logger.exception("Couldn't index {} log lines".format(len(batch)))
+                    else:
+                        self.lines_indexed += len(batch)
+
+                if stopping:
+                    return
+        finally:
+            db.close()
+
+    def search(self, server, chan, text, nick=None, start=None, end=None, limit=100, offset=0):
+        """
+        Returns the messages in a channel matching a search, newest first
+        :type server: str
+        :type chan: str
+        :type text: str
+        :param nick: Only return messages from this nick
+        :param start: Only return messages sent at or after this unix time
+        :param end: Only return messages sent before this unix time
+        :rtype: list[SearchResult]
+        """
+        words = build_query(text)
+        if not words:
+            return []
+        server, chan = server.lower(), chan.lower()
+        match = "content : ({}) AND chan_key : {}".format(words, _key(server, chan))
+        if nick is not None:
+            match += " AND nick_key : {}".format(_key(nick.lower()))
+
+        db = sqlite3.connect(self.path)
+        try:
+            conditions = ["log_lines_fts match ?"]
+            params = [match]
+            # lines are stored in the order they were sent, so a time range is a range of ids, which the full-text
+            # index can seek to directly
+            if start is not None:
+                row = db.execute("select id from log_lines where server = ? and chan = ? and time >= ? "
+                                 "order by time limit 1", (server, chan, int(start))).fetchone()
+                if row is None:
+                    return []
+                conditions.append("f.rowid >= ?")
+                params.append(row[0])
+            if end is not None:
+                row = db.execute("select id from log_lines where server = ? and chan = ? and time < ? "
+                                 "order by time desc limit 1", (server, chan, int(end))).fetchone()
+                if row is None:
+                    return []
+                conditions.append("f.rowid <= ?")
+                params.append(row[0])
+            params.extend((limit, offset))
+
+            sql = ("select l.time, l.nick, l.kind, l.content from log_lines_fts f "
+                   "cross join log_lines l on l.id = f.rowid "
+                   "where {} order by f.rowid desc limit ? offset ?".format(" and ".join(conditions)))
+            return [SearchResult(*row) for row in db.execute(sql, params)]
+        finally:
+            db.close()
+
+
+index = None
+
+
+def configure(config, data_dir):
+    """
+    Starts the log search index, unless it's disabled in the "logging" section of the config or can't be opened
+    :type config: dict
+    :type data_dir: str
+    """
+    global index
+    logging_config = config.get("logging", {})
+    stop()
+    index = None
+    if logging_config.get("search_index", True):
+        try:
+            index = LogSearchIndex(os.path.join(data_dir, "log_search.db"))
+        except sqlite3.Error:
+            # most likely an SQLite built without FTS5, which shouldn't stop the bot from starting
+            logger.exception("Couldn't open the log search index, log searching is unavailable")
+
+
+def stop():
+    if index is not None:
+        index.close()
@@ -0,0 +1,187 @@
+"""
+logwriter.py - writes log lines to files in batches from a background thread, so logging never blocks on disk
+
+Lines are queued by write(), and a single writer thread appends them to their files, keeping a bounded number of
+files open at once.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+# most log files kept open at once, the least recently written one is closed to make room for another
+DEFAULT_MAX_OPEN_FILES = 128
+# seconds between flushes of the open files
+DEFAULT_FLUSH_INTERVAL = 1.0
+# seconds a file can go unwritten before it's closed, so files from previous days don't stay open
+DEFAULT_IDLE_TIMEOUT = 300
+# most lines written between checks for flushes and closes
+MAX_BATCH_SIZE = 1000
+
+logger = logging.getLogger("cloudbot")
+
+# markers queued in place of a path
+_FLUSH = object()
+_STOP = object()
+
+
+class LogWriter:
+    """
+    :type max_open_files: int
+    :type flush_interval: float
+    :type idle_timeout: float
+    """
+
+    def __init__(self, max_open_files=DEFAULT_MAX_OPEN_FILES, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.max_open_files = max_open_files
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+
+        self.lines_written = 0
+        self.files_opened = 0
+
+        self._queue = queue.Queue()
+        # path -> (file, last written time), least recently written first. Only used from the writer thread.
+        self._files = OrderedDict()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log writer", daemon=True)
+                self._thread.start()
+
+    def write(self, path, line):
+        """
+        Queues line (which should end with a newline) to be appended to the file at path
+        :type path: str
+        :type line: str
+        """
+        self._ensure_thread()
+        self._queue.put((path, line))
+
+    def flush(self, timeout=None):
+        """
+        Writes out all queued lines and flushes every open file, waiting until that's done
+        :rtype: bool
+        """
+        self._ensure_thread()
+        flushed = threading.Event()
+        self._queue.put((_FLUSH, flushed))
+        return flushed.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Writes out all queued lines, closes every open file and stops the writer thread
+        """
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put((_STOP, None))
+        thread.join(timeout)
+
+    def _get_file(self, path, now):
+        entry = self._files.pop(path, None)
+        if entry is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            entry = (open(path, "a", encoding="utf-8"), now)
+            self.files_opened += 1
+            while len(self._files) >= self.max_open_files:
+                _, (old_file, _) = self._files.popitem(last=False)
+                old_file.close()
+        # move it to the end, as the most recently written file
+        self._files[path] = (entry[0], now)
+        return entry[0]
+
+    def _write_batch(self, batch, now):
+        for path, lines in batch.items():
+            try:
+                self._get_file(path, now).write("".join(lines))
+            except OSError:
+                logger.exception("Couldn't write to log file {}".format(path))
+            else:
+                self.lines_written += len(lines)
+
+    def _flush_files(self, now):
+        for path, (log_file, last_written) in list(self._files.items()):
+            try:
+                log_file.flush()
+            except OSError:
+                logger.exception("Couldn't flush log file {}".format(path))
+            if now - last_written >= self.idle_timeout:
+                log_file.close()
+                del self._files[path]
+
+    def _close_files(self):
+        for log_file, _ in self._files.values():
+            try:
+                log_file.close()
+            except OSError:
+                pass
+        self._files.clear()
+
+    def _run(self):
+        last_flush = time.time()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+
+            # collect everything already queued, grouped by file, so each file gets a single write
+            batch = {}
+            waiters = []
+            stopping = False
+            count = 0
+            while item is not None:
+                path, value = item
+                if path is _FLUSH:
+                    waiters.append(value)
+                elif path is _STOP:
+                    stopping = True
+                else:
+                    batch.setdefault(path, []).append(value)
+                    count += 1
+                if count >= MAX_BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            now = time.time()
+            self._write_batch(batch, now)
+
+            if stopping:
+                self._close_files()
+                for waiter in waiters:
+                    waiter.set()
+                return
+
+            if waiters or now - last_flush >= self.flush_interval:
+                self._flush_files(now)
+                last_flush = now
+            for waiter in waiters:
+                waiter.set()
+
+
+writer = LogWriter()
+
+
+def configure(config):
+    """
+    Sets up the log writer from the "logging" section of the config
+    :type config: dict
+    """
+    global writer
+    logging_config = config.get("logging", {})
+    writer.close()
+    writer = LogWriter(logging_config.get("max_open_files", DEFAULT_MAX_OPEN_FILES),
+                       logging_config.get("flush_interval", DEFAULT_FLUSH_INTERVAL),
+                       logging_config.get("idle_close", DEFAULT_IDLE_TIMEOUT))
@@ -0,0 +1,89 @@
+"""
+masks.py - matches IRC hostmasks against many glob patterns at once
+
+Patterns are compiled once: literal masks go into a set, patterns using only * and ? are combined into one regex, and
+the rare patterns using [] character classes are left to fnmatch. Recent decisions are remembered, as the same few
+users tend to trigger most checks.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+# hostmasks each matcher remembers the result for
+DEFAULT_CACHE_SIZE = 1024
+
+
+def glob_to_regex(pattern):
+    """
+    Translates a glob using only * and ? into a regex
+    :type pattern: str
+    :rtype: str
+    """
+    return "".join(".*" if char == "*" else "." if char == "?" else re.escape(char) for char in pattern)
+
+
+class MaskMatcher:
+    """
+    Matches hostmasks against a fixed set of glob patterns, as fnmatch would, case-sensitively. Callers lower-case both
+    the patterns and the masks.
+    :type patterns: list[str]
+    :type cache_size: int
+    """
+
+    def __init__(self, patterns, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :type patterns: collections.Iterable[str]
+        """
+        self.patterns = list(patterns)
+        self.cache_size = cache_size
+
+        self._literals = set()
+        self._fallbacks = []
+        wildcards = []
+        for pattern in self.patterns:
+            if "[" in pattern:
+                self._fallbacks.append(pattern)
+            elif "*" in pattern or "?" in pattern:
+                wildcards.append(glob_to_regex(pattern))
+            else:
+                self._literals.add(pattern)
+
+        if wildcards:
+            self._regex = re.compile(r"(?s)(?:{})\Z".format("|".join(wildcards)))
+        else:
+            self._regex = None
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _match(self, mask):
+        if mask in self._literals:
+            return True
+        if self._regex is not None and self._regex.match(mask):
+            return True
+        return any(fnmatchcase(mask, pattern) for pattern in self._fallbacks)
+
+    def match(self, mask):
+        """
+        Returns whether any of the patterns match mask
+        :type mask: str
+        :rtype: bool
+        """
+        with self._lock:
+            result = self._cache.get(mask)
+            if result is not None:
+                self._cache.move_to_end(mask)
+                return result
+
+        result = self._match(mask)
+
+        with self._lock:
+            self._cache[mask] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def __bool__(self):
+        return bool(self.patterns)
@@ -0,0 +1,218 @@
+"""
+ratelimit.py - limits how quickly commands can be used, per user, channel, connection and command
+
+Each use of a command takes its cost in tokens from the bucket of the user, the channel, the connection and, if it has
+a budget of its own, the command. It's only allowed if every one of those buckets has enough tokens left, so one user
+flooding a channel runs out of their own budget long before the channel's. Only users are limited unless the config
+turns the channel and connection limits on, as a bot in many busy channels would otherwise hit them in normal use.
+
+Buckets which have been idle long enough to refill completely are indistinguishable from new ones, so they're dropped,
+keeping memory bounded however many users pass through.
+"""
+
+from collections import Counter, OrderedDict
+from time import time
+
+from cloudbot.util.bucket import TokenBucket
+
+# tokens a command costs, unless its hook or the config says otherwise
+DEFAULT_COST = 5
+# most buckets kept per scope, the least recently used are dropped beyond this even if they haven't refilled yet
+DEFAULT_MAX_BUCKETS = 10000
+
+# scope -> (tokens, restore_rate), or None for no limit
+default_limits = {
+    "user": (10, 1),
+    "channel": None,
+    "connection": None,
+}
+# scope -> (tokens, restore_rate) for a limit the config turns on without giving both
+enabled_limits = {
+    "user": (10, 1),
+    "channel": (20, 4),
+    "connection": (100, 20),
+}
+
+scopes = ("user", "channel", "connection", "command")
+
+
+class _Scope:
+    """
+    The buckets for one kind of key, the least recently used first
+    :type buckets: collections.OrderedDict[tuple, cloudbot.util.bucket.TokenBucket]
+    :type refill_time: float
+    """
+
+    __slots__ = ("buckets", "refill_time")
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.refill_time = 0
+
+
+class RateLimiter:
+    """
+    :type limits: dict[str, (float, float)]
+    :type commands: dict[str, dict]
+    :type max_buckets: int
+    :type allowed: int
+    :type limited: collections.Counter
+    :type limited_commands: collections.Counter
+    :type evictions: int
+    """
+
+    def __init__(self, limits=None, commands=None, max_buckets=DEFAULT_MAX_BUCKETS):
+        """
+        :param limits: scope -> (tokens, restore_rate) for "user", "channel" and "connection", or None for no limit
+        :param commands: command name -> {"tokens": float, "restore_rate": float, "cost": float}, all optional
+        """
+        self.limits = dict(default_limits)
+        if limits:
+            self.limits.update(limits)
+        self.commands = {name.lower(): settings for name, settings in (commands or {}).items()}
+        self.max_buckets = max_buckets
+
+        self.allowed = 0
+        self.limited = Counter()
+        self.limited_commands = Counter()
+        self.evictions = 0
+
+        self._scopes = {scope: _Scope() for scope in scopes}
+        for scope, limit in self.limits.items():
+            if limit is not None:
+                self._scopes[scope].refill_time = limit[0] / limit[1]
+        for settings in self.commands.values():
+            if "tokens" in settings:
+                refill_time = settings["tokens"] / settings.get("restore_rate", 1)
+                self._scopes["command"].refill_time = max(self._scopes["command"].refill_time, refill_time)
+
+        # (server, user) pairs already told they're being limited, so they're only told once per burst
+        self._warned = set()
+
+    def get_cost(self, command, hook_cost=None):
+        """
+        :type command: str
+        :param hook_cost: The cost the command's hook was declared with
+        :rtype: float
+        """
+        settings = self.commands.get(command.lower(), {})
+        if "cost" in settings:
+            return settings["cost"]
+        if hook_cost is not None:
+            return hook_cost
+        return DEFAULT_COST
+
+    def _get_bucket(self, scope, key, limit):
+        buckets = self._scopes[scope].buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*limit)
+            if len(buckets) > self.max_buckets:
+                buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self, now):
+        for scope in self._scopes.values():
+            buckets = scope.buckets
+            # a bucket's timestamp is when it was last used, so the first bucket is the one idle the longest
+            while buckets:
+                bucket = next(iter(buckets.values()))
+                if now - bucket.timestamp < scope.refill_time:
+                    break
+                buckets.popitem(last=False)
+                self.evictions += 1
+
+    def check(self, server, chan, user, command, cost=DEFAULT_COST):
+        """
+        Takes cost tokens from each of the buckets a use of a command is limited by, if they all have enough. Returns
+        None if it's allowed, or the first scope which doesn't have enough tokens left.
+        :param server: The connection's name
+        :param chan: The channel the command was used in, or None for private messages
+        :param user: What identifies the user, such as their host
+        :type command: str
+        :type cost: float
+        :rtype: str | None
+        """
+        now = time()
+        self._evict(now)
+
+        server, user, command = server.lower(), user.lower(), command.lower()
+        keys = [("user", (server, user), self.limits["user"]),
+                ("connection", (server,), self.limits["connection"])]
+        if chan is not None:
+            keys.insert(1, ("channel", (server, chan.lower()), self.limits["channel"]))
+        settings = self.commands.get(command)
+        if settings is not None and "tokens" in settings:
+            keys.append(("command", (server, command), (settings["tokens"], settings.get("restore_rate", 1))))
+
+        buckets = []
+        for scope, key, limit in keys:
+            if limit is None:
+                continue
+            bucket = self._get_bucket(scope, key, limit)
+            if bucket.tokens < cost:
+                self.limited[scope] += 1
+                self.limited_commands[command] += 1
+                return scope
+            buckets.append(bucket)
+
+        for bucket in buckets:
+            bucket.consume(cost)
+        self.allowed += 1
+        self._warned.discard((server, user))
+        return None
+
+    def should_warn(self, server, user):
+        """
+        Returns True the first time a user is limited since they were last allowed to use a command
+        :type server: str
+        :type user: str
+        :rtype: bool
+        """
+        key = (server.lower(), user.lower())
+        if key in self._warned:
+            return False
+        if len(self._warned) >= self.max_buckets:
+            self._warned.clear()
+        self._warned.add(key)
+        return True
+
+    def get_stats(self):
+        """
+        :rtype: dict
+        """
+        return {
+            "allowed": self.allowed,
+            "limited": dict(self.limited),
+            "limited_commands": dict(self.limited_commands),
+            "buckets": {scope: len(self._scopes[scope].buckets) for scope in scopes},
+            "evictions": self.evictions,
+        }
+
+
+limiter = RateLimiter()
+
+
+def _get_limit(settings, scope):
+    if settings is None:
+        return default_limits[scope]
+    if not settings:
+        # an empty or false setting turns the limit off
+        return None
+    tokens, restore_rate = enabled_limits[scope]
+    return settings.get("tokens", tokens), settings.get("restore_rate", restore_rate)
+
+
+def configure(config):
+    """
+    Sets up the rate limiter from the "ratelimit" section of the config
+    :type config: dict
+    """
+    global limiter
+    ratelimit_config = config.get("ratelimit", {})
+    limits = {scope: _get_limit(ratelimit_config.get(scope), scope) for scope in default_limits}
+    limiter = RateLimiter(limits, ratelimit_config.get("commands"),
+                          ratelimit_config.get("max_buckets", DEFAULT_MAX_BUCKETS))
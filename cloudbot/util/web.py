@@ -1,9 +1,18 @@
 """ web.py - web services and more """
 
 import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+from cloudbot.util import http
+
 # Constants
 
 DEFAULT_SHORTENER = 'is.gd'
@@ -11,14 +20,21 @@ DEFAULT_PASTEBIN = 'hastebin'
 
 HASTEBIN_SERVER = 'http://hastebin.com'
 
+# number of long -> short mappings kept in memory, in front of the shortener cache database
+SHORTEN_CACHE_SIZE = 1024
+# number of URLs shortened at once by shorten_many
+SHORTEN_WORKERS = 4
+
+logger = logging.getLogger("cloudbot")
+
 # Python eval
 
 def pyeval(code, pastebin=True):
     p = {'input': code}
-    r = requests.post('http://pyeval.appspot.com/exec', data=p)
+    r = http.session.post('http://pyeval.appspot.com/exec', data=p)
 
     p = {'id': r.text}
-    r = requests.get('http://pyeval.appspot.com/exec', params=p)
+    r = http.session.get('http://pyeval.appspot.com/exec', params=p)
     j = r.json()
 
     output = j['output'].rstrip('\n')
@@ -34,13 +50,108 @@ def pyeval(code, pastebin=True):
 
 
 def shorten(url, custom=None, service=DEFAULT_SHORTENER):
+    if custom is None:
+        short_url = shorten_cache.get(service, url)
+        if short_url is not None:
+            return short_url
+    return _shorten_uncached(url, custom, service)
+
+
+def _shorten_uncached(url, custom, service):
     impl = shorteners[service]
-    return impl.shorten(url, custom)
+    start = time.time()
+    try:
+        short_url = impl.shorten(url, custom)
+    except Exception:
+        shorten_cache.record(service, time.time() - start, True)
+        raise
+    shorten_cache.record(service, time.time() - start, False)
+
+    if custom is None:
+        shorten_cache.put(service, url, short_url)
+    return short_url
 
 
 def try_shorten(url, custom=None, service=DEFAULT_SHORTENER):
-    impl = shorteners[service]
-    return impl.try_shorten(url, custom)
+    try:
+        return shorten(url, custom, service)
+    except ServiceError:
+        return url
+
+
+def shorten_many(urls, service=DEFAULT_SHORTENER):
+    """
+    Shortens several URLs, returning the short URLs in the same order. URLs which haven't been shortened before are
+    shortened at the same time, rather than one after another.
+    :type urls: list[str]
+    :rtype: list[str]
+    """
+    return _map_shortened(urls, service, False)
+
+
+def try_shorten_many(urls, service=DEFAULT_SHORTENER):
+    """
+    Like shorten_many, but returns the original URL for any that couldn't be shortened
+    :type urls: list[str]
+    :rtype: list[str]
+    """
+    return _map_shortened(urls, service, True)
+
+
+def _try_shorten_uncached(url, custom, service):
+    try:
+        return _shorten_uncached(url, custom, service)
+    except ServiceError:
+        return url
+
+
+def _map_shortened(urls, service, fallback):
+    global _shorten_pool
+    function = _try_shorten_uncached if fallback else _shorten_uncached
+    results = {}
+    uncached = []
+    # the cache is asked once for each URL, so every hit is only counted once
+    for url in OrderedDict.fromkeys(urls):
+        short_url = shorten_cache.get(service, url)
+        if short_url is None:
+            uncached.append(url)
+        else:
+            results[url] = short_url
+
+    if len(uncached) < 2:
+        # nothing to gain from the pool
+        for url in uncached:
+            results[url] = function(url, None, service)
+    else:
+        if _shorten_pool is None:
+            _shorten_pool = ThreadPoolExecutor(SHORTEN_WORKERS)
+        futures = {url: _shorten_pool.submit(function, url, None, service) for url in uncached}
+        results.update((url, future.result()) for url, future in futures.items())
+    return [results[url] for url in urls]
+
+
+def get_shorten_stats():
+    """
+    Returns request counts, cache hits and latency for each shortening service
+    :rtype: dict[str, dict[str, int | float]]
+    """
+    return shorten_cache.get_stats()
+
+
+def configure(config, data_dir=None):
+    """
+    Sets up the shortener cache, persisting it under data_dir unless disabled in the config
+    :type config: dict
+    :type data_dir: str
+    """
+    global shorten_cache
+    cache_config = config.get("shortener_cache", {})
+    if cache_config.get("persist", True) and data_dir is not None:
+        path = os.path.join(data_dir, "shortened_urls.db")
+    else:
+        path = None
+    shorten_cache.close()
+    shorten_cache = ShortenerCache(path, cache_config.get("memory_size", SHORTEN_CACHE_SIZE))
 
 
 def expand(url, service=None):
@@ -73,6 +184,124 @@ class ServiceError(Exception):
         return '[HTTP {}] {}'.format(self.request.status_code, self.message)
 
 
+class ShortenStats:
+    """
+    :type requests: int
+    :type errors: int
+    :type memory_hits: int
+    :type disk_hits: int
+    :type total_time: float
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.total_time = 0.0
+
+
+class ShortenerCache:
+    """
+    Remembers the short URL each long URL was given by each service, so the same URL is only ever shortened once.
+
+    Mappings are kept in a bounded in-memory LRU, in front of an SQLite database if a path is given.
+    :type max_size: int
+    """
+
+    def __init__(self, path=None, max_size=SHORTEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._memory = OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("create table if not exists shortened (service text not null, url text not null, "
+                             "short_url text not null, primary key (service, url))")
+            self._db.commit()
+
+    def _get_stats(self, service):
+        stats = self._stats.get(service)
+        if stats is None:
+            stats = self._stats[service] = ShortenStats()
+        return stats
+
+    def get(self, service, url):
+        """
+        :type service: str
+        :type url: str
+        :rtype: str | None
+        """
+        key = (service, url)
+        with self._lock:
+            short_url = self._memory.get(key)
+            if short_url is not None:
+                self._memory.move_to_end(key)
+                self._get_stats(service).memory_hits += 1
+                return short_url
+
+            if self._db is None:
+                return None
+            row = self._db.execute("select short_url from shortened where service = ? and url = ?",
+                                   key).fetchone()
+            if row is None:
+                return None
+            self._get_stats(service).disk_hits += 1
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, service, url, short_url):
+        """
+        :type service: str
+        :type url: str
+        :type short_url: str
+        """
+        key = (service, url)
+        with self._lock:
+            self._remember(key, short_url)
+            if self._db is not None:
+                try:
+                    self._db.execute("insert or replace into shortened (service, url, short_url) values (?, ?, ?)",
+                                     (service, url, short_url))
+                    self._db.commit()
+                except sqlite3.Error:
+                    logger.exception("Couldn't save shortened URL")
+
+    def _remember(self, key, short_url):
+        self._memory[key] = short_url
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def record(self, service, elapsed, failed):
+        """
+        Records a request made to a shortening service
+        :type service: str
+        :type elapsed: float
+        :type failed: bool
+        """
+        with self._lock:
+            stats = self._get_stats(service)
+            stats.requests += 1
+            stats.total_time += elapsed
+            if failed:
+                stats.errors += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {service: {"requests": stats.requests, "errors": stats.errors, "memory_hits": stats.memory_hits,
+                              "disk_hits": stats.disk_hits,
+                              "average_time": stats.total_time / stats.requests if stats.requests else 0.0}
+                    for service, stats in self._stats.items()}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
 class Shortener:
     def __init__(self):
         pass
@@ -87,7 +316,7 @@ class Shortener:
             return url
 
     def expand(self, url):
-        r = requests.get(url, allow_redirects=False)
+        r = http.session.get(url, allow_redirects=False)
 
         if 'location' in r.headers:
             return r.headers['location']
@@ -107,6 +336,9 @@ class Pastebin:
 shorteners = {}
 pastebins = {}
 
+shorten_cache = ShortenerCache()
+_shorten_pool = None
+
 
 def _shortener(name):
     def _decorate(impl):
@@ -126,7 +358,7 @@ def _pastebin(name):
 class Isgd(Shortener):
     def shorten(self, url, custom=None):
         p = {'url': url, 'shorturl': custom, 'format': 'json'}
-        r = requests.get('http://is.gd/create.php', params=p)
+        r = http.session.get('http://is.gd/create.php', params=p)
         j = r.json()
 
         if 'shorturl' in j:
@@ -136,7 +368,7 @@ class Isgd(Shortener):
 
     def expand(self, url):
         p = {'shorturl': url, 'format': 'json'}
-        r = requests.get('http://is.gd/forward.php', params=p)
+        r = http.session.get('http://is.gd/forward.php', params=p)
         j = r.json()
 
         if 'url' in j:
@@ -150,7 +382,7 @@ class Googl(Shortener):
     def shorten(self, url, custom=None):
         h = {'content-type': 'application/json'}
         p = {'longUrl': url}
-        r = requests.post('https://www.googleapis.com/urlshortener/v1/url', data=json.dumps(p), headers=h)
+        r = http.session.post('https://www.googleapis.com/urlshortener/v1/url', data=json.dumps(p), headers=h)
         j = r.json()
 
         if 'error' not in j:
@@ -160,7 +392,7 @@ class Googl(Shortener):
 
     def expand(self, url):
         p = {'shortUrl': url}
-        r = requests.get('https://www.googleapis.com/urlshortener/v1/url', params=p)
+        r = http.session.get('https://www.googleapis.com/urlshortener/v1/url', params=p)
         j = r.json()
 
         if 'error' not in j:
@@ -173,7 +405,7 @@ class Googl(Shortener):
 class Gitio(Shortener):
     def shorten(self, url, custom=None):
         p = {'url': url, 'code': custom}
-        r = requests.post('http://git.io', data=p)
+        r = http.session.post('http://git.io', data=p)
 
         if r.status_code == requests.codes.created:
             s = r.headers['location']
@@ -188,7 +420,7 @@ class Gitio(Shortener):
 @_pastebin('hastebin')
 class Hastebin(Pastebin):
     def paste(self, data, ext):
-        r = requests.post(HASTEBIN_SERVER + '/documents', data=data)
+        r = http.session.post(HASTEBIN_SERVER + '/documents', data=data)
         j = r.json()
 
         if r.status_code is requests.codes.ok:
@@ -1,13 +1,30 @@
 import asyncio
 
 from cloudbot import hook
-from cloudbot.util import bucket
+from cloudbot.util import ratelimit
 
-TOKENS = 10
-RESTORE_RATE = 2
-MESSAGE_COST = 5
+# connection name -> (acls the compiled acls were made from, compiled acls)
+compiled_acls = {}
+no_acls = {}
 
-buckets = {}
+
+def get_acls(conn):
+    """
+    Returns each hook's acl for a connection, with its channel lists as lowercase sets. Reloading the config replaces
+    the connection's acls, so they're recompiled whenever the acls they were made from are no longer the connection's.
+    :type conn: cloudbot.client.Client
+    :rtype: dict[str, (set[str] | None, set[str] | None)]
+    """
+    acls = conn.config.get('acls', no_acls)
+    compiled_from, compiled = compiled_acls.get(conn.name, (None, None))
+    if compiled_from is not acls:
+        compiled = {}
+        for function_name, acl in acls.items():
+            allowed_channels = set(map(str.lower, acl['deny-except'])) if 'deny-except' in acl else None
+            denied_channels = set(map(str.lower, acl['allow-except'])) if 'allow-except' in acl else None
+            compiled[function_name] = (allowed_channels, denied_channels)
+        compiled_acls[conn.name] = (acls, compiled)
+    return compiled
 
 
 @asyncio.coroutine
@@ -24,16 +41,13 @@ def sieve_suite(bot, event, _hook):
         return None
 
     # check acls
-    acl = conn.config.get('acls', {}).get(_hook.function_name)
+    acl = get_acls(conn).get(_hook.function_name)
     if acl:
-        if 'deny-except' in acl:
-            allowed_channels = list(map(str.lower, acl['deny-except']))
-            if event.chan.lower() not in allowed_channels:
-                return None
-        if 'allow-except' in acl:
-            denied_channels = list(map(str.lower, acl['allow-except']))
-            if event.chan.lower() in denied_channels:
-                return None
+        allowed_channels, denied_channels = acl
+        if allowed_channels is not None and event.chan.lower() not in allowed_channels:
+            return None
+        if denied_channels is not None and event.chan.lower() in denied_channels:
+            return None
 
     # check disabled_commands
     if _hook.type == "command":
@@ -54,21 +68,16 @@ def sieve_suite(bot, event, _hook):
             event.notice("Sorry, you are not allowed to use this command.")
             return None
 
-    # check command spam tokens
+    # check rate limits
     if _hook.type == "command":
-        uid = event.chan
-
-        if not uid in buckets:
-            _bucket = bucket.TokenBucket(TOKENS, RESTORE_RATE)
-            _bucket.consume(MESSAGE_COST)
-            buckets[uid] = _bucket
-            return event
-
-        _bucket = buckets[uid]
-        if _bucket.consume(MESSAGE_COST):
-            pass
-        else:
-            print("pong!")
+        limiter = ratelimit.limiter
+        user = event.host or event.nick
+        # private messages have the sender's nick as their channel
+        chan = None if event.chan.lower() == event.nick.lower() else event.chan
+        limited = limiter.check(conn.name, chan, user, _hook.name, limiter.get_cost(_hook.name, _hook.cost))
+        if limited is not None:
+            if limiter.should_warn(conn.name, user):
+                event.notice("You're using commands too quickly, slow down.")
             return None
 
     return event
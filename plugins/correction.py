@@ -1,9 +1,9 @@
 import asyncio
-import re
 
 from cloudbot import hook
+from cloudbot.util import history
 
-correction_re = re.compile(r"^[sS]/([^/]*)/([^/]*)(/.*)?\s*$")
+correction_re = history.correction_re
 
 
 @asyncio.coroutine
@@ -14,28 +14,21 @@ def correction(match, conn, chan, message):
     :type conn: cloudbot.client.Client
     :type chan: str
     """
-    print(match.groups())
     to_find, replacement, find_nick = match.groups()
     if find_nick:
         find_nick = find_nick[1:].lower()  # Remove the '/'
 
-    find_re = re.compile("(?i){}".format(re.escape(to_find)))
+    find_re = history.compile_search(to_find)
 
-    for item in conn.history[chan].__reversed__():
-        nick, timestamp, msg = item
-        if correction_re.match(msg):
-            # don't correct corrections, it gets really confusing
-            continue
-        if find_nick:
-            if find_nick != nick.lower():
-                continue
-        if find_re.search(msg):
+    # corrections are skipped, correcting them gets really confusing
+    channel_history = conn.history.get(chan)
+    if channel_history is not None:
+        for nick, timestamp, msg, is_correction in channel_history.search(find_re, nick=find_nick or None):
             if "\x01ACTION" in msg:
                 msg = msg.replace("\x01ACTION ", "/me ").replace("\x01", "")
             message("Correction, <{}> {}".format(nick, find_re.sub("\x02" + replacement + "\x02", msg)))
             return
-        else:
-            continue
+
     if find_nick:
         return "Did not find {} in any recent messages from {}.".format(to_find, find_nick)
     else:
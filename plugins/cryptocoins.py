@@ -1,6 +1,7 @@
 import requests
 
 from cloudbot import hook
+from cloudbot.util import http
 
 
 ## CONSTANTS
@@ -50,7 +51,7 @@ def bitcoin(text, notice):
     else:
         exchange = exchanges["blockchain"]
 
-    response = requests.get(exchange["api_url"])
+    response = http.session.get(exchange["api_url"])
     if response.status_code != requests.codes.ok:
         return "Error reaching {}: {}".format(text or "blockchain", response.status_code)
     func = exchange["func"]
@@ -60,7 +61,7 @@ def bitcoin(text, notice):
 @hook.command("ltc", "litecoin", autohelp=False)
 def litecoin(message):
     """- gets litecoin exchange rate from BTC-E"""
-    response = requests.get("https://btc-e.com/api/2/ltc_usd/ticker")
+    response = http.session.get("https://btc-e.com/api/2/ltc_usd/ticker")
     if response.status_code != requests.codes.ok:
         return "Error reaching btc-e.com: {}".format(response.status_code)
     data = response.json()
@@ -6,6 +6,7 @@ from lxml import html
 import requests
 
 from cloudbot import hook
+from cloudbot.util import http
 
 
 def format_output(h, definition, show_examples):
@@ -54,7 +55,7 @@ def define(text):
 
     url = 'http://ninjawords.com/'
 
-    response = requests.get(url + text)
+    response = http.session.get(url + text)
     if response.status_code != requests.codes.ok:
         return "Error reaching ninjawords.com: {}".format(response.status_code)
 
@@ -86,7 +87,7 @@ def etymology(text):
 
     url = 'http://www.etymonline.com/index.php'
 
-    response = requests.get(url, params={"term": text})
+    response = http.session.get(url, params={"term": text})
     if response.status_code != requests.codes.ok:
         return "Error reaching etymonline.com: {}".format(response.status_code)
 
@@ -5,7 +5,7 @@ from lxml import html
 import requests
 
 from cloudbot import hook
-from cloudbot.util import formatting
+from cloudbot.util import formatting, http
 
 api_url = "http://encyclopediadramatica.se/api.php"
 ed_url = "http://encyclopediadramatica.se/"
@@ -15,7 +15,7 @@ ed_url = "http://encyclopediadramatica.se/"
 def drama(text):
     """<phrase> - gets the first paragraph of the Encyclopedia Dramatica article on <phrase>"""
 
-    search_response = requests.get(api_url, params={"action": "opensearch", "search": text})
+    search_response = http.session.get(api_url, params={"action": "opensearch", "search": text})
 
     if search_response.status_code != requests.codes.ok:
         return "Error searching: {}".format(search_response.status_code)
@@ -28,7 +28,7 @@ def drama(text):
 
     url = ed_url + parse.quote(article_name, '')
 
-    page_response = requests.get(url)
+    page_response = http.session.get(url)
 
     if page_response.status_code != requests.codes.ok:
         return "Error getting page: {}".format(search_response.status_code)
@@ -44,9 +44,9 @@ def decode_aes(c, s):
         return "Invalid password for the given message (couldn't encode result as utf-8)"
 
 
-@hook.onload
+@hook.migration(1)
 def create_db(db):
-    """check to see that our db has the the encryption table.
+    """creates the encryption table.
     :type db: sqlalchemy.orm.session.Session
     """
     db.execute("create table if not exists encryption(encrypted, iv, "
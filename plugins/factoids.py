@@ -2,12 +2,15 @@
 import string
 import asyncio
 import re
+import bisect
+from collections import OrderedDict
 from sqlalchemy import Table, Column, String
+from sqlalchemy.sql import select
 
 import requests
 
 from cloudbot import hook
-from cloudbot.util import botvars, formatting, web
+from cloudbot.util import botvars, formatting, http, web
 
 re_lineends = re.compile(r'[\r\n]*')
 
@@ -32,22 +35,125 @@ table = Table(
 )
 
 
-def _load_cache_db(db):
-    query = db.execute(table.select())
-    return [(row["word"], row["data"]) for row in query]
+# maximum length of each line sent by listfactoids
+LIST_LINE_LENGTH = 400
+# number of factoid words listfactoids will send at once
+LIST_PAGE_WORDS = 100
+
+# word -> data. Holds every factoid, unless "factoids": {"cache_size": n} is set in the config, in which case it only
+# holds the n most recently used factoids, and everything else is read from the database when needed.
+factoid_cache = OrderedDict()
+# sorted list of all factoid words, used for existence checks and prefix listing
+factoid_keys = []
+cache_size = None
+
+
+def _load_cache_db(db, load_data):
+    if load_data:
+        query = db.execute(table.select())
+        return [(row["word"], row["data"]) for row in query]
+    else:
+        query = db.execute(select([table.c.word]))
+        return [(row["word"], None) for row in query]
 
 
 @asyncio.coroutine
 @hook.onload()
-def load_cache(async, db):
+def load_cache(async, db, bot):
     """
     :type db: sqlalchemy.orm.Session
+    :type bot: cloudbot.bot.CloudBot
     """
-    global factoid_cache
-    factoid_cache = {}
-    for word, data in (yield from async(_load_cache_db, db)):
+    global factoid_cache, factoid_keys, cache_size
+    cache_size = bot.config.get("factoids", {}).get("cache_size")
+
+    new_cache = OrderedDict()
+    new_keys = []
+    for word, data in (yield from async(_load_cache_db, db, cache_size is None)):
         # nick = row["nick"]
-        factoid_cache[word] = data  # we might want (data, nick) sometime later
+        new_keys.append(word)
+        if cache_size is None:
+            new_cache[word] = data  # we might want (data, nick) sometime later
+    new_keys.sort()
+
+    factoid_cache = new_cache
+    factoid_keys = new_keys
+
+
+def _cache_factoid(word, data):
+    """
+    :type word: str
+    :type data: str
+    """
+    factoid_cache[word] = data
+    if cache_size is not None:
+        factoid_cache.move_to_end(word)
+        while len(factoid_cache) > cache_size:
+            factoid_cache.popitem(last=False)
+
+
+def has_factoid(word):
+    """
+    :type word: str
+    :rtype: bool
+    """
+    index = bisect.bisect_left(factoid_keys, word)
+    return index < len(factoid_keys) and factoid_keys[index] == word
+
+
+def _prefixed_range(prefix):
+    """
+    Returns the start and end of the factoid words starting with the given prefix, as indexes into factoid_keys
+    :type prefix: str
+    :rtype: (int, int)
+    """
+    start = bisect.bisect_left(factoid_keys, prefix)
+    # every word starting with the prefix sorts before this, apart from any with that character right after the prefix
+    end = bisect.bisect_left(factoid_keys, prefix + "\U0010ffff", start)
+    while end < len(factoid_keys) and factoid_keys[end].startswith(prefix):
+        end += 1
+    return start, end
+
+
+def get_prefixed(prefix):
+    """
+    Returns all factoid words starting with the given prefix, in order
+    :type prefix: str
+    :rtype: list[str]
+    """
+    start, end = _prefixed_range(prefix)
+    return factoid_keys[start:end]
+
+
+def _get_factoid_db(db, word):
+    row = db.execute(select([table.c.data]).where(table.c.word == word)).fetchone()
+    if row is None:
+        return None
+    return row["data"]
+
+
+@asyncio.coroutine
+def get_factoid(async, db, word):
+    """
+    Gets the data for a factoid, from the cache if possible
+    :type db: sqlalchemy.orm.Session
+    :type word: str
+    :rtype: str
+    """
+    if word in factoid_cache:
+        data = factoid_cache[word]
+        if cache_size is not None:
+            factoid_cache.move_to_end(word)
+        return data
+
+    if cache_size is None or not has_factoid(word):
+        # either everything is cached, or the factoid doesn't exist, so don't bother with the database
+        return None
+
+    data = yield from async(_get_factoid_db, db, word)
+    if data is not None:
+        _cache_factoid(word, data)
+    return data
 
 
 @asyncio.coroutine
@@ -58,14 +164,15 @@ def add_factoid(async, db, word, data, nick):
     :type data: str
     :type nick: str
     """
-    if word in factoid_cache:
+    if has_factoid(word):
         # if we have a set value, update
         yield from async(db.execute, table.update().values(data=data, nick=nick).where(table.c.word == word))
     else:
         # otherwise, insert
         yield from async(db.execute, table.insert().values(word=word, data=data, nick=nick))
+        bisect.insort(factoid_keys, word)
     yield from async(db.commit)
-    yield from load_cache(async, db)
+    _cache_factoid(word, data)
 
 
 @asyncio.coroutine
@@ -76,7 +183,10 @@ def del_factoid(async, db, word):
     """
     yield from async(db.execute, table.delete().where(table.c.word == word))
     yield from async(db.commit)
-    yield from load_cache(async, db)
+    factoid_cache.pop(word, None)
+    index = bisect.bisect_left(factoid_keys, word)
+    if index < len(factoid_keys) and factoid_keys[index] == word:
+        del factoid_keys[index]
 
 
 @asyncio.coroutine
@@ -89,7 +199,7 @@ def remember(text, nick, db, notice, async):
     except ValueError:
         return remember.__doc__
 
-    old_data = factoid_cache.get(word)
+    old_data = yield from get_factoid(async, db, word)
 
     if data.startswith('+') and old_data:
         # remove + symbol
@@ -113,7 +223,7 @@ def remember(text, nick, db, notice, async):
 def forget(text, db, async, notice):
     """<word> - forgets previously remembered <word>"""
 
-    data = factoid_cache.get(text)
+    data = yield from get_factoid(async, db, text)
 
     if data:
         yield from del_factoid(async, db, text)
@@ -126,20 +236,21 @@ def forget(text, db, async, notice):
 
 @asyncio.coroutine
 @hook.command()
-def info(text, notice):
+def info(text, notice, async, db):
     """<factoid> - shows the source of a factoid"""
 
     text = text.strip()
 
-    if text in factoid_cache:
-        notice(factoid_cache[text])
+    data = yield from get_factoid(async, db, text)
+    if data is not None:
+        notice(data)
     else:
         notice("Unknown Factoid.")
 
 
 @asyncio.coroutine
 @hook.regex(r'^{} ?(.+)'.format(re.escape(FACTOID_CHAR)))
-def factoid(match, async, event, message, action):
+def factoid(match, async, event, message, action, db):
     """<word> - shows what data is associated with <word>"""
 
     # split up the input
@@ -151,8 +262,8 @@ def factoid(match, async, event, message, action):
     else:
         arguments = ""
 
-    if factoid_id in factoid_cache:
-        data = factoid_cache[factoid_id]
+    data = yield from get_factoid(async, db, factoid_id)
+    if data is not None:
         # factoid preprocessors
         if data.startswith("<py>"):
             code = data[4:].strip()
@@ -171,7 +282,7 @@ def factoid(match, async, event, message, action):
             action(result)
         elif result.startswith("<url>"):
             url = result[5:].strip()
-            response = requests.get(url)
+            response = http.session.get(url)
             if response.status_code != requests.codes.ok:
                 message("Failed to fetch resource.")
             else:
@@ -180,19 +291,48 @@ def factoid(match, async, event, message, action):
             message(result)
 
 
+def paginate_words(words, line_length=LIST_LINE_LENGTH):
+    """
+    Splits a list of words into comma-separated lines no longer than line_length
+    :type words: list[str]
+    :rtype: list[str]
+    """
+    lines = []
+    line = []
+    line_size = 0
+    for word in words:
+        added_length = len(word) + 2
+        if line and line_size + added_length > line_length:
+            lines.append(", ".join(line))
+            line = []
+            line_size = 0
+        line.append(word)
+        line_size += added_length
+    if line:
+        lines.append(", ".join(line))
+    return lines
+
+
 @asyncio.coroutine
 @hook.command(autohelp=False, permissions=["listfactoids"])
-def listfactoids(notice):
-    """- lists all available factoids"""
-    reply_text = []
-    reply_text_length = 0
-    for word in factoid_cache.keys():
-        added_length = len(word) + 2
-        if reply_text_length + added_length > 400:
-            notice(", ".join(reply_text))
-            reply_text = []
-            reply_text_length = 0
-        else:
-            reply_text.append(word)
-            reply_text_length += added_length
-    notice(", ".join(reply_text))
+def listfactoids(text, notice):
+    """[prefix] [page] - lists available factoids, optionally only those starting with [prefix]"""
+    args = text.split()
+    page = 1
+    if args and args[-1].isdigit():
+        page = int(args.pop())
+    prefix = args[0] if args else ""
+
+    # only the words on the requested page are joined into lines, however many factoids there are
+    start, end = _prefixed_range(prefix)
+    if start == end:
+        notice("No factoids found.")
+        return
+
+    pages = (end - start + LIST_PAGE_WORDS - 1) // LIST_PAGE_WORDS
+    page = min(max(page, 1), pages)
+    page_start = start + (page - 1) * LIST_PAGE_WORDS
+    for line in paginate_words(factoid_keys[page_start:min(page_start + LIST_PAGE_WORDS, end)]):
+        notice(line)
+    if pages > 1:
+        notice("Page {}/{}".format(page, pages))
@@ -1,11 +1,8 @@
 from urllib.parse import quote_plus
 import asyncio
 
-import requests
-import requests.exceptions
-
 from cloudbot import hook
-from cloudbot.util import formatting
+from cloudbot.util import async_http, formatting, http
 
 api_url = "http://api.fishbans.com/stats/{}/"
 
@@ -17,13 +14,9 @@ def fishbans(text, loop):
     user = text.strip()
 
     try:
-        request = yield from loop.run_in_executor(None, requests.get, api_url.format(quote_plus(user)))
-        request.raise_for_status()
-    except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
+        json = yield from async_http.get_json(api_url.format(quote_plus(user)), loop=loop)
+    except (http.HTTPError, http.URLError) as e:
         return "Could not fetch ban data from the Fishbans API: {}".format(e)
-
-    try:
-        json = request.json()
     except ValueError:
         return "Could not fetch ban data from the Fishbans API: Invalid Response"
 
@@ -48,13 +41,9 @@ def bancount(text, loop):
     user = text.strip()
 
     try:
-        request = yield from loop.run_in_executor(None, requests.get, api_url.format(quote_plus(user)))
-        request.raise_for_status()
-    except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
+        json = yield from async_http.get_json(api_url.format(quote_plus(user)), loop=loop)
+    except (http.HTTPError, http.URLError) as e:
         return "Could not fetch ban data from the Fishbans API: {}".format(e)
-
-    try:
-        json = request.json()
     except ValueError:
         return "Could not fetch ban data from the Fishbans API: Invalid Response"
 
@@ -1,9 +1,7 @@
 import asyncio
 
-from bs4 import BeautifulSoup
-import requests
-
 from cloudbot import hook
+from cloudbot.util import async_http
 
 fml_cache = []
 
@@ -11,8 +9,7 @@ fml_cache = []
 @asyncio.coroutine
 def refresh_cache(loop):
     """ gets a page of random FMLs and puts them into a dictionary """
-    response = yield from loop.run_in_executor(None, requests.get, 'http://www.fmylife.com/random/')
-    soup = BeautifulSoup(response.text, "lxml")
+    soup = yield from async_http.get_soup('http://www.fmylife.com/random/', loop=loop)
 
     for e in soup.find_all('div', {'class': 'post article'}):
         fml_id = int(e['id'])
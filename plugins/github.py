@@ -1,7 +1,5 @@
-import requests
-
 from cloudbot import hook
-from cloudbot.util import web, formatting
+from cloudbot.util import http, web, formatting
 
 shortcuts = {
     'cloudbot': 'CloudBotIRC/Refresh'
@@ -16,7 +14,7 @@ def issues(text):
     issue = args[1] if len(args) > 1 else None
 
     if issue:
-        r = requests.get('https://api.github.com/repos/{}/issues/{}'.format(repo, issue))
+        r = http.session.get('https://api.github.com/repos/{}/issues/{}'.format(repo, issue))
         j = r.json()
 
         url = web.try_shorten(j['html_url'], service='git.io')
@@ -30,7 +28,7 @@ def issues(text):
 
         return 'Issue #{} ({}): {} | {}: {}'.format(number, state, url, title, summary)
     else:
-        r = requests.get('https://api.github.com/repos/{}/issues'.format(repo))
+        r = http.session.get('https://api.github.com/repos/{}/issues'.format(repo))
         j = r.json()
 
         count = len(j)
@@ -1,4 +1,3 @@
-from collections import deque
 import time
 import asyncio
 import re
@@ -7,18 +6,24 @@ from cloudbot import hook
 from cloudbot.util import timesince
 from cloudbot.event import EventType
 
-db_ready = []
 
+@hook.migration(1)
+def create_table(db):
+    """
+    :type db: sqlalchemy.orm.Session
+    """
+    db.execute("create table if not exists seen_user(name, time, quote, chan, host, primary key(name, chan))")
+    db.commit()
 
-def db_init(db, conn_name):
-    """check to see that our db has the the seen table (connection name is for caching the result per connection)
+
+@hook.migration(2)
+def create_chan_index(db):
+    """
+    .seen looks up names with LIKE, which can't use the (name, chan) primary key, so at least narrow it by channel
     :type db: sqlalchemy.orm.Session
     """
-    global db_ready
-    if db_ready.count(conn_name) < 1:
-        db.execute("create table if not exists seen_user(name, time, quote, chan, host, primary key(name, chan))")
-        db.commit()
-        db_ready.append(conn_name)
+    db.execute("create index if not exists seen_user_chan_idx on seen_user (chan, name)")
+    db.commit()
 
 
 def track_seen(event, db, conn):
@@ -27,7 +32,6 @@ def track_seen(event, db, conn):
     :type db: sqlalchemy.orm.Session
     :type conn: cloudbot.client.Client
     """
-    db_init(db, conn)
     # keep private messages private
     if event.chan[:1] == "#" and not re.findall('^s/.*/.*/$', event.content.lower()):
         db.execute(
@@ -42,14 +46,7 @@ def track_history(event, message_time, conn):
     :type event: cloudbot.event.Event
     :type conn: cloudbot.client.Client
     """
-    try:
-        history = conn.history[event.chan]
-    except KeyError:
-        conn.history[event.chan] = deque(maxlen=100)
-        history = conn.history[event.chan]
-
-    data = (event.nick, message_time, event.content)
-    history.append(data)
+    conn.history.add(event.chan, event.nick, message_time, event.content)
 
 
 @hook.event([EventType.message, EventType.action], ignorebots=False, singlethread=True)
@@ -67,6 +64,19 @@ def chat_tracker(event, db, conn):
     track_history(event, message_time, conn)
 
 
+@asyncio.coroutine
+@hook.event([EventType.part, EventType.kick], ignorebots=False)
+def forget_history(event, conn):
+    """
+    Drops a channel's history once the bot has left it
+    :type event: cloudbot.event.Event
+    :type conn: cloudbot.client.Client
+    """
+    left = event.target if event.type is EventType.kick else event.nick
+    if left.lower() == conn.nick.lower():
+        conn.history.clear(event.chan)
+
+
 @asyncio.coroutine
 @hook.command(autohelp=False)
 def resethistory(event, conn):
@@ -74,18 +84,17 @@ def resethistory(event, conn):
     :type event: cloudbot.event.Event
     :type conn: cloudbot.client.Client
     """
-    try:
-        conn.history[event.chan].clear()
+    if conn.history.clear(event.chan):
         return "Reset chat history for current channel."
-    except KeyError:
+    else:
         # wat
         return "There is no history for this channel."
 
 
 @hook.command()
-def seen(text, nick, chan, db, event, conn):
+def seen(text, nick, chan, db_read, event, conn):
     """<nick> <channel> - tells when a nickname was last in active in one of my channels
-    :type db: sqlalchemy.orm.Session
+    :type db_read: sqlalchemy.orm.Session
     :type event: cloudbot.event.Event
     :type conn: cloudbot.client.Client
     """
@@ -99,9 +108,7 @@ def seen(text, nick, chan, db, event, conn):
     if not re.match("^[A-Za-z0-9_|.\-\]\[]*$", text.lower()):
         return "I can't look up that name, its impossible to use!"
 
-    db_init(db, conn.name)
-
-    last_seen = db.execute("select name, time, quote from seen_user where name like :name and chan = :chan",
+    last_seen = db_read.execute("select name, time, quote from seen_user where name like :name and chan = :chan",
                            {'name': text, 'chan': chan}).fetchone()
 
     if last_seen:
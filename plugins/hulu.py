@@ -7,7 +7,7 @@ from cloudbot.util import http, timeformat
 hulu_re = re.compile(r'(.*://)(www.hulu.com|hulu.com)(.*)', re.I)
 
 
-@hook.regex(hulu_re)
+@hook.url("hulu.com", pattern=hulu_re)
 def hulu_url(match):
     data = http.get_json("http://www.hulu.com/api/oembed.json?url=http://www.hulu.com" + match.group(3))
     showname = data['title'].split("(")[-1].split(")")[0]
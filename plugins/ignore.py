@@ -1,8 +1,69 @@
 import asyncio
-from fnmatch import fnmatch
 
 from cloudbot import hook
 from cloudbot.event import EventType
+from cloudbot.util.masks import MaskMatcher
+
+# connection name -> (ignore list the matcher was made from, matcher)
+matchers = {}
+
+
+class IgnoreMatcher:
+    """
+    The ignore list of a connection, compiled
+    :type channels: MaskMatcher
+    :type masks: MaskMatcher
+    """
+
+    def __init__(self, ignorelist):
+        """
+        :type ignorelist: list[str]
+        """
+        channels = []
+        masks = []
+        for pattern in ignorelist:
+            pattern = pattern.lower()
+            if pattern.startswith("#"):
+                # .ignore stores channels in the same nick!user@host form as users
+                if pattern.endswith("!*@*"):
+                    pattern = pattern[:-4]
+                channels.append(pattern)
+            else:
+                masks.append(pattern)
+        self.channels = MaskMatcher(channels)
+        self.masks = MaskMatcher(masks)
+
+    def is_ignored(self, chan, mask):
+        """
+        Checks a channel and hostmask against the ignore list, case-insensitively
+        :type chan: str
+        :type mask: str
+        :rtype: bool
+        """
+        return (chan is not None and self.channels.match(chan.lower())) or self.masks.match(mask.lower())
+
+
+def get_matcher(conn):
+    """
+    Returns the compiled ignore list for a connection. Reloading the config replaces the list, so the matcher is
+    remade whenever the list it was made from is no longer the connection's.
+    :type conn: cloudbot.client.Client
+    :rtype: IgnoreMatcher
+    """
+    ignorelist = conn.config["plugins"]["ignore"]["ignored"]
+    compiled_list, matcher = matchers.get(conn.name, (None, None))
+    if compiled_list is not ignorelist:
+        matcher = IgnoreMatcher(ignorelist)
+        matchers[conn.name] = (ignorelist, matcher)
+    return matcher
+
+
+def recompile(conn):
+    """
+    Remakes a connection's matcher after its ignore list has been changed in place
+    :type conn: cloudbot.client.Client
+    """
+    matchers.pop(conn.name, None)
 
 
 @hook.onload
@@ -43,12 +104,8 @@ def ignore_sieve(bot, event, _hook):
         # this is a server message, we don't need to check it
         return event
 
-    ignorelist = event.conn.config["plugins"]["ignore"]["ignored"]
-    mask = event.mask.lower()
-
-    for pattern in ignorelist:
-        if (pattern.startswith("#") and fnmatch(pattern, event.chan)) or fnmatch(mask, pattern):
-            return None
+    if get_matcher(event.conn).is_ignored(event.chan, event.mask.lower()):
+        return None
 
     return event
 
@@ -78,6 +135,7 @@ def ignore(text, bot, conn, notice):
         notice("{} has been ignored.".format(target))
         ignorelist.append(target)
         ignorelist.sort()
+        recompile(conn)
         bot.config.save_config()
     return
 
@@ -93,6 +151,7 @@ def unignore(text, bot, conn, notice):
         notice("{} has been unignored.".format(target))
         ignorelist.remove(target)
         ignorelist.sort()
+        recompile(conn)
         bot.config.save_config()
     else:
         notice("{} is not ignored.".format(target))
@@ -37,7 +37,7 @@ def imdb(text):
         return 'Unknown error.'
 
 
-@hook.regex(imdb_re)
+@hook.url("imdb.com", pattern=imdb_re)
 def imdb_url(match):
     imdb_id = match.group(4).split('/')[-1]
     if imdb_id == "":
@@ -6,6 +6,15 @@ from cloudbot.util import http, timesince
 api_url = "http://ws.audioscrobbler.com/2.0/?format=json"
 
 
+@hook.migration(1)
+def create_table(db):
+    """
+    :type db: sqlalchemy.orm.Session
+    """
+    db.execute("create table if not exists lastfm(nick primary key, acc)")
+    db.commit()
+
+
 @hook.command("lastfm", "l", autohelp=False)
 def lastfm(text, nick, db, bot, notice):
     """[user] [dontsave] - displays the now playing (or last played) track of LastFM user [user]"""
@@ -20,8 +29,6 @@ def lastfm(text, nick, db, bot, notice):
     else:
         user = text
 
-    db.execute("create table if not exists lastfm(nick primary key, acc)")
-
     if not user:
         user = db.execute("select acc from lastfm where nick=lower(:nick)",
                           {'nick': nick}).fetchone()
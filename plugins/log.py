@@ -1,17 +1,23 @@
 import asyncio
+import datetime
+import operator
 import os
-import codecs
+import re
+import string
+import threading
 import time
+from collections import OrderedDict
 
 import cloudbot
 from cloudbot import hook
 from cloudbot.event import EventType
+from cloudbot.util import logwriter, logfiles, logsearch, ratelimit, web
+from cloudbot.util.formatting import strip_colors
 
 
 # +---------+
 # | Formats |
 # +---------+
-from cloudbot.util.formatting import strip_colors
 
 base_formats = {
     EventType.message: "[{server}:{channel}] <{nick}> {content}",
@@ -39,206 +45,412 @@ ctcp_unknown = "[{server}:{channel}] {nick} [{user}@{host}] has requested unknow
 ctcp_unknown_with_message = ("[{server}:{channel}] {nick} [{user}@{host}] "
                              "has requested unknown CTCP {ctcp_command}: {ctcp_message}")
 
+known_ctcp_commands = ("VERSION", "PING", "TIME", "FINGER")
+
+motd_commands = ("375", "372", "376")
+server_info_commands = ("003", "005", "250", "251", "252", "253", "254", "255", "256")
+
+# commands logged to channel log files
+file_log_commands = frozenset(("PRIVMSG", "PART", "JOIN", "MODE", "TOPIC", "QUIT", "NOTICE"))
+
 
 # +------------+
 # | Formatting |
 # +------------+
 
-def format_event(event):
+irc_control_chars = frozenset("\x03\x0f\x02\x16\x1f")
+
+
+def strip_content(content):
     """
-    Format an event
-    :type event: cloudbot.event.Event
-    :rtype: str
+    Strips IRC colors from content, skipping the regex for the usual case of content without any
+    :type content: str | None
+    :rtype: str | None
     """
+    if content is None or irc_control_chars.isdisjoint(content):
+        return content
+    return strip_colors(content)
+
+
+# the event attribute each field used in the formats comes from
+field_attributes = {
+    "server": "conn.readable_name",
+    "channel": "chan",
+    "chan": "chan",
+    "target": "target",
+    "nick": "nick",
+    "user": "user",
+    "host": "host",
+    "irc_raw": "irc_raw",
+}
 
-    # Setup arguments
+# how the remaining fields are worked out, from an event and its stripped content
+field_getters = {
+    "content": lambda event, content: content,
+    "param_tail": lambda event, content: " ".join(event.irc_paramlist[1:]),
+    "ctcp_command": lambda event, content: event.irc_ctcp_text.partition(" ")[0],
+    "ctcp_message": lambda event, content: event.irc_ctcp_text.partition(" ")[2],
+}
 
-    args = {
-        "server": event.conn.readable_name, "target": event.target, "channel": event.chan, "nick": event.nick,
-        "user": event.user, "host": event.host
-    }
 
-    if event.content is not None:
-        # We can't strip colors from None
-        args["content"] = strip_colors(event.content)
+def compile_format(log_format):
+    """
+    Compiles a format into a function taking an event and its stripped content. The function only looks up the fields
+    the format uses, fetching all of the event's attributes in one go, and fills them in positionally.
+    :type log_format: str
+    :rtype: (cloudbot.event.Event, str) -> str
+    """
+    fields = [field for _, field, _, _ in string.Formatter().parse(log_format) if field is not None]
+    # attribute fields are numbered first, so they can be passed straight from the attrgetter's tuple
+    attribute_fields = [field for field in fields if field in field_attributes]
+    other_fields = [field for field in fields if field not in field_attributes]
+    positions = {field: position for position, field in enumerate(unique(attribute_fields + other_fields))}
+
+    parts = []
+    for literal, field, spec, conversion in string.Formatter().parse(log_format):
+        parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is not None:
+            parts.append("{{{}{}{}}}".format(positions[field], "!" + conversion if conversion else "",
+                                            ":" + spec if spec else ""))
+    positional_format = "".join(parts).format
+
+    attributes = [field_attributes[field] for field in unique(attribute_fields)]
+    getters = [field_getters[field] for field in unique(other_fields)]
+
+    if not attributes:
+        def formatter(event, content):
+            return positional_format(*[getter(event, content) for getter in getters])
+        return formatter
+
+    if len(attributes) == 1:
+        # attrgetter returns a bare value rather than a tuple when given only one attribute
+        get_attribute = operator.attrgetter(attributes[0])
+
+        def get_attributes(event):
+            return get_attribute(event),
     else:
-        args["content"] = None
-
-    # Try formatting with non-connection-specific formats
-
-    if event.type in base_formats:
-        return base_formats[event.type].format(**args)
+        get_attributes = operator.attrgetter(*attributes)
+
+    if not getters:
+        def formatter(event, content):
+            return positional_format(*get_attributes(event))
+    elif getters == [field_getters["content"]]:
+        def formatter(event, content):
+            return positional_format(*get_attributes(event) + (content,))
+    else:
+        def formatter(event, content):
+            return positional_format(*get_attributes(event) + tuple(getter(event, content) for getter in getters))
 
-    # Try formatting with IRC-formats, if this is an IRC event
-    if event.irc_command is not None:
-        return format_irc_event(event, args)
+    return formatter
 
 
-def format_irc_event(event, args):
+def unique(items):
     """
-    Format an IRC event
-    :param event: The event to format
-    :param args: The pre-created arguments
-    :return:
+    :type items: list
+    :rtype: list
     """
+    return list(OrderedDict.fromkeys(items))
+
+
+base_formatters = {event_type: compile_format(log_format) for event_type, log_format in base_formats.items()}
+irc_formatters = {command: compile_format(log_format) for command, log_format in irc_formats.items()}
+irc_default_formatter = compile_format(irc_default)
+ctcp_formatters = {
+    # (known, with message) -> formatter
+    (True, False): compile_format(ctcp_known),
+    (True, True): compile_format(ctcp_known_with_message),
+    (False, False): compile_format(ctcp_unknown),
+    (False, True): compile_format(ctcp_unknown_with_message),
+}
 
-    # Setup arguments
-
-    # Add the IRC-specific param_tail argument to the generic arguments
-    args["param_tail"] = " ".join(event.irc_paramlist[1:])
-
-    # Try formatting with the IRC command
 
-    if event.irc_command in irc_formats:
-        return irc_formats[event.irc_command].format(**args)
+def format_ctcp(event, content):
+    ctcp_command, _, ctcp_message = event.irc_ctcp_text.partition(" ")
+    return ctcp_formatters[(ctcp_command in known_ctcp_commands, bool(ctcp_message))](event, content)
 
-    # Try formatting with the CTCP command
 
-    if event.irc_ctcp_text is not None:
-        ctcp_command, ctcp_message = event.irc_ctcp_text.split(None, 1)
-        args["ctcp_command"] = ctcp_command
-        args["ctcp_message"] = ctcp_message
+class LogSettings:
+    """
+    The parts of the "logging" config used for each line, worked out once each time the config is loaded
+    :type raw_file_log: bool
+    :type hidden_commands: set[str]
+    """
 
-        if ctcp_command in ("VERSION", "PING", "TIME", "FINGER"):
-            if ctcp_message:
-                return ctcp_known_with_message.format(**args)
-            else:
-                return ctcp_known.format(**args)
-        else:
-            if ctcp_message:
-                return ctcp_unknown_with_message.format(**args)
-            else:
-                return ctcp_unknown.format(**args)
+    def __init__(self, logging_config):
+        """
+        :type logging_config: dict
+        """
+        self.raw_file_log = logging_config.get("raw_file_log", False)
+        self.hidden_commands = {"PING"}
+        if not logging_config.get("show_motd", True):
+            self.hidden_commands.update(motd_commands)
+        if not logging_config.get("show_server_info", True):
+            self.hidden_commands.update(server_info_commands)
 
-    # No formats have been found, resort to the default
 
-    # Check if the command is blacklisted for raw output
+_no_logging_config = {}
+# (logging config, settings made from it)
+_settings = (None, None)
 
-    logging_config = event.bot.config.get("logging", {})
 
-    if not logging_config.get("show_motd", True) and event.irc_command in ("375", "372", "376"):
-        return None
-    elif not logging_config.get("show_server_info", True) and event.irc_command in (
-            "003", "005", "250", "251", "252", "253", "254", "255", "256"):
-        return None
-    elif event.irc_command == "PING":
-        return None
+def get_settings(bot):
+    """
+    Returns the LogSettings for the bot's current config. Loading the config replaces its "logging" dict, so settings
+    are only remade when that dict changes.
+    :type bot: cloudbot.bot.CloudBot
+    :rtype: LogSettings
+    """
+    global _settings
+    logging_config = bot.config.get("logging", _no_logging_config)
+    if _settings[0] is not logging_config:
+        _settings = (logging_config, LogSettings(logging_config))
+    return _settings[1]
 
-    # Format using the default raw format
 
-    return irc_default.format(server=event.conn.readable_name, irc_raw=event.irc_raw)
+def format_event(event, content, settings):
+    """
+    Format an event
+    :type event: cloudbot.event.Event
+    :param content: The event's content, stripped of colors
+    :type settings: LogSettings
+    :rtype: str
+    """
+    formatter = base_formatters.get(event.type)
+    if formatter is None:
+        if event.irc_command is None:
+            return None
+        formatter = irc_formatters.get(event.irc_command)
+        if formatter is None:
+            if event.irc_ctcp_text is not None:
+                formatter = format_ctcp
+            elif event.irc_command in settings.hidden_commands:
+                return None
+            else:
+                formatter = irc_default_formatter
+    return formatter(event, content)
 
 # +--------------+
 # | File logging |
 # +--------------+
 
-file_format = "{server}_{chan}_%Y%m%d.log"
-raw_file_format = "{server}_%Y%m%d.log"
+file_format = "{server}_{chan}_{date}.log"
+raw_file_format = "{server}_{date}.log"
 
 folder_format = "%Y"
+date_format = "%Y%m%d"
+
+# (second, folder name, date) for the second the date was last worked out in
+_current_date = (None, None, None)
 
-# Stream cache, (server, chan) -> (file_name, stream)
-stream_cache = {}
-# Raw stream cache, server -> (file_name, stream)
-raw_cache = {}
+
+def get_current_date():
+    """
+    Returns the folder name and date for log files written now, working them out at most once a second
+    :rtype: (str, str)
+    """
+    global _current_date
+    second = int(time.time())
+    if _current_date[0] != second:
+        current_time = time.gmtime(second)
+        _current_date = (second, time.strftime(folder_format, current_time), time.strftime(date_format, current_time))
+    return _current_date[1], _current_date[2]
 
 
 def get_log_filename(server, chan):
-    current_time = time.gmtime()
-    folder_name = time.strftime(folder_format, current_time)
-    file_name = time.strftime(file_format.format(chan=chan, server=server), current_time).lower()
+    folder_name, date = get_current_date()
+    file_name = file_format.format(server=server, chan=chan, date=date).lower()
     return os.path.join(cloudbot.log_dir, folder_name, file_name)
 
 
-def get_log_stream(server, chan):
-    new_filename = get_log_filename(server, chan)
-    cache_key = (server, chan)
-    old_filename, log_stream = stream_cache.get(cache_key, (None, None))
+def get_raw_log_filename(server):
+    folder_name, date = get_current_date()
+    file_name = raw_file_format.format(server=server, date=date).lower()
+    return os.path.join(cloudbot.log_dir, "raw", folder_name, file_name)
+
+
+@asyncio.coroutine
+@hook.irc_raw("*")
+def log_raw(bot, event):
+    """
+    :type bot: cloudbot.bot.CloudBot
+    :type event: cloudbot.event.Event
+    """
+    if not get_settings(bot).raw_file_log:
+        return
 
-    # If the filename has changed since we opened the stream, we should re-open
-    if new_filename != old_filename:
-        # If we had a stream open before, we should close it
-        if log_stream is not None:
-            log_stream.flush()
-            log_stream.close()
+    logwriter.writer.write(get_raw_log_filename(event.conn.name), event.irc_raw + "\n")
 
-        log_dir = os.path.dirname(new_filename)
-        os.makedirs(log_dir, exist_ok=True)
 
-        log_stream = codecs.open(new_filename, "a", "utf-8")
-        stream_cache[cache_key] = (new_filename, log_stream)
+@asyncio.coroutine
+@hook.irc_raw("*")
+def log(bot, event):
+    """
+    Formats each event once, for the console, the channel log files and the search index
+    :type bot: cloudbot.bot.CloudBot
+    :type event: cloudbot.event.Event
+    """
+    content = strip_content(event.content)
+    text = format_event(event, content, get_settings(bot))
+    if text is None:
+        return
 
-    return log_stream
+    bot.logger.info(text)
 
+    if event.irc_command in file_log_commands and event.chan:
+        logwriter.writer.write(get_log_filename(event.conn.name, event.chan), text + "\n")
 
-def get_raw_log_filename(server):
-    current_time = time.gmtime()
-    folder_name = time.strftime(folder_format, current_time)
-    file_name = time.strftime(raw_file_format.format(server=server), current_time).lower()
-    return os.path.join(cloudbot.log_dir, "raw", folder_name, file_name)
+    if logsearch.index is not None and event.type in search_kinds and is_channel(event.chan) and content:
+        logsearch.index.add(time.time(), event.conn.name, event.chan, event.nick, search_kinds[event.type], content)
 
 
-def get_raw_log_stream(server):
-    new_filename = get_raw_log_filename(server)
-    old_filename, log_stream = stream_cache.get(server, (None, None))
+# +-------------+
+# | Log search  |
+# +-------------+
 
-    # If the filename has changed since we opened the stream, we should re-open
-    if new_filename != old_filename:
-        # If we had a stream open before, we should close it
-        if log_stream is not None:
-            log_stream.flush()
-            log_stream.close()
+search_kinds = {
+    EventType.message: logsearch.MESSAGE,
+    EventType.action: logsearch.ACTION,
+    EventType.notice: logsearch.NOTICE,
+}
+
+search_formats = {
+    logsearch.MESSAGE: "[{time}] <{nick}> {content}",
+    logsearch.ACTION: "[{time}] * {nick} {content}",
+    logsearch.NOTICE: "[{time}] -{nick}- {content}",
+}
 
-        log_dir = os.path.dirname(new_filename)
-        os.makedirs(log_dir, exist_ok=True)
+# searches a user can make at once, and how many seconds it takes them to earn another
+GREP_TOKENS = 3
+GREP_RESTORE_TIME = 60
+# results pasted per page, results shown in the channel instead of pasted if there are only a few
+GREP_PAGE_SIZE = 500
+GREP_INLINE_RESULTS = 3
 
-        log_stream = codecs.open(new_filename, "a", "utf-8")
-        stream_cache[server] = (new_filename, log_stream)
+duration_re = re.compile(r"^(\d+)([mhdw])$")
+duration_units = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
 
-    return log_stream
+# limits each user's searches, dropping the buckets of users who haven't searched for a while
+grep_limiter = ratelimit.RateLimiter({"user": (GREP_TOKENS, 1 / GREP_RESTORE_TIME), "channel": None,
+                                      "connection": None})
+grep_lock = threading.Lock()
 
 
-@hook.irc_raw("*", singlethread=True)
-def log_raw(event):
+def is_channel(chan):
     """
-    :type event: cloudbot.event.Event
+    :type chan: str
+    :rtype: bool
     """
-    logging_config = event.bot.config.get("logging", {})
-    if not logging_config.get("raw_file_log", False):
-        return
+    return bool(chan) and chan[0] in "#&!+"
 
-    get_raw_log_stream(event.conn.name).write(event.irc_raw + "\n")
 
-
-@hook.irc_raw("*", singlethread=True)
-def log(event):
+def parse_time(value, now):
     """
-    :type event: cloudbot.event.Event
+    Parses a time ago ("30m", "2h", "3d", "1w") or a UTC date ("2015-06-01") into a unix time
+    :type value: str
+    :type now: float
+    :rtype: float
     """
-    text = format_event(event)
-
-    if text is not None:
-        if event.irc_command in ["PRIVMSG", "PART", "JOIN", "MODE", "TOPIC", "QUIT", "NOTICE"] and event.chan:
-            get_log_stream(event.conn.name, event.chan).write(text + '\n')
+    match = duration_re.match(value)
+    if match:
+        return now - int(match.group(1)) * duration_units[match.group(2)]
+    date = datetime.datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
 
 
-# Log console separately to prevent lag
-@asyncio.coroutine
-@hook.irc_raw("*")
-def console_log(bot, event):
+def format_result(result):
     """
-    :type bot: cloudbot.bot.CloudBot
-    :type event: cloudbot.event.Event
+    :type result: cloudbot.util.logsearch.SearchResult
+    :rtype: str
+    """
+    sent = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(result.time))
+    return search_formats[result.kind].format(time=sent, nick=result.nick, content=result.content)
+
+
+@hook.command("grep", "loggrep")
+def grep(text, chan, nick, conn, notice, event):
+    """[-n nick] [-s since] [-u until] [-p page] <words> - searches this channel's logs, times like 2h, 3d or 2015-06-01
+    :type event: cloudbot.event.CommandEvent
     """
-    text = format_event(event)
-    if text is not None:
-        bot.logger.info(text)
+    if logsearch.index is None:
+        return "Log searching is disabled or unavailable."
+    if not is_channel(chan):
+        return "Logs can only be searched from the channel they're for."
+
+    # grep runs in a thread, and the limiter isn't thread-safe
+    with grep_lock:
+        limited = grep_limiter.check(conn.name, None, nick, "grep", 1)
+    if limited is not None:
+        notice("You're searching too often, try again in a minute.")
+        return
+
+    now = time.time()
+    options = {"nick": None, "start": None, "end": None}
+    page = 1
+    args = text.split()
+    try:
+        while len(args) > 1 and args[0] in ("-n", "-s", "-u", "-p"):
+            flag, value = args.pop(0), args.pop(0)
+            if flag == "-n":
+                options["nick"] = value
+            elif flag == "-s":
+                options["start"] = parse_time(value, now)
+            elif flag == "-u":
+                options["end"] = parse_time(value, now)
+            else:
+                page = max(int(value), 1)
+    except ValueError:
+        notice("Times must look like 30m, 2h, 3d, 1w or 2015-06-01, and pages must be numbers.")
+        return
+
+    words = " ".join(args)
+    if not logsearch.build_query(words):
+        event.notice_doc()
+        return
+
+    results = logsearch.index.search(conn.name, chan, words, limit=GREP_PAGE_SIZE + 1,
+                                     offset=(page - 1) * GREP_PAGE_SIZE, **options)
+    if not results:
+        return "No messages found."
+
+    more = len(results) > GREP_PAGE_SIZE
+    results = results[:GREP_PAGE_SIZE]
+    if page == 1 and len(results) <= GREP_INLINE_RESULTS:
+        return [format_result(result) for result in results]
+
+    pasted = web.paste("\n".join(format_result(result) for result in results))
+    if more:
+        return "Page {} of matches: {} (use -p {} for older ones)".format(page, pasted, page + 1)
+    return "{} matches on page {}: {}".format(len(results), page, pasted)
 
 
-# TODO: @hook.onstop() for when unloaded
-@hook.command("flushlog", permissions=["adminonly"])
+@hook.command("flushlog", permissions=["adminonly"], autohelp=False)
 def flush_log():
-    for stream in stream_cache.values():
-        stream.flush()
-    for stream in raw_cache.values():
-        stream.flush()
+    """- writes out all queued log lines to disk"""
+    if logwriter.writer.flush(timeout=30):
+        return "Logs flushed."
+    return "Timed out waiting for logs to flush."
+
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return "{:.1f}{}".format(size, unit)
+
+
+@hook.command("logstats", permissions=["adminonly"], autohelp=False)
+def log_stats(notice):
+    """- shows how much disk the channel logs use, and what compressing and pruning them has saved"""
+    if logfiles.maintainer is None:
+        return "Log maintenance isn't running."
+    stats = logfiles.maintainer.get_stats()
+    notice("{} log files ({} compressed) using {}, {} saved by compression.".format(
+        stats["files"], stats["compressed_files"], _format_size(stats["size"]), _format_size(stats["saved"])))
+    if stats["files_compressed"]:
+        notice("Since startup: compressed {} files from {} to {} in {:.1f}s of compressing.".format(
+            stats["files_compressed"], _format_size(stats["bytes_before"]),
+            _format_size(stats["bytes_after"]), stats["compress_time"]))
+    if stats["files_deleted"]:
+        notice("Since startup: deleted {} files past retention, freeing {}.".format(
+            stats["files_deleted"], _format_size(stats["bytes_deleted"])))
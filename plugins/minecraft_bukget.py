@@ -19,7 +19,7 @@ details_url = base_url + "plugins/bukkit/{}"
 @hook.onload()
 def load_categories():
     global categories, count_total, count_categories
-    categories = requests.get("http://api.bukget.org/3/categories").json()
+    categories = http.session.get("http://api.bukget.org/3/categories").json()
 
     count_total = sum([cat["count"] for cat in categories])
     count_categories = {cat["name"].lower(): int(cat["count"]) for cat in categories}  # dict comps!
@@ -38,7 +38,7 @@ def plugin_search(term):
     search_term = http.quote_plus(term)
 
     try:
-        request = requests.get(search_url.format(search_term))
+        request = http.session.get(search_url.format(search_term))
         request.raise_for_status()
     except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
         raise BukgetError("Error Fetching Search Page: {}".format(e))
@@ -66,7 +66,7 @@ def plugin_random():
         plugin_number = random.randint(1, count_total)
         print("trying {}".format(plugin_number))
         try:
-            request = requests.get(random_url.format(plugin_number))
+            request = http.session.get(random_url.format(plugin_number))
             request.raise_for_status()
         except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
             raise BukgetError("Error Fetching Search Page: {}".format(e))
@@ -84,7 +84,7 @@ def plugin_details(slug):
     slug = slug.lower().strip()
 
     try:
-        request = requests.get(details_url.format(slug))
+        request = http.session.get(details_url.format(slug))
         request.raise_for_status()
     except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
         raise BukgetError("Error Fetching Details: {}".format(e))
@@ -9,7 +9,7 @@ def mcstatus():
     """- gets the status of various Mojang (Minecraft) servers"""
 
     try:
-        request = http.get("http://status.mojang.com/check")
+        request = http.get("http://status.mojang.com/check", cache=30, negative_cache=15)
     except (http.URLError, http.HTTPError) as e:
         return "Unable to get Minecraft server status: {}".format(e)
 
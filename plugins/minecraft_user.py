@@ -23,7 +23,7 @@ def get_name(uuid):
     uuid_encoded = http.quote_plus(uuid)
 
     try:
-        request = requests.get(UUID_URL.format(uuid_encoded))
+        request = http.session.get(UUID_URL.format(uuid_encoded))
     except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
         raise McuError("Could not get name from UUID: {}".format(e))
 
@@ -53,7 +53,7 @@ def get_profile(name):
     # submit the profile request
     try:
         headers = {"Content-Type": "application/json"}
-        request = requests.post(PROFILE_URL, data=json.dumps(payload).encode('utf-8'), headers=headers)
+        request = http.session.post(PROFILE_URL, data=json.dumps(payload).encode('utf-8'), headers=headers)
     except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
         raise McuError("Could not get profile status: {}".format(e))
 
@@ -74,7 +74,7 @@ def get_profile(name):
 
     try:
         params = {'user': name}
-        response = requests.get(PAID_URL, params=params)
+        response = http.session.get(PAID_URL, params=params)
     except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
         raise McuError("Could not get payment status: {}".format(e))
 
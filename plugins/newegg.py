@@ -64,7 +64,7 @@ def format_item(item, show_url=True):
 
 ## HOOK FUNCTIONS
 
-@hook.regex(NEWEGG_RE)
+@hook.url("newegg.com", pattern=NEWEGG_RE)
 def newegg_url(match):
     item_id = match.group(1)
     item = http.get_json(API_PRODUCT.format(item_id))
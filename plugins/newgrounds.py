@@ -11,7 +11,7 @@ def test(s):
     return set(s) <= valid
 
 
-@hook.regex(newgrounds_re)
+@hook.url("newgrounds.com", pattern=newgrounds_re)
 def newgrounds_url(match):
     location = match.group(4).split("/")[-1]
     if not test(location):
@@ -2,18 +2,13 @@ import re
 
 from cloudbot import hook
 
-db_ready = False
-
 
 def clean_sql(sql):
     return re.sub(r'\s+', " ", sql).strip()
 
 
+@hook.migration(1)
 def db_init(db):
-    global db_ready
-    if db_ready:
-        return
-
     exists = db.execute("""
       select exists (
         select * from sqlite_master where type = "table" and name = "todos"
@@ -31,8 +26,6 @@ def db_init(db):
 
     db.commit()
 
-    db_ready = True
-
 
 def db_getall(db, nick, limit=-1):
     return db.execute("""
@@ -93,8 +86,6 @@ def db_search(db, nick, query):
 def note(text, nick, db, notice):
     """<add|del|list|search> args - manipulates your list of notes"""
 
-    db_init(db)
-
     parts = text.split()
     cmd = parts[0].lower()
 
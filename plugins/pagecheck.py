@@ -5,7 +5,7 @@ import requests
 import requests.exceptions
 
 from cloudbot import hook
-from cloudbot.util import urlnorm
+from cloudbot.util import http, urlnorm
 
 
 @hook.command("down", "offline", "up")
@@ -20,7 +20,7 @@ def down(text):
     text = 'http://' + urllib.parse.urlparse(text).netloc
 
     try:
-        requests.get(text)
+        http.session.get(text)
     except requests.exceptions.ConnectionError:
         return '{} seems to be down'.format(text)
     else:
@@ -39,7 +39,7 @@ def isup(text):
     domain = auth or path
     url = urlnorm.normalize(domain, assume_scheme="http")
     try:
-        response = requests.get('http://isup.me/' + domain)
+        response = http.session.get('http://isup.me/' + domain)
     except requests.exceptions.ConnectionError:
         return "Failed to get status."
     if response.status_code != requests.codes.ok:
@@ -23,7 +23,7 @@ except ImportError:
     objgraph = None
 
 from cloudbot import hook
-from cloudbot.util import web
+from cloudbot.util import http, ratelimit, web
 
 
 def get_name(thread_id):
@@ -70,6 +70,98 @@ def threaddump_command():
     return get_thread_dump()
 
 
+@hook.command("httpstats", autohelp=False, permissions=["botcontrol"])
+def http_stats(notice):
+    """- shows request counts, latency and connections opened for each host contacted over HTTP"""
+    stats = http.get_stats()
+    if not stats:
+        notice("No HTTP requests made yet.")
+        return
+    lines = []
+    for host, host_stats in sorted(stats.items(), key=lambda item: item[1]["requests"], reverse=True):
+        lines.append("{}: {} requests ({} errors) over {} connections, avg {:.0f}ms, max {:.0f}ms".format(
+            host, host_stats["requests"], host_stats["errors"], host_stats["connections"],
+            host_stats["average_time"] * 1000, host_stats["max_time"] * 1000))
+    flight_stats = http.get_flight_stats()
+    if flight_stats:
+        lines.append("")
+        lines.append("Shared in-flight requests:")
+        for host, host_stats in sorted(flight_stats.items()):
+            lines.append("{}: {deduplicated} of {requests} requests shared another caller's fetch".format(
+                host, **host_stats))
+    shorten_stats = web.get_shorten_stats()
+    if shorten_stats:
+        lines.append("")
+        lines.append("URL shorteners:")
+        for service, service_stats in sorted(shorten_stats.items()):
+            lines.append("{}: {} requests ({} errors), avg {:.0f}ms, {} cached in memory, {} cached on disk".format(
+                service, service_stats["requests"], service_stats["errors"], service_stats["average_time"] * 1000,
+                service_stats["memory_hits"], service_stats["disk_hits"]))
+    cache_stats = http.get_cache_stats()
+    if cache_stats:
+        lines.append("")
+        lines.append("Response cache:")
+        for host, host_stats in sorted(cache_stats.items()):
+            lines.append("{}: {hits} hits, {misses} misses, {revalidated} revalidated, {negative_hits} cached "
+                         "failures".format(host, **host_stats))
+    return web.paste("\n".join(lines))
+
+
+@hook.command("linkstats", autohelp=False, permissions=["botcontrol"])
+def link_stats(bot, notice):
+    """- shows how often link previews for each domain were answered from the preview cache"""
+    stats = bot.link_previews.get_stats()
+    if not stats:
+        notice("No links previewed yet.")
+        return
+    for host, host_stats in sorted(stats.items(), key=lambda item: sum(item[1].values()), reverse=True):
+        total = host_stats["hits"] + host_stats["misses"]
+        notice("{}: {} of {} previews cached ({:.0%})".format(host, host_stats["hits"], total,
+                                                               host_stats["hits"] / total))
+    notice("{} repeated links ignored within the dedup window.".format(bot.recent_links.duplicates))
+
+
+@hook.command("ratestats", autohelp=False, permissions=["botcontrol"])
+def rate_stats(notice):
+    """- shows how many commands the rate limits have let through or stopped, and by which limit"""
+    stats = ratelimit.limiter.get_stats()
+    limited = sum(stats["limited"].values())
+    notice("{} commands allowed, {} limited ({}).".format(
+        stats["allowed"], limited, ", ".join("{}: {}".format(scope, count)
+                                             for scope, count in sorted(stats["limited"].items())) or "none"))
+    if stats["limited_commands"]:
+        top = sorted(stats["limited_commands"].items(), key=lambda item: item[1], reverse=True)[:5]
+        notice("Most limited commands: {}".format(", ".join("{} ({})".format(name, count) for name, count in top)))
+    notice("Buckets: {}; {} idle buckets dropped.".format(
+        ", ".join("{} {}".format(count, scope) for scope, count in sorted(stats["buckets"].items())),
+        stats["evictions"]))
+
+
+@hook.command("breakers", autohelp=False, permissions=["botcontrol"])
+def breakers(text, notice):
+    """[reset <host>] - shows hosts whose circuit breakers have seen failures, or closes the breaker for <host>"""
+    args = text.split()
+    if args and args[0] == "reset":
+        if len(args) != 2:
+            return "Usage: breakers reset <host>"
+        if http.reset_breaker(args[1]):
+            return "Closed the circuit for {}.".format(args[1])
+        return "No requests have been made to {}.".format(args[1])
+
+    states = {host: state for host, state in http.get_breaker_states().items()
+              if state["state"] != "closed" or state["failures"] or state["rejected"]}
+    if not states:
+        notice("All circuits closed.")
+        return
+    for host, state in sorted(states.items()):
+        if state["state"] == "open":
+            status = "open, retrying in {:.0f}s".format(state["retry_in"])
+        else:
+            status = state["state"]
+        notice("{}: {} ({} consecutive failures, {} requests rejected)".format(host, status, state["failures"],
+                                                                                state["rejected"]))
+
+
 @hook.command("objtypes", autohelp=False, permissions=["botcontrol"])
 def show_types():
     if objgraph is None:
@@ -1,6 +1,10 @@
 import random
 import re
+import threading
 import time
+from collections import OrderedDict
+
+from sqlalchemy.exc import IntegrityError
 
 from cloudbot import hook
 
@@ -12,32 +16,228 @@ def format_quote(q, num, n_quotes):
                                     nick, msg)
 
 
-def create_table_if_not_exists(db):
-    """Creates an empty quote table if one does not already exist"""
+# maximum number of (chan, nick) keys to remember quote counts for
+MAX_CACHED_KEYS = 1024
+# times a quote lookup is retried when quotes are deleted between counting them and fetching one
+MAX_ATTEMPTS = 3
+
+# (chan, nick_lower) -> number of non-deleted quotes for that key. chan or nick_lower may be None, meaning "any".
+# Counts are loaded lazily, kept in LRU order, and kept up to date as quotes are added and deleted.
+quote_counts = OrderedDict()
+quote_lock = threading.Lock()
+
+
+@hook.migration(1)
+def create_table(db):
+    """Creates an empty quote table if one does not already exist
+    :type db: sqlalchemy.orm.Session
+    """
     db.execute("create table if not exists quote"
                "(chan, nick, add_nick, msg, time real, deleted default 0, "
                "primary key (chan, nick, msg))")
     db.commit()
 
 
+def _backfill_nick_lower(db):
+    """
+    Sets nick_lower from nick wherever they disagree. This is done in Python rather than with SQLite's lower(), which
+    only lower-cases ASCII, so it matches the nick.lower() used for new quotes and lookups.
+    :type db: sqlalchemy.orm.Session
+    """
+    rows = db.execute("select rowid, nick, nick_lower from quote").fetchall()
+    for rowid, nick, nick_lower in rows:
+        if nick is not None and nick.lower() != nick_lower:
+            db.execute("update quote set nick_lower = ? where rowid = ?", (nick.lower(), rowid))
+
+
+@hook.migration(2)
+def add_nick_lower(db):
+    """Adds a normalized nick column, so nick lookups can use an index
+    :type db: sqlalchemy.orm.Session
+    """
+    columns = [row[1] for row in db.execute("pragma table_info(quote)")]
+    if "nick_lower" not in columns:
+        db.execute("alter table quote add column nick_lower")
+    _backfill_nick_lower(db)
+    db.commit()
+
+
+@hook.migration(3)
+def create_indexes(db):
+    """
+    :type db: sqlalchemy.orm.Session
+    """
+    db.execute("create index if not exists quote_chan_nick_idx on quote (chan, nick_lower, time)")
+    db.execute("create index if not exists quote_nick_idx on quote (nick_lower, time)")
+    db.execute("create index if not exists quote_chan_idx on quote (chan, time)")
+    db.commit()
+
+
+@hook.migration(4)
+def create_live_indexes(db):
+    """
+    Replaces the indexes with ones covering only quotes which haven't been deleted, so counting quotes and stepping to
+    the nth one never touches the table. Also redoes the nick_lower backfill for non-ASCII nicks, which SQLite's lower()
+    left alone.
+    :type db: sqlalchemy.orm.Session
+    """
+    _backfill_nick_lower(db)
+    db.execute("drop index if exists quote_chan_nick_idx")
+    db.execute("drop index if exists quote_nick_idx")
+    db.execute("drop index if exists quote_chan_idx")
+    db.execute("create index if not exists quote_chan_nick_live_idx on quote (chan, nick_lower, time) "
+               "where deleted != 1")
+    db.execute("create index if not exists quote_nick_live_idx on quote (nick_lower, time) where deleted != 1")
+    db.execute("create index if not exists quote_chan_live_idx on quote (chan, time) where deleted != 1")
+    db.commit()
+
+
+# (has chan, has nick) -> the column numbering the live quotes of that kind of key from 1, oldest first
+seq_columns = {
+    (True, True): "chan_nick_seq",
+    (True, False): "chan_seq",
+    (False, True): "nick_seq",
+}
+
+
+def _number_quotes(db):
+    """
+    Numbers every live quote within each of its keys, oldest first, and clears the numbers of deleted quotes
+    :type db: sqlalchemy.orm.Session
+    """
+    db.execute("update quote set chan_nick_seq = null, chan_seq = null, nick_seq = null where deleted = 1")
+    counters = {}
+    rows = db.execute("select rowid, chan, nick_lower from quote where deleted != 1 order by time, rowid").fetchall()
+    for rowid, chan, nick_lower in rows:
+        seqs = []
+        for key in _cache_keys(chan, nick_lower):
+            counters[key] = counters.get(key, 0) + 1
+            seqs.append(counters[key])
+        db.execute("update quote set chan_nick_seq = ?, chan_seq = ?, nick_seq = ? where rowid = ?",
+                   tuple(seqs) + (rowid,))
+
+
+@hook.migration(5)
+def add_sequences(db):
+    """
+    Numbers each key's quotes, so the nth quote is found by seeking an index rather than stepping through it. The
+    numbers are kept up to date by add_quote and del_quote.
+    :type db: sqlalchemy.orm.Session
+    """
+    columns = [row[1] for row in db.execute("pragma table_info(quote)")]
+    for column in seq_columns.values():
+        if column not in columns:
+            db.execute("alter table quote add column {} integer".format(column))
+    _number_quotes(db)
+    db.execute("drop index if exists quote_chan_nick_live_idx")
+    db.execute("drop index if exists quote_nick_live_idx")
+    db.execute("drop index if exists quote_chan_live_idx")
+    db.execute("create index if not exists quote_chan_nick_seq_idx on quote (chan, nick_lower, chan_nick_seq) "
+               "where deleted != 1")
+    db.execute("create index if not exists quote_nick_seq_idx on quote (nick_lower, nick_seq) where deleted != 1")
+    db.execute("create index if not exists quote_chan_seq_idx on quote (chan, chan_seq) where deleted != 1")
+    db.commit()
+
+
+def _key_filter(chan, nick_lower):
+    """
+    Returns the WHERE clause and parameters selecting a key's live quotes
+    :rtype: (str, tuple)
+    """
+    if chan is not None and nick_lower is not None:
+        return "chan = ? AND nick_lower = ? AND deleted != 1", (chan, nick_lower)
+    elif chan is not None:
+        return "chan = ? AND deleted != 1", (chan,)
+    return "nick_lower = ? AND deleted != 1", (nick_lower,)
+
+
+def _seq_column(chan, nick_lower):
+    return seq_columns[(chan is not None, nick_lower is not None)]
+
+
+def _get_count(db, chan, nick_lower):
+    """Returns the number of quotes matching the given key, which is the highest number given to one of them
+    :type db: sqlalchemy.orm.Session
+    :rtype: int
+    """
+    key = (chan, nick_lower)
+    with quote_lock:
+        count = quote_counts.get(key)
+        if count is not None:
+            quote_counts.move_to_end(key)
+            return count
+
+    where, params = _key_filter(chan, nick_lower)
+    count = db.execute("SELECT coalesce(max({}), 0) FROM quote WHERE {}".format(_seq_column(chan, nick_lower), where),
+                       params).fetchone()[0]
+    with quote_lock:
+        quote_counts[key] = count
+        if len(quote_counts) > MAX_CACHED_KEYS:
+            quote_counts.popitem(last=False)
+    return count
+
+
+def _fetch_quote(db, chan, nick_lower, num):
+    """Returns the (time, nick, msg) of the num-th oldest quote matching the given key, or None. This is a single
+    O(log n) seek of the key's sequence index.
+    :type db: sqlalchemy.orm.Session
+    """
+    where, params = _key_filter(chan, nick_lower)
+    column = _seq_column(chan, nick_lower)
+    return db.execute("SELECT time, nick, msg FROM quote WHERE {} AND {} = ?".format(where, column),
+                      params + (num,)).fetchone()
+
+
+def _cache_keys(chan, nick_lower):
+    return (chan, nick_lower), (chan, None), (None, nick_lower)
+
+
+def _adjust_counts(chan, nick_lower, change):
+    with quote_lock:
+        for key in _cache_keys(chan, nick_lower):
+            if key in quote_counts:
+                quote_counts[key] += change
+
+
 def add_quote(db, chan, nick, add_nick, msg):
     """Adds a quote to a nick, returns message string"""
+    nick_lower = nick.lower()
+    # the new quote is the newest, so it's numbered one past the last quote of each of its keys
     try:
         db.execute('''INSERT OR FAIL INTO quote
-                      (chan, nick, add_nick, msg, time)
-                      VALUES(?,?,?,?,?)''',
-                   (chan, nick, add_nick, msg, time.time()))
+                      (chan, nick, nick_lower, add_nick, msg, time, chan_nick_seq, chan_seq, nick_seq)
+                      VALUES(?,?,?,?,?,?,
+                             (SELECT coalesce(max(chan_nick_seq), 0) + 1 FROM quote
+                              WHERE chan = ? AND nick_lower = ? AND deleted != 1),
+                             (SELECT coalesce(max(chan_seq), 0) + 1 FROM quote WHERE chan = ? AND deleted != 1),
+                             (SELECT coalesce(max(nick_seq), 0) + 1 FROM quote
+                              WHERE nick_lower = ? AND deleted != 1))''',
+                   (chan, nick, nick_lower, add_nick, msg, time.time(), chan, nick_lower, chan, nick_lower))
         db.commit()
-    except db.IntegrityError:
+    except IntegrityError:
+        db.rollback()
         return "Message already stored, doing nothing."
+
+    _adjust_counts(chan, nick_lower, 1)
     return "Quote added."
 
 
-def del_quote(db, chan, nick, add_nick, msg):
-    """Deletes a quote from a nick"""
-    db.execute('''UPDATE quote SET deleted = 1 WHERE
-                  chan=? AND lower(nick)=lower(?) AND msg=msg''')
+def del_quote(db, chan, nick, msg):
+    """Deletes a quote from a nick, renumbering the quotes after it"""
+    nick_lower = nick.lower()
+    rows = db.execute('''SELECT rowid, chan_nick_seq, chan_seq, nick_seq FROM quote WHERE
+                         chan = ? AND nick_lower = ? AND msg = ? AND deleted != 1''',
+                      (chan, nick_lower, msg)).fetchall()
+    for rowid, chan_nick_seq, chan_seq, nick_seq in rows:
+        db.execute("UPDATE quote SET deleted = 1, chan_nick_seq = NULL, chan_seq = NULL, nick_seq = NULL "
+                   "WHERE rowid = ?", (rowid,))
+        for key, seq in zip(_cache_keys(chan, nick_lower), (chan_nick_seq, chan_seq, nick_seq)):
+            if seq is not None:
+                where, params = _key_filter(*key)
+                db.execute("UPDATE quote SET {0} = {0} - 1 WHERE {1} AND {0} > ?".format(_seq_column(*key), where),
+                           params + (seq,))
     db.commit()
+    _adjust_counts(chan, nick_lower, -len(rows))
 
 
 def get_quote_num(num, count, name):
@@ -57,75 +257,44 @@ def get_quote_num(num, count, name):
     return num
 
 
-def get_quote_by_nick(db, nick, num=False):
-    """Returns a formatted quote from a nick, random or selected by number"""
-    count = db.execute('''SELECT COUNT(*) FROM quote WHERE deleted != 1
-                          AND lower(nick) = lower(?)''', [nick]).fetchall()[0][0]
+def _get_quote(db, chan, nick, num, name):
+    """Returns a formatted quote matching the given channel and/or nick, random or selected by number"""
+    nick_lower = nick.lower() if nick is not None else None
+    for _ in range(MAX_ATTEMPTS):
+        count = _get_count(db, chan, nick_lower)
+        try:
+            position = get_quote_num(num, count, name)
+        except Exception as error_message:
+            return error_message
+
+        quote = _fetch_quote(db, chan, nick_lower, position)
+        if quote is not None:
+            return format_quote(quote, position, count)
+        # quotes were deleted since they were counted, count them again
+        with quote_lock:
+            quote_counts.pop((chan, nick_lower), None)
+    return "Quotes for {} are changing too quickly, try again.".format(name)
 
-    try:
-        num = get_quote_num(num, count, nick)
-    except Exception as error_message:
-        return error_message
 
-    quote = db.execute('''SELECT time, nick, msg
-                          FROM quote
-                          WHERE deleted != 1
-                          AND lower(nick) = lower(?)
-                          ORDER BY time
-                          LIMIT ?, 1''', (nick, (num - 1))).fetchall()[0]
-    return format_quote(quote, num, count)
+def get_quote_by_nick(db, nick, num=False):
+    """Returns a formatted quote from a nick, random or selected by number"""
+    return _get_quote(db, None, nick, num, nick)
 
 
 def get_quote_by_nick_chan(db, chan, nick, num=False):
     """Returns a formatted quote from a nick in a channel, random or selected by number"""
-    count = db.execute('''SELECT COUNT(*)
-                          FROM quote
-                          WHERE deleted != 1
-                          AND chan = ?
-                          AND lower(nick) = lower(?)''', (chan, nick)).fetchall()[0][0]
-
-    try:
-        num = get_quote_num(num, count, nick)
-    except Exception as error_message:
-        return error_message
-
-    quote = db.execute('''SELECT time, nick, msg
-                          FROM quote
-                          WHERE deleted != 1
-                          AND chan = ?
-                          AND lower(nick) = lower(?)
-                          ORDER BY time
-                          LIMIT ?, 1''', (chan, nick, (num - 1))).fetchall()[0]
-    return format_quote(quote, num, count)
+    return _get_quote(db, chan, nick, num, nick)
 
 
 def get_quote_by_chan(db, chan, num=False):
     """Returns a formatted quote from a channel, random or selected by number"""
-    count = db.execute('''SELECT COUNT(*)
-                          FROM quote
-                          WHERE deleted != 1
-                          AND chan = ?''', (chan,)).fetchall()[0][0]
-
-    try:
-        num = get_quote_num(num, count, chan)
-    except Exception as error_message:
-        return error_message
-
-    quote = db.execute('''SELECT time, nick, msg
-                          FROM quote
-                          WHERE deleted != 1
-                          AND chan = ?
-                          ORDER BY time
-                          LIMIT ?, 1''', (chan, (num - 1))).fetchall()[0]
-    return format_quote(quote, num, count)
+    return _get_quote(db, chan, None, num, chan)
 
 
 @hook.command('q')
 @hook.command()
-def quote(text, nick='', chan='', db=None, notice=None):
+def quote(text, nick='', chan='', db=None, db_read=None, notice=None):
     """[#chan] [nick] [#n] OR add <nick> <message> - gets the [#n]th quote by <nick> (defaulting to random) OR adds <message> as a quote for <nick> in the caller's channel"""
-    create_table_if_not_exists(db)
-
     add = re.match(r"add[^\w@]+(\S+?)>?\s+(.*)", text, re.I)
     retrieve = re.match(r"(\S+)(?:\s+#?(-?\d+))?$", text)
     retrieve_chan = re.match(r"(#\S+)\s+(\S+)(?:\s+#?(-?\d+))?$", text)
@@ -138,11 +307,11 @@ def quote(text, nick='', chan='', db=None, notice=None):
         select, num = retrieve.groups()
         by_chan = True if select.startswith('#') else False
         if by_chan:
-            return get_quote_by_chan(db, select, num)
+            return get_quote_by_chan(db_read, select, num)
         else:
-            return get_quote_by_nick(db, select, num)
+            return get_quote_by_nick(db_read, select, num)
     elif retrieve_chan:
         chan, nick, num = retrieve_chan.groups()
-        return get_quote_by_nick_chan(db, chan, nick, num)
+        return get_quote_by_nick_chan(db_read, chan, nick, num)
 
     notice(quote.__doc__)
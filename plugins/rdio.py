@@ -104,7 +104,7 @@ def rdioal(text, bot):
 rdio_re = re.compile(r'(.*:)//(rd.io|www.rdio.com|rdio.com)(:[0-9]+)?(.*)', re.I)
 
 
-@hook.regex(rdio_re)
+@hook.url("rd.io", "rdio.com", pattern=rdio_re)
 def rdio_url(match, bot):
     api_key = bot.config.get("api_keys", {}).get("rdio_key")
     api_secret = bot.config.get("api_keys", {}).get("rdio_secret")
@@ -36,7 +36,7 @@ class ParseError(Exception):
 def get_data(url):
     """ Uses the metadata module to parse the metadata from the provided URL """
     try:
-        request = requests.get(url)
+        request = http.session.get(url)
     except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as e:
         raise ParseError(e)
 
@@ -11,9 +11,9 @@ base_url = "http://reddit.com/r/{}/.json"
 short_url = "http://redd.it/{}"
 
 
-@hook.regex(reddit_re)
+@hook.url("reddit.com", "redd.it", pattern=reddit_re)
 def reddit_url(match):
-    thread = http.get_html(match.group(1))
+    thread, _ = http.get_html_stream("http://" + match.group(1), max_size=1024 * 1024)
 
     title = thread.xpath('//title/text()')[0]
     upvotes = thread.xpath("//span[@class='upvotes']/span[@class='number']/text()")[0]
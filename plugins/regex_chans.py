@@ -56,7 +56,7 @@ def delete_status(db, conn, chan):
 
 @hook.sieve()
 def sieve_regex(bot, event, _hook):
-    if _hook.type == "regex" and event.chan.startswith("#") and _hook.plugin.title != "factoids":
+    if _hook.type in ("regex", "url") and event.chan.startswith("#") and _hook.plugin.title != "factoids":
         status = status_cache.get((event.conn.name, event.chan))
         if status != "ENABLED" and (status == "DISABLED" or not default_enabled):
             bot.logger.info("[{}] Denying {} from {}".format(event.conn.readable_name, _hook.function_name, event.chan))
@@ -26,9 +26,9 @@ def rss(text, message):
     if not result.rows:
         return "Could not find/read RSS feed."
 
-    for row in result.rows:
+    links = web.try_shorten_many([row["link"] for row in result.rows])
+    for row, link in zip(result.rows, links):
         title = formatting.truncate_str(row["title"], 100)
-        link = web.try_shorten(row["link"])
         message("{} - {}".format(title, link))
 
 
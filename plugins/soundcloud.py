@@ -28,7 +28,7 @@ def soundcloud(url, api_key):
         data['comment_count'], url)
 
 
-@hook.regex(sc_re)
+@hook.url("soundcloud.com", pattern=sc_re)
 def soundcloud_url(match, bot=None):
     api_key = bot.config.get("api_keys", {}).get("soundcloud")
     if not api_key:
@@ -39,7 +39,7 @@ def soundcloud_url(match, bot=None):
     return soundcloud(url, api_key)
 
 
-@hook.regex(sndsc_re)
+@hook.url("snd.sc", pattern=sndsc_re)
 def sndsc_url(match, bot=None):
     api_key = bot.config.get("api_keys", {}).get("soundcloud")
     if not api_key:
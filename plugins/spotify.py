@@ -86,7 +86,7 @@ def spartist(inp):
     return "\x02{}\x02 - {}".format(data["artists"][0]["name"], url)
 
 
-@hook.regex(http_re)
+@hook.url("open.spotify.com", pattern=http_re)
 @hook.regex(spotify_re)
 def spotify_url(match):
     type = match.group(2)
@@ -59,7 +59,7 @@ def get_steam_info(url):
            " \x02Price\x02: {price}".format(**data)
 
 
-@hook.regex(steam_re)
+@hook.url("store.steampowered.com", pattern=steam_re)
 def steam_url(match):
     return get_steam_info("http://store.steampowered.com" + match.group(4))
 
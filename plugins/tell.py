@@ -1,6 +1,6 @@
 import re
 from datetime import datetime
-from sqlalchemy import Table, Column, String, Boolean, DateTime
+from sqlalchemy import Table, Column, String, Boolean, DateTime, Index
 
 from sqlalchemy.sql import select
 
@@ -20,6 +20,35 @@ table = Table(
     Column('time_read', DateTime)
 )
 
+Index('tells_pending_idx', table.c.connection, table.c.target, table.c.is_read)
+
+# set of (connection, target) pairs which have unread tells waiting, so tellinput can skip the database for everyone
+# else
+tell_cache = set()
+
+
+@hook.migration(1)
+def create_pending_index(db):
+    """
+    Tables created before the index was declared won't have it yet
+    :type db: sqlalchemy.orm.Session
+    """
+    db.execute("create index if not exists tells_pending_idx on tells (connection, target, is_read)")
+    db.commit()
+
+
+@hook.onload()
+def load_cache(db):
+    """
+    :type db: sqlalchemy.orm.Session
+    """
+    global tell_cache
+    new_cache = set()
+    query = select([table.c.connection, table.c.target]).where(table.c.is_read == 0).distinct()
+    for connection, target in db.execute(query):
+        new_cache.add((connection, target.lower()))
+    tell_cache = new_cache
+
 
 def get_unread(db, server, target):
     query = select([table.c.sender, table.c.message, table.c.time_sent]) \
@@ -47,6 +76,7 @@ def read_all_tells(db, server, target):
         .values(is_read=1)
     db.execute(query)
     db.commit()
+    tell_cache.discard((server, target.lower()))
 
 
 def read_tell(db, server, target, message):
@@ -57,6 +87,8 @@ def read_tell(db, server, target, message):
         .values(is_read=1)
     db.execute(query)
     db.commit()
+    if not count_unread(db, server, target):
+        tell_cache.discard((server, target.lower()))
 
 
 def add_tell(db, server, sender, target, message):
@@ -70,6 +102,7 @@ def add_tell(db, server, sender, target, message):
     )
     db.execute(query)
     db.commit()
+    tell_cache.add((server, target.lower()))
 
 
 @hook.event(EventType.message, singlethread=True)
@@ -79,6 +112,10 @@ def tellinput(event, conn, db, nick, notice):
     :type conn: cloudbot.client.Client
     :type db: sqlalchemy.orm.Session
     """
+    if (conn.name, nick.lower()) not in tell_cache:
+        # no pending tells, no need to touch the database
+        return
+
     if 'showtells' in event.content.lower():
         return
 
@@ -97,10 +134,10 @@ def tellinput(event, conn, db, nick, notice):
 
 
 @hook.command(autohelp=False)
-def showtells(nick, notice, db, conn):
+def showtells(nick, notice, db, db_read, conn):
     """showtells -- View all pending tell messages (sent in a notice)."""
 
-    tells = get_unread(db, conn.name, nick)
+    tells = get_unread(db_read, conn.name, nick)
 
     if not tells:
         notice("You have no pending messages.")
@@ -0,0 +1,83 @@
+import asyncio
+from http.cookiejar import CookieJar
+
+import pytest
+
+from cloudbot.util import async_http, http, httpcache
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    async_http.close_idle_connections()
+    loop.close()
+
+
+@pytest.fixture
+def server(loop, monkeypatch):
+    """
+    A local server answering every request with a JSON body naming the path it was asked for, and the cookie it was
+    sent. Yields the server's URL and the list of request lines it received.
+    """
+    requests = []
+
+    @asyncio.coroutine
+    def handle(reader, writer):
+        while True:
+            request_line = yield from reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = yield from reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            path = request_line.split()[1].decode()
+            requests.append(path)
+            body = '{{"path": "{}", "cookie": "{}"}}'.format(path, headers.get("cookie", "")).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                         b"Set-Cookie: session=abc; Path=/\r\nSet-Cookie: other=1, 2; Path=/\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+        writer.close()
+
+    monkeypatch.setattr(http, "response_cache", httpcache.ResponseCache())
+    monkeypatch.setattr(http, "jar", CookieJar())
+    monkeypatch.setattr(http, "host_policies", {})
+    server = loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", 0, loop=loop))
+    port = server.sockets[0].getsockname()[1]
+    yield "http://127.0.0.1:{}".format(port), requests
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+
+
+def test_cache_options_not_sent_as_query(loop, server):
+    url, requests = server
+    for _ in range(2):
+        data = loop.run_until_complete(async_http.get_json(url + "/api", q="x", cache=600, loop=loop))
+        assert data["path"] == "/api?q=x"
+    # the second call was answered from the shared cache
+    assert requests == ["/api?q=x"]
+    host = url.split("//")[1]
+    assert http.response_cache.stats[host].hits == 1
+
+
+def test_cookies_use_shared_jar(loop, server):
+    url, requests = server
+    data = loop.run_until_complete(async_http.get_json(url + "/login", cookies=True, loop=loop))
+    assert data["cookie"] == ""
+    data = loop.run_until_complete(async_http.get_json(url + "/page", cookies=True, loop=loop))
+    assert sorted(data["cookie"].split("; ")) == ["other=1, 2", "session=abc"]
+    # without cookies=True, nothing from the jar is sent
+    data = loop.run_until_complete(async_http.get_json(url + "/other", loop=loop))
+    assert data["cookie"] == ""
+
+
+def test_invalid_url_doesnt_trip_breaker(loop, monkeypatch):
+    monkeypatch.setattr(http, "host_policies", {})
+    for _ in range(5):
+        with pytest.raises(async_http.URLError):
+            loop.run_until_complete(async_http.get("ftp://example.com/file", loop=loop))
+    assert http.get_policy("example.com").failures == 0
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+import cloudbot
+from cloudbot import config as config_module
+
+
+class MockBot:
+    def __init__(self, loop):
+        self.loop = loop
+        self.connections = []
+        self.configured = []
+
+    def __getattr__(self, name):
+        if name.startswith("configure_"):
+            return lambda: self.configured.append(name)
+        raise AttributeError(name)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def config(tmpdir, monkeypatch, loop):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setitem(cloudbot.dev_mode, "config_reloading", False)
+    tmpdir.join("config.json").write(json.dumps({"connections": [], "http": {"timeout": 10},
+                                                 "history": {"depth": 5}, "api_keys": {}}))
+    bot = MockBot(loop)
+    bot.config = config_module.Config(bot)
+    return bot.config
+
+
+def rewrite(config, **changes):
+    data = dict(config)
+    data.update(changes)
+    with open(config.path, "w") as f:
+        json.dump(data, f)
+    config.load_config()
+
+
+def test_changed_sections_reloaded(config, caplog):
+    with caplog.at_level(logging.WARNING, logger="cloudbot"):
+        rewrite(config, http={"timeout": 20}, links={"dedup_window": 60}, history={"depth": 10},
+                api_keys={"new": "key"})
+    assert sorted(config.bot.configured) == ["configure_http", "configure_links"]
+    assert config["http"] == {"timeout": 20}
+    # history is only read at startup, api keys whenever a plugin uses them
+    assert "Config section history changed, restart the bot to apply it." in caplog.text
+    assert "api_keys" not in caplog.text
+
+
+def test_stop_waits_for_save(config, loop):
+    config["api_keys"] = {"saved": "key"}
+    # handed to the executor, as save_config does after SAVE_DELAY
+    config._save()
+    loop.run_until_complete(config.stop())
+    with open(config.path) as f:
+        assert json.load(f)["api_keys"] == {"saved": "key"}
+
+
+def test_flush_writes_pending_save(config, loop):
+    config["api_keys"] = {"flushed": "key"}
+    config._schedule_save()
+    config.flush()
+    assert config._save_handle is None
+    with open(config.path) as f:
+        assert json.load(f)["api_keys"] == {"flushed": "key"}
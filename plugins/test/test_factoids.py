@@ -0,0 +1,146 @@
+import asyncio
+import time
+import tracemalloc
+
+import pytest
+from sqlalchemy import MetaData, create_engine
+
+from cloudbot.util import botvars
+
+if botvars.metadata is None:
+    botvars.metadata = MetaData()
+
+from plugins import factoids
+
+
+class MockBot:
+    def __init__(self, cache_size=None):
+        self.config = {"factoids": {"cache_size": cache_size}} if cache_size is not None else {}
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    factoids.table.create(engine)
+    conn = engine.connect()
+    yield conn
+    conn.close()
+
+
+def run_now(loop):
+    def _run(function, *args):
+        future = asyncio.Future(loop=loop)
+        future.set_result(function(*args))
+        return future
+    return _run
+
+
+def fill(db, count):
+    db.execute(factoids.table.insert(), [{"word": "word{:06d}".format(i), "data": "data {}".format(i), "nick": "nick"}
+                                        for i in range(count)])
+
+
+def load(loop, db, cache_size=None):
+    loop.run_until_complete(factoids.load_cache(run_now(loop), db, MockBot(cache_size)))
+
+
+def test_has_factoid(loop, db):
+    fill(db, 10)
+    load(loop, db)
+    assert factoids.has_factoid("word000000")
+    assert factoids.has_factoid("word000009")
+    assert not factoids.has_factoid("word")
+    assert not factoids.has_factoid("word0000000")
+    assert not factoids.has_factoid("zzz")
+
+
+def test_get_prefixed(loop, db):
+    fill(db, 25)
+    load(loop, db)
+    assert factoids.get_prefixed("word00001") == ["word0000{:02d}".format(i) for i in range(10, 20)]
+    assert factoids.get_prefixed("word000024") == ["word000024"]
+    assert factoids.get_prefixed("other") == []
+    assert len(factoids.get_prefixed("")) == 25
+
+
+def test_paginate_words():
+    assert factoids.paginate_words([]) == []
+    assert factoids.paginate_words(["a", "b", "c"]) == ["a, b, c"]
+    # each word takes its length plus the separator, so only two fit on a line of 8
+    assert factoids.paginate_words(["abc", "def", "ghi"], 10) == ["abc, def", "ghi"]
+    # a word longer than a line still gets one of its own
+    assert factoids.paginate_words(["abcdefghijkl", "a"], 10) == ["abcdefghijkl", "a"]
+
+
+def test_listfactoids_pages(loop, db):
+    fill(db, factoids.LIST_PAGE_WORDS + 5)
+    load(loop, db)
+    notices = []
+    loop.run_until_complete(factoids.listfactoids("2", notices.append))
+    assert notices == [", ".join("word{:06d}".format(i) for i in range(factoids.LIST_PAGE_WORDS,
+                                                                      factoids.LIST_PAGE_WORDS + 5)), "Page 2/2"]
+
+    notices = []
+    loop.run_until_complete(factoids.listfactoids("word00001", notices.append))
+    assert notices == [", ".join("word0000{:02d}".format(i) for i in range(10, 20))]
+
+    notices = []
+    loop.run_until_complete(factoids.listfactoids("nothing", notices.append))
+    assert notices == ["No factoids found."]
+
+
+def test_bounded_cache_evicts(loop, db):
+    fill(db, 10)
+    load(loop, db, cache_size=3)
+    # only the words are loaded, the data is read when it's needed
+    assert not factoids.factoid_cache
+    assert len(factoids.factoid_keys) == 10
+
+    for i in range(4):
+        data = loop.run_until_complete(factoids.get_factoid(run_now(loop), db, "word{:06d}".format(i)))
+        assert data == "data {}".format(i)
+    assert list(factoids.factoid_cache) == ["word000001", "word000002", "word000003"]
+
+    # using a cached factoid makes it the most recently used, so the next one read pushes out the one after it
+    loop.run_until_complete(factoids.get_factoid(run_now(loop), db, "word000001"))
+    loop.run_until_complete(factoids.get_factoid(run_now(loop), db, "word000005"))
+    assert list(factoids.factoid_cache) == ["word000003", "word000001", "word000005"]
+
+    assert loop.run_until_complete(factoids.get_factoid(run_now(loop), db, "missing")) is None
+    assert len(factoids.factoid_cache) == 3
+
+
+def test_reload_100k(loop, db):
+    fill(db, 100000)
+
+    results = {}
+    for cache_size in (None, 1000):
+        tracemalloc.start()
+        start = time.time()
+        load(loop, db, cache_size)
+        elapsed = time.time() - start
+        _, peak = tracemalloc.get_traced_memory()
+        current = sum(stat.size for stat in tracemalloc.take_snapshot().statistics("filename"))
+        tracemalloc.stop()
+        results[cache_size] = (elapsed, peak, current)
+        assert len(factoids.factoid_keys) == 100000
+
+    # loading every factoid's data has to keep it all, loading only the words doesn't
+    assert results[1000][2] < results[None][2]
+    for elapsed, _, _ in results.values():
+        assert elapsed < 30
+
+    start = time.time()
+    for i in range(0, 100000, 100):
+        assert factoids.has_factoid("word{:06d}".format(i))
+    notices = []
+    loop.run_until_complete(factoids.listfactoids("500", notices.append))
+    assert notices[-1] == "Page 500/1000"
+    assert time.time() - start < 1
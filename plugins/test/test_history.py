@@ -0,0 +1,31 @@
+from cloudbot.util.history import HistoryStore, RingFile
+
+
+def test_depth_zero_disables_channel():
+    store = HistoryStore(depth=10, channel_depths={"#quiet": 0})
+    store.add("esper", "#Quiet", "nick", 1.0, "hello")
+    store.add("esper", "#chan", "nick", 1.0, "hello")
+    assert store.get("esper", "#quiet") is None
+    assert len(store.get("esper", "#chan")) == 1
+
+
+def test_depth_bounds_channel():
+    store = HistoryStore(depth=3)
+    for i in range(10):
+        store.add("esper", "#chan", "nick{}".format(i % 2), float(i), "message {}".format(i))
+    history = store.get("esper", "#chan")
+    assert [record.content for record in history] == ["message 7", "message 8", "message 9"]
+    assert sum(len(records) for records in history.by_nick.values()) == 3
+
+
+def test_private_messages_not_persisted(tmpdir):
+    path = str(tmpdir.join("history.ring"))
+    store = HistoryStore(ring=RingFile(path, 64 * 1024))
+    store.add("esper", "#chan", "nick", 1.0, "public")
+    store.add("esper", "nick", "nick", 2.0, "private")
+    store.close()
+
+    store = HistoryStore(ring=RingFile(path, 64 * 1024))
+    assert [record.content for record in store.get("esper", "#chan")] == ["public"]
+    assert store.get("esper", "nick") is None
+    store.close()
@@ -0,0 +1,61 @@
+import pytest
+import requests
+
+from cloudbot.util import http, httpcache
+
+
+def key_for(kind, *args, **kwargs):
+    arguments = http.bind_arguments(http.open, args, kwargs)
+    return http.flight_key(kind, **arguments)
+
+
+def test_flight_key_positional_matches_keyword():
+    positional = key_for("json", "http://example.com/api", {"q": "x"}, "agent", None, None, None, False, 5,
+                         {"Accept": "application/json"})
+    keyword = key_for("json", "http://example.com/api", q="x", user_agent="agent", timeout=5,
+                      headers={"Accept": "application/json"})
+    assert positional == keyword
+    assert positional[4] == (("Accept", "application/json"),)
+
+
+def test_flight_key_not_shared():
+    assert key_for("json", "http://example.com/api", post_data="x") is None
+    assert key_for("json", "http://example.com/api", get_method="DELETE") is None
+    assert http.bind_arguments(http.open, (), {}) is None
+
+
+def test_mount_pools_closes_replaced_adapters():
+    session = http.Session()
+    old_adapters = [session.adapters[prefix] for prefix in ("http://", "https://")]
+    closed = []
+    for adapter in old_adapters:
+        adapter.close = lambda adapter=adapter: closed.append(adapter)
+    session.mount_pools(4, 4)
+    assert closed == old_adapters
+    session.close()
+
+
+def test_cache_key_varies_with_headers():
+    plain = httpcache.cache_key("http://example.com/")
+    json_key = httpcache.cache_key("http://example.com/", {"Accept": "application/json", "User-Agent": "a"})
+    assert plain == "http://example.com/"
+    assert json_key != httpcache.cache_key("http://example.com/", {"Accept": "text/html", "User-Agent": "a"})
+    # header names aren't case-sensitive, and header values aren't kept in the key
+    assert json_key == httpcache.cache_key("http://example.com/", {"user-agent": "a", "accept": "application/json"})
+    assert "application/json" not in json_key
+
+
+def test_client_errors_dont_trip_breaker(monkeypatch):
+    monkeypatch.setattr(http, "host_policies", {})
+    session = http.Session()
+    for _ in range(5):
+        with pytest.raises(requests.exceptions.InvalidHeader):
+            session.request("GET", "http://127.0.0.1:1/", headers={"X-Bad": "a\nb"})
+    policy = http.get_policy("127.0.0.1:1")
+    assert policy.failures == 0
+
+    # nothing listens on port 1, so this one is the host's fault
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.request("GET", "http://127.0.0.1:1/")
+    assert policy.failures == 1
+    session.close()
@@ -0,0 +1,58 @@
+import pytest
+
+from cloudbot.util import http, http_fixtures
+
+
+def record(path, url, body, status=200, headers=None):
+    store = http_fixtures.FixtureStore(str(path), mode=http_fixtures.RECORD)
+    store.save("GET", url, None, status, "OK", headers or {"Content-Type": "application/json"}, body)
+
+
+def test_replay(tmpdir):
+    record(tmpdir, "http://api.example.com/lookup?b=2&a=1", b'{"name": "test"}')
+
+    with http_fixtures.use_fixtures(str(tmpdir)):
+        # parameter order doesn't matter
+        assert http.get_json("http://api.example.com/lookup", a=1, b=2) == {"name": "test"}
+        assert http.session.get("http://api.example.com/lookup?a=1&b=2").json() == {"name": "test"}
+
+
+def test_replay_html_stream(tmpdir):
+    record(tmpdir, "http://pages.example.com/", b"<html><head><title>A page</title></head></html>",
+           headers={"Content-Type": "text/html; charset=utf-8"})
+
+    with http_fixtures.use_fixtures(str(tmpdir)):
+        page, url = http.get_html_stream("http://pages.example.com/", stop_tags=("title",))
+
+    assert page.findtext(".//title") == "A page"
+
+
+def test_missing_fixture(tmpdir):
+    with http_fixtures.use_fixtures(str(tmpdir)):
+        with pytest.raises(http.URLError):
+            http.get("http://missing.example.com/")
+
+
+def test_failure_injection(tmpdir):
+    record(tmpdir, "http://flaky.example.com/", b"{}")
+
+    def run():
+        results = []
+        http.reset_breaker("flaky.example.com")
+        with http_fixtures.use_fixtures(str(tmpdir), fail_rate=0.3, fail_status=503, seed=4):
+            for _ in range(20):
+                response = http.session.get("http://flaky.example.com/")
+                results.append(response.status_code)
+        return results
+
+    results = run()
+    # the same seed always fails the same requests
+    assert results == run()
+    assert set(results) == {200, 503}
+
+
+def test_fixtures_removed(tmpdir):
+    with http_fixtures.use_fixtures(str(tmpdir)):
+        pass
+    assert http_fixtures.active_store is None
+    assert not isinstance(http.session.get_adapter("http://example.com/"), http_fixtures.FixtureAdapter)
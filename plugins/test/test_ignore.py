@@ -0,0 +1,14 @@
+from plugins.ignore import IgnoreMatcher
+
+
+def test_channel_case_insensitive():
+    matcher = IgnoreMatcher(["#chan!*@*"])
+    assert matcher.is_ignored("#Chan", "nick!user@host")
+    assert matcher.is_ignored("#CHAN", "nick!user@host")
+    assert not matcher.is_ignored("#other", "nick!user@host")
+
+
+def test_mask_case_insensitive():
+    matcher = IgnoreMatcher(["*!*@Bad.Host"])
+    assert matcher.is_ignored("#chan", "Nick!User@BAD.host")
+    assert not matcher.is_ignored(None, "nick!user@good.host")
@@ -0,0 +1,41 @@
+from cloudbot.util.links import PreviewCache, RecentLinks
+
+
+def test_preview_expires():
+    cache = PreviewCache()
+    cache.put("hook|http://example.com/", ["title", "second line"], 60, now=1000)
+    assert cache.get("hook|http://example.com/", now=1030) == ("title", "second line")
+    assert cache.get("hook|http://example.com/", now=1061) is None
+
+
+def test_preview_persisted(tmpdir):
+    path = str(tmpdir.join("previews.db"))
+    cache = PreviewCache(path)
+    cache.put("hook|http://example.com/", ["title", "second line"], 60)
+    cache.close()
+
+    cache = PreviewCache(path)
+    assert cache.get("hook|http://example.com/") is None
+    assert cache.load("hook|http://example.com/") == ("title", "second line")
+    # loading it kept it in memory
+    assert cache.get("hook|http://example.com/") == ("title", "second line")
+    cache.close()
+
+
+def test_memory_bounded():
+    cache = PreviewCache(max_size=10)
+    for i in range(100):
+        cache.put("hook|http://example.com/{}".format(i), ["title"], 60)
+    assert len(cache._memory) == 10
+
+
+def test_recent_links_only_recorded_when_handled():
+    recent = RecentLinks(window=30)
+    key = ("esper", "#chan", "http://example.com/")
+    # seen but not handled, as when every url hook was sieved out
+    assert not recent.seen(key, now=0)
+    assert not recent.seen(key, now=1)
+    recent.record(key, now=1)
+    assert recent.seen(key, now=2)
+    assert recent.duplicates == 1
+    assert not recent.seen(key, now=31)
@@ -0,0 +1,30 @@
+import os
+
+from cloudbot.util.logfiles import LogIndex
+
+
+def make_logs(tmpdir, names):
+    year_dir = tmpdir.mkdir("2015")
+    for name in names:
+        year_dir.join(name).write("line\n")
+    return str(tmpdir)
+
+
+def test_private_logs_indexed(tmpdir):
+    log_dir = make_logs(tmpdir, ["snoonet_irc_#chan_20150601.log", "snoonet_irc_some_nick_20150601.log.gz",
+                                 "esper_nick_20150602.log"])
+    index = LogIndex(log_dir, ["snoonet_irc", "esper"])
+    index.scan(full=True)
+    files = {os.path.basename(rel_path): (entry["server"], entry["chan"]) for rel_path, entry in index.items()}
+    assert files == {
+        "snoonet_irc_#chan_20150601.log": ("snoonet_irc", "#chan"),
+        "snoonet_irc_some_nick_20150601.log.gz": ("snoonet_irc", "some_nick"),
+        "esper_nick_20150602.log": ("esper", "nick"),
+    }
+
+
+def test_private_logs_without_servers(tmpdir):
+    log_dir = make_logs(tmpdir, ["esper_some_nick_20150601.log"])
+    index = LogIndex(log_dir)
+    index.scan(full=True)
+    assert [(entry["server"], entry["chan"]) for _, entry in index.items()] == [("esper", "some_nick")]
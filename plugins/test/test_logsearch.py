@@ -0,0 +1,42 @@
+import sqlite3
+
+from cloudbot.util import logsearch
+
+old_schema = [
+    "create table log_lines (id integer primary key, time integer not null, server text not null, "
+    "chan text not null, nick text not null, kind integer not null, content text not null)",
+    "create virtual table log_lines_fts using fts5(content, chan_key, nick_key, content='')",
+    "create trigger log_lines_insert after insert on log_lines begin "
+    "insert into log_lines_fts (rowid, content, chan_key, nick_key) "
+    "values (new.id, new.content, hex(new.server || ' ' || new.chan), hex(lower(new.nick))); end",
+]
+
+
+def search(index, nick):
+    return [result.content for result in index.search("esper", "#chan", "hello", nick=nick)]
+
+
+def test_non_ascii_nick_search(tmpdir):
+    index = logsearch.LogSearchIndex(str(tmpdir.join("log_search.db")), flush_interval=0)
+    index.add(1, "esper", "#chan", "ÄNick", logsearch.MESSAGE, "hello there")
+    index.add(2, "esper", "#chan", "Other", logsearch.MESSAGE, "hello again")
+    index.close()
+    assert search(index, "änick") == ["hello there"]
+    assert search(index, "ÄNICK") == ["hello there"]
+    assert search(index, "other") == ["hello again"]
+
+
+def test_old_index_upgraded(tmpdir):
+    path = str(tmpdir.join("log_search.db"))
+    db = sqlite3.connect(path)
+    for statement in old_schema:
+        db.execute(statement)
+    db.execute("insert into log_lines (time, server, chan, nick, kind, content) "
+               "values (1, 'esper', '#chan', 'ÄNick', 0, 'hello there')")
+    db.commit()
+    db.close()
+
+    index = logsearch.LogSearchIndex(path, flush_interval=0)
+    index.add(2, "esper", "#chan", "änick", logsearch.MESSAGE, "hello again")
+    index.close()
+    assert search(index, "Änick") == ["hello again", "hello there"]
@@ -0,0 +1,49 @@
+from fnmatch import fnmatchcase
+
+from cloudbot.util.masks import MaskMatcher
+
+patterns = [
+    "*!*@host.example.com",
+    "nick!*@*",
+    "*!ident@*.isp.net",
+    "exact!user@literal.org",
+    "n?ck!*@*",
+    "*!*@[0-9]*.dynamic.net",
+    "*!*@a.b(c)+d",
+]
+
+masks = [
+    "someone!~user@host.example.com",
+    "nick!anything@anywhere",
+    "other!ident@dsl.isp.net",
+    "other!ident@isp.net",
+    "exact!user@literal.org",
+    "exact!user@literal.org.uk",
+    "neck!x@y",
+    "x!y@7abc.dynamic.net",
+    "x!y@abc.dynamic.net",
+    "x!y@a.b(c)+d",
+    "unmatched!user@1.2.3.4",
+]
+
+
+def test_matches_like_fnmatch():
+    matcher = MaskMatcher(patterns)
+    for mask in masks:
+        expected = any(fnmatchcase(mask, pattern) for pattern in patterns)
+        assert matcher.match(mask) == expected, mask
+        # and again, answered from the cache
+        assert matcher.match(mask) == expected, mask
+
+
+def test_empty():
+    matcher = MaskMatcher([])
+    assert not matcher
+    assert not matcher.match("nick!user@host")
+
+
+def test_cache_is_bounded():
+    matcher = MaskMatcher(["*!*@bad.host"], cache_size=10)
+    for i in range(100):
+        matcher.match("nick{}!user@host".format(i))
+    assert len(matcher._cache) == 10
@@ -0,0 +1,74 @@
+import sqlite3
+import time
+
+import pytest
+
+from plugins import quote
+
+
+@pytest.fixture
+def db():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("create table quote (chan, nick, add_nick, msg, time real, deleted default 0, "
+                 "primary key (chan, nick, msg))")
+    conn.execute("insert into quote (chan, nick, add_nick, msg, time) values ('#chan', 'ÄNick', 'adder', 'old', 1)")
+    for migration in (quote.add_nick_lower, quote.create_indexes, quote.create_live_indexes,
+                      quote.add_sequences):
+        migration(conn)
+    quote.quote_counts.clear()
+    yield conn
+    conn.close()
+
+
+def test_non_ascii_nick_backfilled(db):
+    assert quote.get_quote_by_nick(db, "änick", 1) == "[1/1] <ÄNick> old"
+
+
+def test_numbered_quotes(db):
+    for i in range(5):
+        quote.add_quote(db, "#chan", "nick", "adder", "quote {}".format(i))
+    assert quote.get_quote_by_nick(db, "NICK", 1) == "[1/5] <nick> quote 0"
+    assert quote.get_quote_by_nick(db, "nick", 4) == "[4/5] <nick> quote 3"
+    assert quote.get_quote_by_nick(db, "nick", -1) == "[5/5] <nick> quote 4"
+    assert quote.get_quote_by_chan(db, "#chan", 1) == "[1/6] <ÄNick> old"
+    # errors are returned for the command to reply with
+    assert str(quote.get_quote_by_nick(db, "nick", 6)) == "I only have 5 quotes for nick."
+
+    quote.del_quote(db, "#chan", "nick", "quote 0")
+    assert quote.get_quote_by_nick(db, "nick", 1) == "[1/4] <nick> quote 1"
+    assert quote.get_quote_by_nick_chan(db, "#chan", "nick", -1) == "[4/4] <nick> quote 4"
+    # the channel's quotes after the deleted one were renumbered too
+    assert quote.get_quote_by_chan(db, "#chan", 2) == "[2/5] <nick> quote 1"
+
+    # nothing relies on the cached counts
+    quote.quote_counts.clear()
+    assert quote.get_quote_by_chan(db, "#chan", -1) == "[5/5] <nick> quote 4"
+
+
+def test_stale_count_retried(db):
+    quote.add_quote(db, "#chan", "nick", "adder", "only")
+    assert quote.get_quote_by_nick(db, "nick") == "[1/1] <nick> only"
+    # deleted behind the cache's back, as another process would
+    db.execute("update quote set deleted = 1 where msg = 'only'")
+    db.commit()
+    assert str(quote.get_quote_by_nick(db, "nick", 1)) == "No quotes found for nick."
+
+
+def test_large_key(db):
+    count = 100000
+    db.executemany("insert into quote (chan, nick, nick_lower, add_nick, msg, time) values (?, ?, ?, ?, ?, ?)",
+                   (("#big", "nick", "nick", "adder", "quote {}".format(i), i) for i in range(count)))
+    quote.add_sequences(db)
+
+    plan = db.execute("explain query plan select time, nick, msg from quote where chan = ? and deleted != 1 "
+                      "and chan_seq = ?", ("#big", 1)).fetchall()
+    assert "quote_chan_seq_idx (chan=? AND chan_seq=?)" in str(plan)
+
+    start = time.perf_counter()
+    for num in range(1, count + 1, count // 1000):
+        assert quote.get_quote_by_chan(db, "#big", num) == "[{}/{}] <nick> quote {}".format(num, count, num - 1)
+    elapsed = time.perf_counter() - start
+    # the only thing remembered is the key's count, not its quotes
+    assert quote.quote_counts[("#big", None)] == count
+    # 1000 lookups, each a single index seek; well under 0.1ms each on a laptop
+    assert elapsed < 1
@@ -0,0 +1,57 @@
+from cloudbot.util import ratelimit
+from cloudbot.util.ratelimit import RateLimiter
+
+
+def test_user_limited_before_channel():
+    limiter = RateLimiter({"user": (10, 0.001), "channel": (30, 0.001)})
+    assert limiter.check("esper", "#chan", "spammer", "help", 5) is None
+    assert limiter.check("esper", "#chan", "spammer", "help", 5) is None
+    assert limiter.check("esper", "#chan", "spammer", "help", 5) == "user"
+    # the channel still has budget left for everyone else
+    assert limiter.check("esper", "#chan", "someone", "help", 5) is None
+    assert limiter.get_stats()["limited"] == {"user": 1}
+
+
+def test_limited_use_costs_nothing():
+    limiter = RateLimiter({"user": (100, 0.001), "channel": (10, 0.001), "connection": None})
+    assert limiter.check("esper", "#chan", "a", "help", 10) is None
+    assert limiter.check("esper", "#chan", "a", "help", 10) == "channel"
+    # being stopped by the channel limit didn't take anything from the user's bucket
+    assert limiter.check("esper", None, "a", "help", 90) is None
+
+
+def test_command_budget_and_cost():
+    limiter = RateLimiter(commands={"wa": {"tokens": 10, "restore_rate": 0.001, "cost": 10}})
+    cost = limiter.get_cost("wa", 3)
+    assert cost == 10
+    assert limiter.check("esper", "#chan", "a", "wa", cost) is None
+    assert limiter.check("esper", "#other", "b", "wa", cost) == "command"
+
+
+def test_idle_buckets_dropped():
+    limiter = RateLimiter({"user": (10, 1e6), "channel": (10, 1e6), "connection": (10, 1e6)})
+    for i in range(100):
+        limiter.check("esper", None, "user{}".format(i), "help", 1)
+    # every bucket refills in microseconds, so only the latest are still kept
+    assert limiter.get_stats()["buckets"]["user"] < 100
+
+
+def test_buckets_bounded():
+    limiter = RateLimiter(max_buckets=10)
+    for i in range(100):
+        limiter.check("esper", None, "user{}".format(i), "help", 1)
+    assert limiter.get_stats()["buckets"]["user"] == 10
+
+
+def test_only_users_limited_by_default():
+    limiter = RateLimiter()
+    for i in range(100):
+        assert limiter.check("esper", "#chan", "user{}".format(i), "help", 5) is None
+    assert limiter.get_stats()["buckets"] == {"user": 100, "channel": 0, "connection": 0, "command": 0}
+
+
+def test_configured_limits():
+    ratelimit.configure({"ratelimit": {"channel": {"tokens": 30}, "connection": False}})
+    assert ratelimit.limiter.limits == {"user": (10, 1), "channel": (30, 4), "connection": None}
+    ratelimit.configure({})
+    assert ratelimit.limiter.limits == ratelimit.default_limits
@@ -0,0 +1,27 @@
+from cloudbot.util import web
+
+
+class CountingShortener(web.Shortener):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def shorten(self, url, custom=None):
+        self.calls.append(url)
+        return url.replace("http://example.com/", "http://s/")
+
+
+def test_shorten_many_counts_each_hit_once(monkeypatch):
+    shortener = CountingShortener()
+    monkeypatch.setitem(web.shorteners, "counting", shortener)
+    monkeypatch.setattr(web, "shorten_cache", web.ShortenerCache())
+
+    urls = ["http://example.com/{}".format(i) for i in range(5)]
+    assert web.shorten_many(urls[:2], "counting") == ["http://s/0", "http://s/1"]
+    assert web.shorten_many(urls + urls[:1], "counting") == ["http://s/{}".format(i) for i in range(5)] + ["http://s/0"]
+
+    # each URL was only ever shortened once, and only the two cached ones counted as hits, once each
+    assert sorted(shortener.calls) == sorted(urls)
+    stats = web.get_shorten_stats()["counting"]
+    assert stats["requests"] == 5
+    assert stats["memory_hits"] == 2
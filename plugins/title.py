@@ -1,5 +1,3 @@
-from bs4 import BeautifulSoup
-
 from cloudbot import hook
 from cloudbot.util import http, urlnorm
 
@@ -10,15 +8,13 @@ def title(text):
     url = urlnorm.normalize(text, assume_scheme="http")
 
     try:
-        page = http.open(url)
-        real_url = page.geturl()
-        soup = BeautifulSoup(page.read())
+        page, real_url = http.get_html_stream(url, stop_tags=("title", "head"))
     except (http.HTTPError, http.URLError):
         return "Could not fetch page."
 
-    page_title = soup.find('title').contents[0]
+    page_title = page.findtext(".//title")
 
-    if not page_title:
+    if not page_title or not page_title.strip():
         return "Could not find title."
 
-    return "{} [{}]".format(page_title, real_url)
+    return "{} [{}]".format(" ".join(page_title.split()), real_url)
@@ -11,7 +11,7 @@ def get_episodes_for_series(series_name, api_key):
     res = {"error": None, "ended": False, "episodes": None, "name": None}
     # http://thetvdb.com/wiki/index.php/API:GetSeries
     try:
-        query = http.get_xml(base_url + 'GetSeries.php', seriesname=series_name)
+        query = http.get_xml(base_url + 'GetSeries.php', seriesname=series_name, cache=3600)
     except http.URLError:
         res["error"] = "error contacting thetvdb.com"
         return res
@@ -25,7 +25,7 @@ def get_episodes_for_series(series_name, api_key):
     series_id = series_id[0]
 
     try:
-        series = http.get_xml(base_url + '%s/series/%s/all/en.xml' % (api_key, series_id))
+        series = http.get_xml(base_url + '%s/series/%s/all/en.xml' % (api_key, series_id), cache=3600)
     except http.URLError:
         res["error"] = "Error contacting thetvdb.com."
         return res
@@ -30,7 +30,7 @@ def truncate(msg):
         return out + "..."
 
 
-@hook.regex(multitwitch_re)
+@hook.url("multitwitch.tv", pattern=multitwitch_re, preview_ttl=60)
 def multitwitch_url(match):
     usernames = match.group(3).split("/")
     out = ""
@@ -45,7 +45,7 @@ def multitwitch_url(match):
     return out
 
 
-@hook.regex(twitch_re)
+@hook.url("twitch.tv", pattern=twitch_re, preview_ttl=60)
 def twitch_url(match):
     bit = match.group(4).split("#")[0]
     location = "/".join(bit.split("/")[1:])
@@ -80,10 +80,10 @@ def twitch_lookup(location):
     fmt = "{}: {} playing {} ({})"  # Title: nickname playing Game (x views)
     if type and id:
         if type == "b":  # I haven't found an API to retrieve broadcast info
-            soup = http.get_soup("http://twitch.tv/" + location)
-            title = soup.find('span', {'class': 'real_title js-title'}).text
-            playing = soup.find('a', {'class': 'game js-game'}).text
-            views = soup.find('span', {'id': 'views-count'}).text + " view"
+            page, _ = http.get_html_stream("http://twitch.tv/" + location, max_size=1024 * 1024)
+            title = page.xpath("//span[@class='real_title js-title']")[0].text_content()
+            playing = page.xpath("//a[@class='game js-game']")[0].text_content()
+            views = page.xpath("//span[@id='views-count']")[0].text_content() + " view"
             views = views + "s" if not views[0:2] == "1 " else views
             return h.unescape(fmt.format(title, channel, playing, views))
         elif type == "c":
@@ -8,6 +8,8 @@ from twitter.api import TwitterHTTPError
 from cloudbot import hook
 from cloudbot.util import timesince
 
+twitter_re = re.compile(r"(?:(?:www.twitter.com|twitter.com)/(?:[-_a-zA-Z0-9]+)/status/)([0-9]+)", re.I)
+
 
 @hook.onload()
 def load_api(bot):
@@ -42,7 +44,7 @@ def format_tweet(tweet):
     return "{}@\x02{}\x02 ({}): {} ({} ago)".format(prefix, user["screen_name"], user["name"], text, _time)
 
 
-@hook.regex(re.compile(r"(?:(?:www.twitter.com|twitter.com)/(?:[-_a-zA-Z0-9]+)/status/)([0-9]+)", re.I))
+@hook.url("twitter.com", pattern=twitter_re)
 def twitter_url(match):
     if tw_api is None:
         return
@@ -27,7 +27,7 @@ def urban(text):
             id_num = 1
 
         # fetch the definitions
-        page = http.get_json(define_url, term=text, referer="http://m.urbandictionary.com")
+        page = http.get_json(define_url, term=text, referer="http://m.urbandictionary.com", cache=3600)
 
         if page['result_type'] == 'no_results':
             return 'Not found.'
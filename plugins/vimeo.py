@@ -2,7 +2,7 @@ from cloudbot import hook
 from cloudbot.util import http, timeformat
 
 
-@hook.regex(r'vimeo.com/([0-9]+)')
+@hook.url("vimeo.com", pattern=r'vimeo.com/([0-9]+)')
 def vimeo_url(match):
     """vimeo <url> -- returns information on the Vimeo video at <url>"""
     info = http.get_json('http://vimeo.com/api/v2/video/%s.json'
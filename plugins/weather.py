@@ -43,7 +43,7 @@ def weather(text, reply, db, nick, bot, notice):
     location = http.quote_plus(loc)
 
     request_url = base_url.format(api_key, "geolookup/forecast/conditions", location)
-    response = http.get_json(request_url)
+    response = http.get_json(request_url, cache=600)
 
     if 'location' not in response:
         try:
@@ -53,7 +53,7 @@ def weather(text, reply, db, nick, bot, notice):
 
         # get the weather again, using the closest match
         request_url = base_url.format(api_key, "geolookup/forecast/conditions", "zmw:" + location_id)
-        response = http.get_json(request_url)
+        response = http.get_json(request_url, cache=600)
 
     if response['location']['state']:
         place_name = "\x02{}\x02, \x02{}\x02 (\x02{}\x02)".format(response['location']['city'],
@@ -86,7 +86,7 @@ def weather(text, reply, db, nick, bot, notice):
         "tomorrow_high_c": forecast_tomorrow['high']['celsius'],
         "tomorrow_low_f": forecast_tomorrow['low']['fahrenheit'],
         "tomorrow_low_c": forecast_tomorrow['low']['celsius'],
-        "url": web.isgd(response["current_observation"]['forecast_url'] + "?apiref=e535207ff4757b18")
+        "url": web.try_shorten(response["current_observation"]['forecast_url'] + "?apiref=e535207ff4757b18")
     }
 
     reply("{place} - \x02Current:\x02 {conditions}, {temp_f}F/{temp_c}C, {humidity}, "
@@ -16,7 +16,7 @@ paren_re = re.compile('\s*\(.*\)$')
 def wiki(text):
     """wiki <phrase> -- Gets first sentence of Wikipedia article on <phrase>."""
 
-    x = http.get_xml(search_url, search=text)
+    x = http.get_xml(search_url, search=text, cache=3600)
 
     ns = '{http://opensearch.org/searchsuggest2}'
     items = x.findall(ns + 'Section/' + ns + 'Item')
@@ -4,7 +4,7 @@ from cloudbot import hook
 from cloudbot.util import http, web, formatting
 
 
-@hook.command("wa", "calc", "math", "wolframalpha")
+@hook.command("wa", "calc", "math", "wolframalpha", cost=10)
 def wolframalpha(text, bot):
     """wa <query> -- Computes <query> using Wolfram Alpha."""
     api_key = bot.config.get("api_keys", {}).get("wolframalpha", None)
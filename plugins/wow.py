@@ -9,16 +9,14 @@ armoury, armory: Request data from the armoury API and format it into something
 
 import re
 
-import requests
-
 from cloudbot import hook
-from cloudbot.util import web
+from cloudbot.util import http, web
 
 
 def wow_armoury_data(link):
     """Sends the API request, and returns the data accordingly (in json if raw, nicely formatted if not)."""
     try:
-        data = requests.get(link)
+        data = http.session.get(link)
     except Exception as e:
         return 'Unable to fetch information for {}. Does the realm or character exist? ({})'.format(link, str(e))
 
@@ -10,7 +10,7 @@ months = {1: 'January', 2: 'February', 3: 'March', 4: 'April', 5: 'May', 6: 'Jun
 
 def xkcd_info(xkcd_id, url=False):
     """ takes an XKCD entry ID and returns a formatted string """
-    data = http.get_json("http://www.xkcd.com/" + xkcd_id + "/info.0.json")
+    data = http.get_json("http://www.xkcd.com/" + xkcd_id + "/info.0.json", cache=86400)
     date = "{} {} {}".format(data['day'], months[int(data['month'])], data['year'])
     if url:
         url = " | http://xkcd.com/" + xkcd_id.replace("/", "")
@@ -31,7 +31,7 @@ def xkcd_search(term):
         return "No results found!"
 
 
-@hook.regex(xkcd_re)
+@hook.url("xkcd.com", pattern=xkcd_re, preview_ttl=86400)
 def xkcd_url(match):
     xkcd_id = match.group(3).split(" ")[0].split("/")[1]
     return xkcd_info(xkcd_id)
@@ -17,7 +17,7 @@ def plural(num=0, text=''):
 
 
 def get_video_description(video_id):
-    request = http.get_json(api_url.format(video_id))
+    request = http.get_json(api_url.format(video_id), cache=600)
 
     if request.get('error'):
         return
@@ -46,8 +46,8 @@ def get_video_description(video_id):
         out += ' - \x02{:,}\x02 view{}'.format(views, "s"[views == 1:])
 
     try:
-        uploader = http.get_json(base_url + "users/{}?alt=json".format(data["uploader"]))["entry"]["author"][0]["name"][
-            "$t"]
+        user = http.get_json(base_url + "users/{}?alt=json".format(data["uploader"]), cache=3600)
+        uploader = user["entry"]["author"][0]["name"]["$t"]
     except:
         uploader = data["uploader"]
 
@@ -61,7 +61,7 @@ def get_video_description(video_id):
     return out
 
 
-@hook.regex(youtube_re)
+@hook.url("youtube.com", "youtu.be", "yooouuutuuube.com", pattern=youtube_re, preview_ttl=3600)
 def youtube_url(match):
     return get_video_description(match.group(1))
 
@@ -118,7 +118,7 @@ def youtime(text):
 ytpl_re = re.compile(r'(.*:)//(www.youtube.com/playlist|youtube.com/playlist)(:[0-9]+)?(.*)', re.I)
 
 
-@hook.regex(ytpl_re)
+@hook.url("youtube.com", pattern=ytpl_re)
 def ytplaylist_url(match):
     location = match.group(4).split("=")[-1]
     try: